@@ -0,0 +1,45 @@
+"""Runs the http api for converting geometries without the streamlit UI, see `mapa_streamlit/api.py`.
+
+Usage: python api.py
+"""
+import logging
+import os
+import sys
+
+from mapa_streamlit.api import ApiServer
+from mapa_streamlit.caching import get_cache_dir
+from mapa_streamlit.cleaning import Janitor
+from mapa_streamlit.jobs import JobManager
+from mapa_streamlit.prewarming import Prewarmer
+from mapa_streamlit.settings import DISK_CLEANING_THRESHOLD, MAX_WORKERS
+from mapa_streamlit.tiles import get_tile_dir
+
+log = logging.getLogger(__name__)
+
+
+def main() -> int:
+    logging.basicConfig(level=os.getenv("MAPA_STREAMLIT_LOG_LEVEL", "INFO"))
+    cache_dir = get_cache_dir()
+    # the api shares the cache directory with the app, hence results computed by either of them are reused
+    janitor = Janitor(path=cache_dir, tile_path=get_tile_dir(cache_dir), disk_cleaning_threshold=DISK_CLEANING_THRESHOLD)
+    job_manager = JobManager(path=cache_dir, max_workers=MAX_WORKERS)
+    server = ApiServer(path=cache_dir, job_manager=job_manager)
+    prewarmer = Prewarmer(path=cache_dir, job_manager=job_manager)
+    janitor.start()
+    prewarmer.start()
+    server.start()
+    try:
+        if server.is_serving():
+            server.join()
+    except KeyboardInterrupt:
+        log.info("👋  shutting down")
+    finally:
+        server.stop()
+        janitor.stop()
+        prewarmer.stop()
+        job_manager.shutdown()
+    return 0 if server.error is None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
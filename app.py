@@ -1,39 +1,66 @@
 import datetime
 import logging
 import os
-from typing import List
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Union
 
-import folium
 import streamlit as st
-from folium.plugins import Draw
-from mapa import convert_bbox_to_stl
-from mapa.caching import get_hash_of_geojson
-from mapa.utils import TMPDIR
-from streamlit_folium import st_folium
 
-from mapa_streamlit.cleaning import run_cleanup_job
+from mapa_streamlit.admission import JobRejected
+from mapa_streamlit.caching import ResultCache, get_cache_dir, get_elevation_hash, get_result_key
+from mapa_streamlit.cleaning import Janitor, cache_exceeds_quota
+from mapa_streamlit.download import DownloadServer, get_download_url
+from mapa_streamlit.drawings import DrawingIndex
+from mapa_streamlit.estimation import CostEstimate, estimate_cost
+from mapa_streamlit.jobs import JobManager, JobStatus, fetch_elevation, get_fetch_job_id, run_conversion
+from mapa_streamlit.metrics import Metrics
+from mapa_streamlit.prewarming import AccessLog, Prewarmer
 from mapa_streamlit.settings import (
-    ABOUT,
     BTN_LABEL_CREATE_STL,
     BTN_LABEL_DOWNLOAD_STL,
+    BTN_LABEL_PREVIEW,
+    DEFAULT_COMPRESSION,
+    DEFAULT_OUTPUT_FORMAT,
     DEFAULT_TILING_FORMAT,
     DISK_CLEANING_THRESHOLD,
+    DOWNLOAD_LINK_STYLE,
+    DOWNLOAD_URL,
+    ELEVATION_SOURCE,
+    JOB_POLLING_INTERVAL,
     MAP_CENTER,
     MAP_ZOOM,
-    MAX_ALLOWED_AREA_SIZE,
+    MAX_WORKERS,
+    PREVIEW_CACHE_ENTRIES,
+    CompressionSelect,
     ModelSizeSlider,
+    OutputFormatSelect,
     SquaredCheckbox,
     TilingSelect,
+    ToleranceSlider,
     ZOffsetSlider,
     ZScaleSlider,
+    get_about,
 )
-from mapa_streamlit.verification import selected_bbox_in_boundary, selected_bbox_too_large
+from mapa_streamlit.tiles import get_tile_dir
+from mapa_streamlit.verification import exceeded_cost_limits, selected_bbox_in_boundary
+
+if TYPE_CHECKING:
+    import folium
+
+    from mapa_streamlit.preview import Preview
 
 log = logging.getLogger(__name__)
 log.setLevel(os.getenv("MAPA_STREAMLIT_LOG_LEVEL", "DEBUG"))
 
 
-def _show_map(center: List[float], zoom: int) -> folium.Map:
+@st.cache_resource
+def _show_map(center: List[float], zoom: int) -> "folium.Map":
+    # the map is static, hence it is built once per server instead of on every rerun. Folium is only imported here,
+    # so the page is painted before the map is built
+    import folium
+    from folium.plugins import Draw
+
     m = folium.Map(
         location=center,
         zoom_start=zoom,
@@ -57,72 +84,248 @@ def _show_map(center: List[float], zoom: int) -> folium.Map:
     return m
 
 
-def _compute_stl(geometry: dict, progress_bar: st.progress) -> None:
-    geo_hash = get_hash_of_geojson(geometry)
-    mapa_cache_dir = TMPDIR()
-    run_cleanup_job(path=mapa_cache_dir, disk_cleaning_threshold=DISK_CLEANING_THRESHOLD)
-    path = mapa_cache_dir / geo_hash
-    progress_bar.progress(0)
-    convert_bbox_to_stl(
-        bbox_geometry=geometry,
+@st.cache_resource
+def _get_job_manager() -> JobManager:
+    # a single pool of worker processes is shared by all sessions of this server
+    return JobManager(path=get_cache_dir(), max_workers=MAX_WORKERS)
+
+
+@st.cache_resource
+def _get_janitor() -> Janitor:
+    # started once per server, cleans up the cache directory off the request path
+    janitor = Janitor(
+        path=get_cache_dir(), tile_path=get_tile_dir(get_cache_dir()), disk_cleaning_threshold=DISK_CLEANING_THRESHOLD
+    )
+    janitor.start()
+    return janitor
+
+
+@st.cache_resource
+def _get_prewarmer() -> Prewarmer:
+    # started once per server, precomputes popular regions while no user is waiting for a job
+    prewarmer = Prewarmer(path=get_cache_dir(), job_manager=_get_job_manager())
+    prewarmer.start()
+    return prewarmer
+
+
+@st.cache_resource
+def _get_download_server() -> DownloadServer:
+    # started once per server, streams finished archives to the browser
+    download_server = DownloadServer(path=get_cache_dir())
+    download_server.start()
+    return download_server
+
+
+@st.cache_resource
+def _get_metrics() -> Metrics:
+    return Metrics(get_cache_dir())
+
+
+def _compute_stl(geometry: dict) -> None:
+    metrics = _get_metrics()
+    params = dict(
         model_size=ModelSizeSlider.value if model_size is None else model_size,
         z_scale=ZScaleSlider.value if z_scale is None else z_scale,
         z_offset=ZOffsetSlider.value if z_offset is None else z_offset,
         ensure_squared=ensure_squared,
-        output_file=path,
-        progress_bar=progress_bar,
         split_area_in_tiles=DEFAULT_TILING_FORMAT if tiling_option is None else tiling_option,
+        tolerance=ToleranceSlider.value if tolerance is None else tolerance,
+        output_format=DEFAULT_OUTPUT_FORMAT if output_format is None else output_format,
+        compression=DEFAULT_COMPRESSION if compression is None else compression,
+        elevation_source=ELEVATION_SOURCE,
     )
-    # it is important to spawn this success message in the sidebar, because state will get lost otherwise
-    st.sidebar.success("Successfully computed STL file!")
+    with metrics.span("result_key"):
+        result_key = get_result_key(geometry, **params)
+    mapa_cache_dir = get_cache_dir()
+    with metrics.span("access_log"):
+        AccessLog(mapa_cache_dir).record(geometry, params)
+    result_cache = ResultCache(mapa_cache_dir)
+    with metrics.span("cache_lookup"):
+        found = result_cache.lookup(result_key)
+    if found:
+        st.sidebar.success("Found STL file in cache!")
+        return
+    with metrics.span("cache_quota"):
+        if cache_exceeds_quota(mapa_cache_dir, disk_cleaning_threshold=DISK_CLEANING_THRESHOLD):
+            _get_janitor().wake_up()
+    with metrics.span("estimate"):
+        estimate = estimate_cost(
+            geometry, ensure_squared=params["ensure_squared"], split_area_in_tiles=params["split_area_in_tiles"]
+        )
+    try:
+        with metrics.span("submit"):
+            job_id = _get_job_manager().submit(
+                result_key, run_conversion, geometry, result_key, mapa_cache_dir, params, memory=estimate.peak_memory
+            )
+    except JobRejected as e:
+        log.warning(f"⛔️  {e}")
+        st.sidebar.error(
+            "Converting the selected region would need more memory than this server can provide. Please select a "
+            "smaller region or split the output into more tiles."
+        )
+        return
+    if "jobs" not in st.session_state:
+        st.session_state.jobs = []
+    if job_id not in st.session_state.jobs:
+        st.session_state.jobs.append(job_id)
 
 
-def _check_area_and_compute_stl(folium_output: dict, geo_hash: str, progress_bar: st.progress) -> None:
-    all_drawings_dict = {
-        get_hash_of_geojson(draw["geometry"]): draw["geometry"] for draw in folium_output["all_drawings"]
-    }
-    geometry = all_drawings_dict[geo_hash]
-    if selected_bbox_too_large(geometry, threshold=MAX_ALLOWED_AREA_SIZE):
+def _check_area(geometry: dict) -> bool:
+    estimate = estimate_cost(
+        geometry,
+        ensure_squared=ensure_squared,
+        split_area_in_tiles=DEFAULT_TILING_FORMAT if tiling_option is None else tiling_option,
+    )
+    exceeded = exceeded_cost_limits(estimate)
+    if exceeded:
+        _get_metrics().increment("selections_rejected_total", reason="cost_limits")
         st.sidebar.warning(
-            "Selected region is too large, fetching data for this area would consume too many resources. "
+            f"Selected region is too large, converting this area would exceed the limits of: {', '.join(exceeded)}. "
             "Please select a smaller region."
         )
+        return False
     elif not selected_bbox_in_boundary(geometry):
+        _get_metrics().increment("selections_rejected_total", reason="boundary")
         st.sidebar.warning(
             "Selected rectangle is not within the allowed region of the world map. Do not scroll too far to the left or "
             "right. Ensure to use the initial center view of the world for drawing your rectangle."
         )
+        return False
+    return True
+
+
+def _check_area_and_compute_stl(geometry: dict) -> None:
+    with _get_metrics().span("check_area"):
+        area_ok = _check_area(geometry)
+    if area_ok:
+        _compute_stl(geometry)
+
+
+def _check_area_and_fetch_elevation(geometry: dict) -> None:
+    # the elevation data is cached, hence the preview as well as the subsequent STL generation are fast afterwards.
+    # It is fetched by a worker process, so the script thread is not blocked by large downloads
+    if not _check_area(geometry):
+        return
+    estimate = estimate_cost(
+        geometry,
+        ensure_squared=ensure_squared,
+        split_area_in_tiles=DEFAULT_TILING_FORMAT if tiling_option is None else tiling_option,
+    )
+    try:
+        job_id = _get_job_manager().submit(
+            get_fetch_job_id(geometry, ELEVATION_SOURCE),
+            fetch_elevation,
+            geometry,
+            get_cache_dir(),
+            ELEVATION_SOURCE,
+            memory=estimate.fetch_memory,
+        )
+    except JobRejected as e:
+        log.warning(f"⛔️  {e}")
+        st.sidebar.error("Fetching the elevation data would need more memory than this server can provide.")
+        return
+    st.session_state.fetch_job = job_id
+
+
+def _show_fetch_status(state, slot: st.empty) -> bool:
+    """Shows the status of the elevation data fetched for the preview. Returns whether it is still in progress."""
+
+    job_id = state.get("fetch_job")
+    if job_id is None:
+        return False
+    job_manager = _get_job_manager()
+    status = job_manager.status(job_id)
+    if status in (JobStatus.QUEUED, JobStatus.PENDING, JobStatus.RUNNING):
+        slot.info("Fetching elevation data...")
+        return True
+    state.fetch_job = None
+    if status == JobStatus.FAILED:
+        log.error(f"⛔️  fetching elevation data failed: {job_manager.error(job_id)}")
+        st.sidebar.error("Fetching the elevation data failed, please try again.")
+    return False
+
+
+def _show_estimate(slot: st.empty, estimate: CostEstimate) -> None:
+    text = (
+        f"Estimated cost: {estimate.area:,.0f} km² with {estimate.dem_pixels / 1e6:.1f} M elevation data points, "
+        f"{estimate.fetch_size / 1024**2:,.0f} MB to download, {estimate.peak_memory / 1024**2:,.0f} MB memory, "
+        f"{estimate.triangles / 1e6:.1f} M triangles and {estimate.output_size / 1024**2:,.0f} MB of STL files."
+    )
+    if exceeded_cost_limits(estimate):
+        slot.warning(f"{text} This exceeds the limits, please select a smaller region.")
     else:
-        _compute_stl(geometry, progress_bar)
+        slot.caption(text)
+
+
+@st.cache_data(max_entries=PREVIEW_CACHE_ENTRIES, show_spinner=False)
+def _get_preview(elevation_hash: str, geometry: dict, params: dict) -> "Preview":
+    # the preview only depends on the elevation data, identified by its hash, and the customization options, hence it
+    # is computed once instead of on every rerun, e.g. while polling the status of running jobs
+    from mapa_streamlit.preview import get_preview
 
+    return get_preview(geometry, get_cache_dir(), **params)
 
-def _download_btn(data: str, disabled: bool) -> None:
-    st.sidebar.download_button(
-        label=BTN_LABEL_DOWNLOAD_STL,
-        data=data,
-        file_name=f'{datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}_mapa-streamlit.zip',
-        disabled=disabled,
+
+def _show_preview(slot: st.empty, geometry: dict, params: dict) -> None:
+    # the preview is only shown once the elevation data was fetched
+    from mapa_streamlit.conversion import elevation_for_bbox_is_cached
+
+    elevation_hash = get_elevation_hash(geometry, params["elevation_source"])
+    if not elevation_for_bbox_is_cached(elevation_hash, get_cache_dir()):
+        return
+    preview = _get_preview(elevation_hash, geometry, params)
+    slot.image(
+        preview.image,
+        caption=f"Preview of the 3D model with approx. {preview.x:.0f} x {preview.y:.0f} x {preview.z:.0f} mm",
+        use_column_width=True,
     )
 
 
-def _get_active_drawing_hash(state, drawings: List[str]) -> str:
-    # update state initially
-    if "drawings" not in state:
-        state.drawings = []
-    if "active_drawing" not in state:
-        state.active_drawing = None
-
-    old_drawings = state.drawings
-    for d in drawings:
-        if d not in old_drawings:
-            active_drawing = d
-            state.drawings = drawings
-            state.active_drawing = active_drawing
-            log.debug(f"🎨  found new active_drawing: {active_drawing}")
-            return active_drawing
+def _show_job_status(state, progress_bar: st.progress) -> bool:
+    """Shows the progress of the jobs submitted by this session. Returns whether any of them is still in progress."""
+
+    job_manager = _get_job_manager()
+    in_progress = False
+    for job_id in list(state.get("jobs", [])):
+        status = job_manager.status(job_id)
+        if status == JobStatus.QUEUED:
+            st.sidebar.info("Server is busy, your STL file will be computed as soon as enough memory is available.")
+            in_progress = True
+            continue
+        if status in (JobStatus.PENDING, JobStatus.RUNNING):
+            progress_bar.progress(job_manager.progress(job_id))
+            in_progress = True
+            continue
+        state.jobs.remove(job_id)
+        # it is important to spawn these messages in the sidebar, because state will get lost otherwise
+        if status == JobStatus.DONE:
+            st.sidebar.success("Successfully computed STL file!")
+        elif status == JobStatus.FAILED:
+            log.error(f"⛔️  job {job_id} failed: {job_manager.error(job_id)}")
+            st.sidebar.error("Computing the STL file failed, please try again.")
+    return in_progress
+
+
+def _download_btn(slot: st.empty, output_file: Union[None, Path]) -> None:
+    file_name = f'{datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}_mapa-streamlit.zip'
+    if output_file is None or not output_file.is_file():
+        slot.download_button(label=BTN_LABEL_DOWNLOAD_STL, data=b"None", file_name=file_name, disabled=True)
+    elif DOWNLOAD_URL and _get_download_server().is_serving():
+        # the archive is streamed by the download server once the link is clicked, instead of being read on every rerun
+        slot.markdown(
+            f'<a href="{get_download_url(output_file, file_name)}" download="{file_name}" target="_self" '
+            f'style="{DOWNLOAD_LINK_STYLE}">{BTN_LABEL_DOWNLOAD_STL}</a>',
+            unsafe_allow_html=True,
+        )
     else:
-        log.debug(f"💾  no new drawing found, returning last active drawing from state: {state.active_drawing}")
-        return state.active_drawing
+        with open(output_file, "rb") as fp:
+            slot.download_button(label=BTN_LABEL_DOWNLOAD_STL, data=fp, file_name=file_name)
+
+
+def _get_drawing_index(state) -> DrawingIndex:
+    if "drawing_index" not in state:
+        state.drawing_index = DrawingIndex()
+    return state.drawing_index
 
 
 if __name__ == "__main__":
@@ -131,7 +334,7 @@ if __name__ == "__main__":
         page_icon="🌍",
         layout="wide",
         initial_sidebar_state="expanded",
-        menu_items={"About": ABOUT},
+        menu_items={"About": get_about()},
     )
 
     st.markdown(
@@ -142,19 +345,30 @@ if __name__ == "__main__":
         unsafe_allow_html=True,
     )
     st.write("\n")
+    _get_janitor()
+    _get_download_server()
+    _get_prewarmer()
+    from streamlit_folium import st_folium
+
     m = _show_map(center=MAP_CENTER, zoom=MAP_ZOOM)
     output = st_folium(m, key="init", width=1000, height=600)
 
     geo_hash = None
+    geometry = None
     if output:
         if output["all_drawings"] is not None:
-            # get latest modified drawing
-            all_drawings = [get_hash_of_geojson(draw["geometry"]) for draw in output["all_drawings"]]
-            geo_hash = _get_active_drawing_hash(state=st.session_state, drawings=all_drawings)
+            # get latest added drawing, only drawings which changed since the last rerun get hashed
+            drawing_index = _get_drawing_index(st.session_state)
+            geo_hash = drawing_index.update([draw["geometry"] for draw in output["all_drawings"]])
+            geometry = drawing_index.geometry(geo_hash)
+            if geometry is None:
+                # the active drawing got deleted
+                geo_hash = None
 
     # ensure progress bar resides at top of sidebar and is invisible initially
     progress_bar = st.sidebar.progress(0)
     progress_bar.empty()
+    jobs_in_progress = _show_job_status(state=st.session_state, progress_bar=progress_bar)
 
     # Getting Started container
     with st.sidebar.container():
@@ -165,7 +379,23 @@ if __name__ == "__main__":
             2. Click the black square on the map
             3. Draw a rectangle on the map
             4. Optional: Apply customizations below
-            5. Click on <kbd>{BTN_LABEL_CREATE_STL}</kbd>
+            5. Click on <kbd>{BTN_LABEL_PREVIEW}</kbd> to check your selection and customizations
+            """,
+            unsafe_allow_html=True,
+        )
+        st.button(
+            BTN_LABEL_PREVIEW,
+            key="preview",
+            on_click=_check_area_and_fetch_elevation,
+            kwargs={"geometry": geometry},
+            disabled=False if geo_hash else True,
+        )
+        # preview and cost estimate are filled after the customization options are known, see below
+        preview_slot = st.empty()
+        estimate_slot = st.empty()
+        st.markdown(
+            f"""
+            6. Click on <kbd>{BTN_LABEL_CREATE_STL}</kbd>
             """,
             unsafe_allow_html=True,
         )
@@ -173,23 +403,18 @@ if __name__ == "__main__":
             BTN_LABEL_CREATE_STL,
             key="create_stl",
             on_click=_check_area_and_compute_stl,
-            kwargs={"folium_output": output, "geo_hash": geo_hash, "progress_bar": progress_bar},
+            kwargs={"geometry": geometry},
             disabled=False if geo_hash else True,
         )
         st.markdown(
             f"""
-            5. Wait for the computation to finish
-            6. Click on <kbd>{BTN_LABEL_DOWNLOAD_STL}</kbd>
+            7. Wait for the computation to finish
+            8. Click on <kbd>{BTN_LABEL_DOWNLOAD_STL}</kbd>
             """,
             unsafe_allow_html=True,
         )
-
-        output_file = TMPDIR() / f"{geo_hash}.zip"
-        if output_file.is_file():
-            with open(output_file, "rb") as fp:
-                _download_btn(fp, False)
-        else:
-            _download_btn(b"None", True)
+        # download button is filled after the customization options are known, see below
+        download_slot = st.empty()
 
         st.sidebar.markdown("---")
 
@@ -224,6 +449,14 @@ if __name__ == "__main__":
             step=ModelSizeSlider.step,
             help=ModelSizeSlider.help,
         )
+        tolerance = st.slider(
+            label=ToleranceSlider.label,
+            min_value=ToleranceSlider.min_value,
+            max_value=ToleranceSlider.max_value,
+            value=ToleranceSlider.value,
+            step=ToleranceSlider.step,
+            help=ToleranceSlider.help,
+        )
         ensure_squared = st.checkbox(
             label=SquaredCheckbox.label,
             help=SquaredCheckbox.help,
@@ -233,3 +466,44 @@ if __name__ == "__main__":
             options=TilingSelect.options,
             help=TilingSelect.help,
         )
+        output_format = st.selectbox(
+            label=OutputFormatSelect.label,
+            options=OutputFormatSelect.options,
+            help=OutputFormatSelect.help,
+        )
+        compression = st.selectbox(
+            label=CompressionSelect.label,
+            options=CompressionSelect.options,
+            help=CompressionSelect.help,
+        )
+
+    # the archive and the preview depend on the geometry as well as on the customization options
+    output_file = None
+    if geometry:
+        params = dict(
+            model_size=model_size,
+            z_scale=z_scale,
+            z_offset=z_offset,
+            ensure_squared=ensure_squared,
+            split_area_in_tiles=tiling_option,
+            elevation_source=ELEVATION_SOURCE,
+        )
+        result_cache = ResultCache(get_cache_dir())
+        result_key = get_result_key(
+            geometry, tolerance=tolerance, output_format=output_format, compression=compression, **params
+        )
+        # archives are only ready once they are published to the result cache, which may be shared by several replicas
+        if result_cache.contains(result_key):
+            output_file = result_cache.artifact(result_key)
+        _show_estimate(
+            estimate_slot, estimate_cost(geometry, ensure_squared=ensure_squared, split_area_in_tiles=tiling_option)
+        )
+        _show_preview(preview_slot, geometry, params)
+    _download_btn(download_slot, output_file)
+    # the preview is shown by the rerun after the elevation data was fetched
+    fetch_in_progress = _show_fetch_status(st.session_state, preview_slot)
+
+    if jobs_in_progress or fetch_in_progress:
+        # poll the status of running jobs by periodically rerunning the script, user interactions are not blocked
+        time.sleep(JOB_POLLING_INTERVAL)
+        st.experimental_rerun()
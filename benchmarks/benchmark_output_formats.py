@@ -0,0 +1,50 @@
+"""Benchmarks writing and archiving a synthetic terrain per output format and archive compression.
+
+Usage: python benchmarks/benchmark_output_formats.py [--size 800] [--repeat 3]
+"""
+import argparse
+import tempfile
+import time
+from itertools import product
+from pathlib import Path
+
+import numpy as np
+from mapa.algorithm import ModelSize, compute_all_triangles
+
+from mapa_streamlit.writers import COMPRESSIONS, WRITERS, ArchiveWriter, get_writer
+
+
+def _get_triangles(size: int) -> np.ndarray:
+    # smooth relief with some noise, roughly resembling a dem of a hilly region
+    x, y = np.meshgrid(np.linspace(-3, 3, size), np.linspace(-3, 3, size))
+    array = 500 * np.sin(x) * np.cos(y) + np.random.default_rng(42).random((size, size)) * 20
+    return compute_all_triangles(array, ModelSize(x=100, y=100), z_offset=2.0, z_scale=1.0, elevation_scale=0.01)
+
+
+def benchmark(size: int, repeat: int) -> None:
+    triangles = _get_triangles(size)
+    print(f"{len(triangles)} triangles")
+    print(f"{'format':<8}{'compression':<13}{'write [s]':>11}{'archive [s]':>13}{'file [MB]':>11}{'zip [MB]':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for output_format, compression in product(WRITERS, COMPRESSIONS):
+            write_duration, archive_duration = np.inf, np.inf
+            for _ in range(repeat):
+                start = time.perf_counter()
+                model_file = get_writer(output_format).write(triangles, Path(tmp_dir) / "model")
+                write_duration = min(write_duration, time.perf_counter() - start)
+                zip_file = Path(tmp_dir) / "model.zip"
+                with ArchiveWriter(zip_file, output_format=output_format, compression=compression) as archive:
+                    archive.add(model_file)
+                archive_duration = min(archive_duration, archive.duration)
+            print(
+                f"{output_format:<8}{compression:<13}{write_duration:>11.3f}{archive_duration:>13.3f}"
+                f"{model_file.stat().st_size / 1024**2:>11.1f}{zip_file.stat().st_size / 1024**2:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=800, help="rows and cols of the synthetic elevation array")
+    parser.add_argument("--repeat", type=int, default=3, help="number of repetitions, the fastest one is reported")
+    args = parser.parse_args()
+    benchmark(args.size, args.repeat)
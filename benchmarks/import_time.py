@@ -0,0 +1,71 @@
+"""Reports the import time of the streamlit app, i.e. the time until the first element of the page can be painted.
+
+The app is imported in a fresh interpreter using `python -X importtime`. The report lists the slowest top level
+imports and fails in case one of the heavy geo packages is imported on startup or the total import time exceeds the
+given limit.
+
+Usage: python benchmarks/import_time.py [--module app] [--top 15] [--max-time 3.0]
+"""
+import argparse
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# these are only needed once a region is selected or converted and must not be imported on startup
+DEFERRED_MODULES = ("mapa", "folium", "streamlit_folium", "rasterio", "numba", "pystac", "pystac_client", "stl")
+
+_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| *(\S+)")
+
+
+def measure_import_time(module: str) -> List[Tuple[str, int]]:
+    """Returns name and cumulative import time in microseconds of each module imported by the given module."""
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=Path(__file__).parent.parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            imports.append((match.group(2), int(match.group(1))))
+    return imports
+
+
+def report(module: str, top: int, max_time: float) -> int:
+    imports = measure_import_time(module)
+    total = next(cumulative for name, cumulative in imports if name == module) / 1e6
+    # top level packages of the imported modules, e.g. `mapa` for `mapa.algorithm`
+    packages: Dict[str, int] = {}
+    for name, cumulative in imports:
+        package = name.split(".")[0]
+        packages[package] = max(packages.get(package, 0), cumulative)
+
+    print(f"import of {module} took {total:.3f}s, {len(imports)} modules")
+    print(f"{'package':<30}{'cumulative [s]':>15}")
+    for package, cumulative in sorted(packages.items(), key=lambda p: p[1], reverse=True)[:top]:
+        print(f"{package:<30}{cumulative / 1e6:>15.3f}")
+
+    failed = False
+    deferred = sorted(p for p in DEFERRED_MODULES if p in packages)
+    if deferred:
+        print(f"FAILED: modules which should be imported lazily are imported on startup: {', '.join(deferred)}")
+        failed = True
+    if max_time and total > max_time:
+        print(f"FAILED: import time {total:.3f}s exceeds limit of {max_time:.3f}s")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app", help="module to be imported")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest packages to be reported")
+    parser.add_argument("--max-time", type=float, default=0.0, help="limit of the total import time in seconds")
+    args = parser.parse_args()
+    sys.exit(report(args.module, args.top, args.max_time))
@@ -0,0 +1,247 @@
+"""Offline benchmarks of the hot paths of the app, which are compared against stored baselines.
+
+Covers the cleanup of synthetic cache directories with up to several hundred thousand files, the verification of
+batches of selected geometries, full reruns of the streamlit script with a stubbed conversion and full conversions of
+synthetic terrain. No network access is needed. The median of the repetitions of each benchmark is compared against
+`baselines.json`, a benchmark counts as regression if it got slower than its baseline by more than the given
+tolerance. Baselines depend on the machine, hence they should be updated using `--save` when switching machines.
+
+Usage: python benchmarks/suite.py [--files 10000 100000 500000] [--filter cleanup] [--save] [--tolerance 0.5]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import runpy
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+# the download server started by the app binds to a random free port
+os.environ.setdefault("MAPA_STREAMLIT_DOWNLOAD_PORT", "0")
+
+from mapa_streamlit.cleaning import _get_data_size_of_dir, run_cleanup_job  # noqa: E402
+from mapa_streamlit.conversion import convert_bbox_to_stl  # noqa: E402
+from mapa_streamlit.estimation import estimate_cost  # noqa: E402
+from mapa_streamlit.verification import exceeded_cost_limits, selected_bbox_in_boundary  # noqa: E402
+
+BASELINES = Path(__file__).parent / "baselines.json"
+DEFAULT_FILES = (10_000, 100_000, 500_000)
+GEOMETRIES = 10_000
+DRAWINGS = (1, 10, 100)
+# side lengths in degree of the regions converted from synthetic terrain
+CONVERSIONS = (0.05, 0.1)
+
+_KINDS = ("{}.zip", "{}.stl", "clipped_{}.tiff", "merged_{}.tiff", "elevation_{}.tiff")
+
+
+def _get_rectangle(lon: float, lat: float, width: float, height: float) -> dict:
+    coordinates = [[lon, lat], [lon, lat + height], [lon + width, lat + height], [lon + width, lat], [lon, lat]]
+    return {"type": "Polygon", "coordinates": [coordinates]}
+
+
+def _get_geometries(n: int) -> List[dict]:
+    rng = random.Random(42)
+    return [
+        _get_rectangle(rng.uniform(-170, 160), rng.uniform(-60, 60), rng.uniform(0.01, 3), rng.uniform(0.01, 3))
+        for _ in range(n)
+    ]
+
+
+def create_cache_dir(path: Path, n_files: int) -> Path:
+    """Fills the given directory with sparse files named like the files of the mapa cache, spread across 2 levels of
+    nested directories."""
+
+    rng = random.Random(42)
+    for i in range(n_files):
+        directory = path / f"{i % 64:02x}" / f"{i // 64 % 64:02x}"
+        if i < 64 * 64:
+            directory.mkdir(parents=True)
+        with open(directory / _KINDS[i % len(_KINDS)].format(f"{rng.getrandbits(128):032x}"), "wb") as f:
+            f.truncate(rng.randint(0, 64 * 1024))
+    return path
+
+
+@contextmanager
+def _stubbed_app(drawings: int) -> Iterator[None]:
+    """Runs the streamlit script in bare mode with the given number of drawings on the map, a plain session state and
+    a stubbed conversion, using a temporary cache directory. Streamlit does not cache resources in bare mode, hence
+    they are cached by name, like they are by the streamlit server."""
+
+    import streamlit as st
+    import streamlit_folium
+
+    from mapa_streamlit import conversion
+
+    class _SessionState(dict):
+        def __getattr__(self, key):
+            try:
+                return self[key]
+            except KeyError:
+                raise AttributeError(key)
+
+        def __setattr__(self, key, value):
+            self[key] = value
+
+    resources = {}
+
+    def _cache_resource(fn: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            key = (fn.__qualname__, repr(args), repr(kwargs))
+            if key not in resources:
+                resources[key] = fn(*args, **kwargs)
+            return resources[key]
+
+        return wrapper
+
+    def _convert_bbox_to_stl(output_file: Path, **kwargs) -> Path:
+        with zipfile.ZipFile(f"{output_file}.zip", "w"):
+            return Path(f"{output_file}.zip")
+
+    output = {"all_drawings": [{"geometry": _get_rectangle(7.0 + 0.01 * i, 47.8, 0.3, 0.3)} for i in range(drawings)]}
+    cache_dir = tempfile.TemporaryDirectory()
+    patches = [
+        (st, "session_state", _SessionState()),
+        (st, "cache_resource", _cache_resource),
+        (streamlit_folium, "st_folium", lambda *args, **kwargs: output),
+        (conversion, "convert_bbox_to_stl", _convert_bbox_to_stl),
+        (tempfile, "tempdir", cache_dir.name),
+    ]
+    originals = [(obj, name, getattr(obj, name)) for obj, name, _ in patches]
+    try:
+        for obj, name, value in patches:
+            setattr(obj, name, value)
+        yield
+    finally:
+        for obj, name, value in originals:
+            setattr(obj, name, value)
+        # stops the janitor and the download server threads and the pool of the job manager
+        for resource in resources.values():
+            getattr(resource, "stop", getattr(resource, "shutdown", lambda: None))()
+        cache_dir.cleanup()
+
+
+def _convert_synthetic(size: float) -> Path:
+    # a fresh cache directory per run, so the elevation data is generated instead of read from the cache
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        return convert_bbox_to_stl(
+            bbox_geometry=_get_rectangle(7.0, 47.8, size, size),
+            model_size=100,
+            z_offset=2.0,
+            z_scale=1.0,
+            ensure_squared=False,
+            split_area_in_tiles="1x1",
+            output_file=Path(tmp_dir) / "benchmark",
+            cache_dir=Path(tmp_dir),
+            elevation_source="synthetic",
+        )
+
+
+def _measure(fn: Callable[[], object], repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def run_benchmarks(files: Tuple[int, ...], repeat: int, name_filter: str) -> Dict[str, float]:
+    results = {}
+
+    def _record(name: str, fn: Callable[[], object], repeat: int = repeat) -> None:
+        if name_filter in name:
+            results[name] = _measure(fn, repeat)
+            print(f"{name:<40}{results[name]:>12.4f}s", flush=True)
+
+    for n in files:
+        if not any(name_filter in f"{name}[{n}]" for name in ("dir_size", "cleanup")):
+            continue
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = create_cache_dir(Path(tmp_dir), n)
+            _record(f"dir_size[{n}]", lambda: _get_data_size_of_dir(path))
+            # the first run reconciles the manifest with the directory, subsequent runs only query the manifest
+            _record(f"cleanup_reconcile[{n}]", lambda: run_cleanup_job(path, 100.0, ram_cleaning_threshold=None), 1)
+            _record(f"cleanup[{n}]", lambda: run_cleanup_job(path, 100.0, ram_cleaning_threshold=None))
+            # evicts roughly 15% of the files, hence it can only run once
+            budget = _get_data_size_of_dir(path) * 0.95
+            _record(
+                f"cleanup_evict[{n}]",
+                lambda: run_cleanup_job(path, 100.0, cache_size_budget=budget, ram_cleaning_threshold=None),
+                1,
+            )
+
+    geometries = _get_geometries(GEOMETRIES)
+    _record(f"cost_limits[{GEOMETRIES}]", lambda: [exceeded_cost_limits(estimate_cost(g)) for g in geometries])
+    _record(f"in_boundary[{GEOMETRIES}]", lambda: [selected_bbox_in_boundary(g) for g in geometries])
+
+    for size in CONVERSIONS:
+        _record(f"convert_synthetic[{size}]", lambda: _convert_synthetic(size))
+
+    for drawings in DRAWINGS:
+        if name_filter not in f"app_rerun[{drawings}]":
+            continue
+        with _stubbed_app(drawings):
+            # the first run imports and caches the server wide resources
+            runpy.run_path(str(ROOT / "app.py"), run_name="__main__")
+            _record(f"app_rerun[{drawings}]", lambda: runpy.run_path(str(ROOT / "app.py"), run_name="__main__"))
+    return results
+
+
+def compare(results: Dict[str, float], baselines: Dict[str, float], tolerance: float) -> List[str]:
+    """Returns the names of the benchmarks, which got slower than their baseline by more than the tolerance."""
+
+    print(f"\n{'benchmark':<40}{'result':>12}{'baseline':>12}{'ratio':>8}")
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            print(f"{name:<40}{result:>11.4f}s{'-':>12}{'-':>8}")
+            continue
+        ratio = result / baseline if baseline else float("inf")
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40}{result:>11.4f}s{baseline:>11.4f}s{ratio:>8.2f}{flag}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, nargs="+", default=DEFAULT_FILES, help="files per cache directory")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions of each benchmark, the median counts")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this string")
+    parser.add_argument("--save", action="store_true", help="store the results as new baselines")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown relative to the baseline")
+    args = parser.parse_args()
+
+    # the log output of the cleanup job would dominate the measurements
+    logging.disable(logging.INFO)
+    results = run_benchmarks(tuple(args.files), args.repeat, args.filter)
+
+    stored = json.loads(BASELINES.read_text()) if BASELINES.is_file() else {"results": {}}
+    if args.save:
+        stored["machine"] = f"{platform.platform()}, {os.cpu_count()} cpus, python {platform.python_version()}"
+        stored["results"].update({name: round(result, 6) for name, result in results.items()})
+        BASELINES.write_text(json.dumps(stored, indent=2, sort_keys=True) + "\n")
+        print(f"\nstored baselines in {BASELINES}")
+        return 0
+    regressions = compare(results, stored["results"], args.tolerance)
+    if regressions:
+        print(f"\nFAILED: {len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,19 @@
+from functools import lru_cache
 from pathlib import Path
 
-import tomli
 
+@lru_cache(maxsize=None)
+def _get_version_from_project_toml() -> str:
+    # tomli and the toml file are only loaded once the version is actually needed, not on every import
+    import tomli
 
-def _get_version_from_project_toml():
     with open(Path(__file__).parent.parent / "pyproject.toml", "rb") as f:
         toml_dict = tomli.load(f)
 
     return toml_dict["tool"]["poetry"]["version"]
 
 
-__version__ = _get_version_from_project_toml()
+def __getattr__(name: str) -> str:
+    if name == "__version__":
+        return _get_version_from_project_toml()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,62 @@
+import logging
+import threading
+from typing import Dict, Union
+
+import psutil
+
+from mapa_streamlit.settings import JOB_MEMORY_BUDGET
+
+log = logging.getLogger(__name__)
+
+
+class JobRejected(Exception):
+    pass
+
+
+def get_memory_budget(fraction: float = JOB_MEMORY_BUDGET) -> int:
+    """Returns the memory in bytes, which may be reserved by jobs running on this host."""
+    return int(psutil.virtual_memory().total * fraction)
+
+
+class AdmissionController:
+    """Keeps track of the memory reserved by running jobs.
+
+    Each job reserves its estimated peak memory before it is started and releases it once it is finished, no matter
+    whether it succeeded or failed. Jobs which do not fit into the remaining budget need to wait, jobs which exceed
+    the whole budget would never fit and get rejected.
+    """
+
+    def __init__(self, budget: Union[None, int] = None) -> None:
+        self.budget = get_memory_budget() if budget is None else budget
+        self._reservations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def reserved(self) -> int:
+        return sum(self._reservations.values())
+
+    def check(self, job_id: str, memory: int) -> None:
+        if memory > self.budget:
+            raise JobRejected(
+                f"job {job_id} needs an estimated memory of {memory / 1024**2:.0f} MB, which exceeds the memory "
+                f"budget of {self.budget / 1024**2:.0f} MB"
+            )
+
+    def reserve(self, job_id: str, memory: int) -> bool:
+        """Reserves the given memory in bytes for the given job. Returns whether it fits into the remaining budget."""
+
+        self.check(job_id, memory)
+        with self._lock:
+            if job_id in self._reservations:
+                return True
+            if self.reserved + memory > self.budget:
+                return False
+            self._reservations[job_id] = memory
+        log.debug(f"🎟  reserved {memory / 1024**2:.0f} MB for job {job_id}")
+        return True
+
+    def release(self, job_id: str) -> None:
+        with self._lock:
+            memory = self._reservations.pop(job_id, None)
+        if memory is not None:
+            log.debug(f"🎟  released {memory / 1024**2:.0f} MB of job {job_id}")
@@ -0,0 +1,170 @@
+"""HTTP api for converting geometries without the streamlit UI.
+
+Endpoints:
+
+- `POST /jobs` with a json body `{"geometry": {...}, "params": {...}}` submits a conversion. The geometry and the
+  parameters are checked like in the app, missing parameters fall back to the defaults of the app.
+- `GET /jobs/<job id>` returns the status and the progress of a job.
+- `GET /jobs/<job id>/archive` streams the finished zip archive, supporting range requests.
+
+Jobs are identified by their result key, hence submitting the same conversion twice returns the same job. Status
+requests of known jobs are answered from memory on the event loop, including their progress, which is polled by a
+background thread of the job manager. So many clients can poll concurrently at little cost.
+"""
+import json
+import logging
+from pathlib import Path
+from typing import Callable, Tuple, Union
+
+import tornado.web
+from tornado.ioloop import IOLoop
+
+from mapa_streamlit.admission import JobRejected
+from mapa_streamlit.caching import ResultCache, get_result_key
+from mapa_streamlit.download import ArchiveHandler, DownloadServer
+from mapa_streamlit.estimation import estimate_cost
+from mapa_streamlit.jobs import JobManager, JobStatus, run_conversion
+from mapa_streamlit.prewarming import AccessLog
+from mapa_streamlit.settings import API_ADDRESS, API_PORT
+from mapa_streamlit.verification import get_default_params, get_rejection_reason, parse_params
+
+log = logging.getLogger(__name__)
+
+_JOB_ID = r"([0-9a-f]+)"
+
+
+class _JsonHandler(tornado.web.RequestHandler):
+    def write_error(self, status_code: int, **kwargs) -> None:
+        reason = self._reason
+        if "exc_info" in kwargs and isinstance(kwargs["exc_info"][1], tornado.web.HTTPError):
+            reason = kwargs["exc_info"][1].log_message or reason
+        self.finish({"error": reason})
+
+
+def get_job_status(job_manager: JobManager, job_id: str, cached: bool = False) -> Union[None, dict]:
+    """Returns the status of the given job or None, if it is unknown to the job manager and not `cached`, i.e. not
+    contained in the result cache. Only reads the state of the job manager, which is kept in memory."""
+
+    status = job_manager.status(job_id)
+    if status is None:
+        # jobs submitted before a restart of the server are only known to the result cache
+        if not cached:
+            return None
+        status = JobStatus.DONE
+    response = {"job_id": job_id, "status": status, "progress": 100 if status == JobStatus.DONE else 0}
+    if status == JobStatus.DONE:
+        response["archive"] = f"/jobs/{job_id}/archive"
+    elif status == JobStatus.FAILED:
+        response["error"] = repr(job_manager.error(job_id))
+    else:
+        response["progress"] = job_manager.progress(job_id)
+    return response
+
+
+class JobsHandler(_JsonHandler):
+    """Submits conversions."""
+
+    def initialize(self, path: str, job_manager: JobManager, conversion: Callable) -> None:
+        self.path = Path(path)
+        self.job_manager = job_manager
+        self.conversion = conversion
+
+    def _submit(self, geometry: dict, params: dict) -> Tuple[int, dict]:
+        reason = get_rejection_reason(geometry, params)
+        if reason:
+            return 400, {"error": reason}
+        result_key = get_result_key(geometry, **params)
+        AccessLog(self.path).record(geometry, params)
+        if ResultCache(self.path).lookup(result_key):
+            return 200, get_job_status(self.job_manager, result_key, cached=True)
+        estimate = estimate_cost(
+            geometry, ensure_squared=params["ensure_squared"], split_area_in_tiles=params["split_area_in_tiles"]
+        )
+        try:
+            self.job_manager.submit(
+                result_key,
+                self.conversion,
+                geometry,
+                result_key,
+                self.path,
+                params,
+                memory=estimate.peak_memory,
+            )
+        except JobRejected as e:
+            return 422, {"error": str(e)}
+        return 202, get_job_status(self.job_manager, result_key)
+
+    async def post(self) -> None:
+        try:
+            body = json.loads(self.request.body)
+            params = parse_params(body.get("params") or {}, get_default_params())
+            geometry = body["geometry"]
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            raise tornado.web.HTTPError(400, f"invalid request: {e!r}")
+        # estimating the cost and looking up the result cache touch the disk, hence they are run off the event loop
+        status_code, response = await IOLoop.current().run_in_executor(None, self._submit, geometry, params)
+        if "job_id" in response:
+            self.set_header("Location", f"/jobs/{response['job_id']}")
+        self.set_status(status_code)
+        self.finish(response)
+
+
+class JobStatusHandler(_JsonHandler):
+    """Returns the status of a job."""
+
+    def initialize(self, path: str, job_manager: JobManager) -> None:
+        self.path = Path(path)
+        self.job_manager = job_manager
+
+    def _is_cached(self, job_id: str) -> bool:
+        return ResultCache(self.path).contains(job_id)
+
+    async def get(self, job_id: str) -> None:
+        response = get_job_status(self.job_manager, job_id)
+        if response is None:
+            # the result cache is only checked for jobs unknown to the job manager, off the event loop
+            cached = await IOLoop.current().run_in_executor(None, self._is_cached, job_id)
+            response = get_job_status(self.job_manager, job_id, cached=cached)
+        if response is None:
+            raise tornado.web.HTTPError(404, f"unknown job: {job_id}")
+        self.set_header("Cache-Control", "no-cache")
+        self.finish(response)
+
+
+class JobArchiveHandler(ArchiveHandler):
+    """Streams the archive of a finished job."""
+
+    async def get(self, job_id: str, include_body: bool = True) -> None:
+        await super().get(f"{job_id}.zip", include_body=include_body)
+
+
+def make_api_app(path: Path, job_manager: JobManager, conversion: Callable = run_conversion) -> tornado.web.Application:
+    path = str(Path(path).absolute())
+    return tornado.web.Application(
+        [
+            (r"/jobs", JobsHandler, {"path": path, "job_manager": job_manager, "conversion": conversion}),
+            (rf"/jobs/{_JOB_ID}", JobStatusHandler, {"path": path, "job_manager": job_manager}),
+            (rf"/jobs/{_JOB_ID}/archive", JobArchiveHandler, {"path": path}),
+        ]
+    )
+
+
+class ApiServer(DownloadServer):
+    """HTTP server of the api, which runs its own event loop in a background thread. The conversions are run by the
+    given job manager, i.e. by a bounded pool of worker processes."""
+
+    def __init__(
+        self,
+        path: Path,
+        job_manager: JobManager,
+        conversion: Callable = run_conversion,
+        port: int = API_PORT,
+        address: str = API_ADDRESS,
+    ) -> None:
+        super().__init__(path=path, port=port, address=address)
+        self.name = "mapa-api-server"
+        self.job_manager = job_manager
+        self.conversion = conversion
+
+    def make_app(self) -> tornado.web.Application:
+        return make_api_app(self.path, self.job_manager, self.conversion)
@@ -0,0 +1,187 @@
+import json
+import logging
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from hashlib import md5
+from pathlib import Path
+from typing import Union
+
+from mapa_streamlit.manifest import CacheManifest
+from mapa_streamlit.settings import CACHE_MANIFEST, DEFAULT_COMPRESSION, DEFAULT_ELEVATION_SOURCE, DEFAULT_OUTPUT_FORMAT
+from mapa_streamlit.store import locked_transaction
+
+log = logging.getLogger(__name__)
+
+
+def get_cache_dir() -> Path:
+    """Returns the cache directory of mapa, like `mapa.utils.TMPDIR` but without importing mapa."""
+    cache_dir = Path(tempfile.gettempdir()) / "mapa"
+    cache_dir.mkdir(exist_ok=True)
+    return cache_dir
+
+
+def get_geometry_hash(geometry: dict) -> str:
+    """Returns the same hash as `mapa.caching.get_hash_of_geojson`, without importing mapa."""
+    return md5(json.dumps(geometry, sort_keys=True).encode()).hexdigest()
+
+
+def get_elevation_hash(geometry: dict, elevation_source: str = DEFAULT_ELEVATION_SOURCE) -> str:
+    """Returns a hash which identifies the elevation array of the given geometry. Equals the geometry hash for the
+    default elevation source, so arrays cached by previous versions are reused."""
+
+    geometry_hash = get_geometry_hash(geometry)
+    if elevation_source == DEFAULT_ELEVATION_SOURCE:
+        return geometry_hash
+    return md5(f"{elevation_source}:{geometry_hash}".encode()).hexdigest()
+
+
+def get_result_key(
+    geometry: dict,
+    model_size: int,
+    z_scale: float,
+    z_offset: float,
+    ensure_squared: bool,
+    split_area_in_tiles: str,
+    tolerance: float = 0.0,
+    output_format: str = DEFAULT_OUTPUT_FORMAT,
+    compression: str = DEFAULT_COMPRESSION,
+    elevation_source: str = DEFAULT_ELEVATION_SOURCE,
+) -> str:
+    """Returns a hash which uniquely identifies the output of a conversion.
+
+    In contrast to the geojson hash used by mapa, this key does not only depend on the geometry but also on all
+    parameters which influence the resulting STL file(s).
+
+    Parameters
+    ----------
+    geometry : dict
+        GeoJSON geometry of the selected bounding box
+    model_size : int
+        Desired size of the 3d model in millimeter
+    z_scale : float
+        Factor to be multiplied to the elevation data
+    z_offset : float
+        Offset in millimeter to be put below the 3d model
+    ensure_squared : bool
+        Whether the output model is forced to be squared
+    split_area_in_tiles : str
+        Tiling format, e.g. "1x1" or "2x3"
+    tolerance : float, optional
+        Tolerance in millimeter of the mesh decimation, by default 0.0
+    output_format : str, optional
+        File format of the 3d model(s), by default DEFAULT_OUTPUT_FORMAT
+    compression : str, optional
+        Compression of the zip archive, by default DEFAULT_COMPRESSION
+    elevation_source : str, optional
+        Spec of the source of the elevation data, by default DEFAULT_ELEVATION_SOURCE
+
+    Returns
+    -------
+    str
+        md5 hex digest of the geometry and the parameters
+    """
+
+    payload = {
+        "geometry": geometry,
+        "model_size": int(model_size),
+        "z_scale": float(z_scale),
+        "z_offset": float(z_offset),
+        "ensure_squared": bool(ensure_squared),
+        "split_area_in_tiles": str(split_area_in_tiles),
+    }
+    # keeps the keys of undecimated outputs, which were computed before decimation was introduced
+    if tolerance:
+        payload["tolerance"] = float(tolerance)
+    if output_format != DEFAULT_OUTPUT_FORMAT:
+        payload["output_format"] = str(output_format)
+    if compression != DEFAULT_COMPRESSION:
+        payload["compression"] = str(compression)
+    if elevation_source != DEFAULT_ELEVATION_SOURCE:
+        payload["elevation_source"] = str(elevation_source)
+    return md5(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """Index of computed zip archives living in the mapa cache directory.
+
+    The index is part of the sqlite manifest of the cache directory and keeps track of the size, creation time and
+    last hit of every archive, as well as the number of cache hits and misses. Entries are removed together with
+    their archives from the manifest, e.g. when the archives get evicted. Lookups are atomic transactions, so several
+    processes and replicas can share the same cache directory.
+    """
+
+    def __init__(self, path: Path, manifest_name: str = CACHE_MANIFEST) -> None:
+        self.path = Path(path)
+        # creates the schema of the manifest, which includes the index
+        self.manifest = CacheManifest(self.path, manifest_name=manifest_name)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.manifest.manifest_file, timeout=30.0)
+
+    def output_file(self, key: str) -> Path:
+        """Path without file ending, which is handed to mapa as `output_file`."""
+        return self.path / key
+
+    def artifact(self, key: str) -> Path:
+        return self.path / f"{key}.zip"
+
+    def contains(self, key: str) -> bool:
+        """Whether a finished archive exists for the given key. Archives which are still being written are not yet
+        part of the index."""
+
+        with closing(self._connect()) as con:
+            row = con.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone()
+        return row is not None and self.artifact(key).is_file()
+
+    def lookup(self, key: str) -> Union[None, Path]:
+        """Returns the path to the cached archive for the given key or None in case of a cache miss.
+
+        In contrast to `contains`, a lookup is counted as hit or miss and updates the last hit of the entry.
+        """
+
+        artifact = self.artifact(key)
+        with locked_transaction(self.manifest.manifest_file) as con:
+            found = con.execute("UPDATE results SET last_hit = ? WHERE key = ?", (time.time(), key)).rowcount
+            if found and artifact.is_file():
+                counter = "result_cache_hits"
+                result = artifact
+            else:
+                # archive might have been deleted by the cleanup job in the meantime
+                con.execute("DELETE FROM results WHERE key = ?", (key,))
+                counter = "result_cache_misses"
+                result = None
+            con.execute(
+                "INSERT INTO meta (key, value) VALUES (?, 1) ON CONFLICT (key) DO UPDATE SET value = value + 1",
+                (counter,),
+            )
+        if result:
+            self.manifest.touch(result)
+        log.info(f"📊  result cache {'hit' if result else 'miss'}")
+        return result
+
+    def add(self, key: str) -> None:
+        now = time.time()
+        with locked_transaction(self.manifest.manifest_file) as con:
+            con.execute(
+                "INSERT OR REPLACE INTO results (key, size, created, last_hit) VALUES (?, ?, ?, ?)",
+                (key, self.artifact(key).stat().st_size, now, now),
+            )
+
+    def entry(self, key: str) -> Union[None, dict]:
+        with closing(self._connect()) as con:
+            row = con.execute("SELECT size, created, last_hit FROM results WHERE key = ?", (key,)).fetchone()
+        return None if row is None else dict(zip(("size", "created", "last_hit"), row))
+
+    def stats(self) -> dict:
+        with closing(self._connect()) as con:
+            (entries,) = con.execute("SELECT COUNT(*) FROM results").fetchone()
+            counters = dict(
+                con.execute("SELECT key, value FROM meta WHERE key IN ('result_cache_hits', 'result_cache_misses')")
+            )
+        return {
+            "entries": entries,
+            "hits": int(counters.get("result_cache_hits", 0)),
+            "misses": int(counters.get("result_cache_misses", 0)),
+        }
@@ -1,10 +1,26 @@
 import logging
 import shutil
+import threading
+import time
 from pathlib import Path
-from typing import Union
+from typing import Callable, Tuple, Union
 
 import psutil
 
+from mapa_streamlit.locking import Lease, get_lease_file
+from mapa_streamlit.manifest import CacheManifest
+from mapa_streamlit.metrics import Metrics
+from mapa_streamlit.settings import (
+    CACHE_LOW_WATER_MARK,
+    CACHE_SIZE_BUDGET,
+    DEM_TILE_BUDGET,
+    DISK_CLEANING_THRESHOLD,
+    JANITOR_INTERVAL,
+    JANITOR_MIN_INTERVAL,
+    RAM_CLEANING_THRESHOLD,
+)
+from mapa_streamlit.store import get_pinned_files, get_store_lock
+
 log = logging.getLogger(__name__)
 
 
@@ -47,7 +63,9 @@ def _get_data_size_of_dir(path: Path) -> float:
     return round(sum(f.stat().st_size for f in path.glob("**/*") if f.is_file()) / 1024**2, 4)
 
 
-def _delete_files_in_dir(path: Path, file_suffix: str, name_prefix: Union[None, str] = None) -> None:
+def _delete_files_in_dir(
+    path: Path, file_suffix: str, name_prefix: Union[None, str] = None, manifest: Union[None, CacheManifest] = None
+) -> None:
     for file in path.iterdir():
         if file.suffix == file_suffix:
             if name_prefix:  # if name prefix is specified, only delete file if name matches
@@ -57,27 +75,239 @@ def _delete_files_in_dir(path: Path, file_suffix: str, name_prefix: Union[None,
             else:
                 file.unlink()
                 log.info(f"🗑  deleted file: {file}")
+            if manifest and not file.exists():
+                manifest.remove(file)
 
 
 def _get_number_of_files_in_dir(path: Path, file_suffix: str) -> int:
     return len([f for f in path.glob("**/*") if f.suffix == file_suffix])
 
 
-def run_cleanup_job(path: Path, disk_cleaning_threshold: float) -> None:
+def _is_evictable(file: Path) -> bool:
+    # downloaded stac items are kept, as they are expensive to fetch and shared by overlapping bounding boxes
+    if file.suffix in (".stl", ".3mf", ".zip", ".prof") or file.name.startswith("elevation_"):
+        return True
+    # tiffs per bounding box are not kept anymore, but may be left over from earlier versions
+    return file.suffix == ".tiff" and file.name.startswith(("merged_", "clipped_"))
+
+
+def _evict_least_recently_used(
+    manifest: CacheManifest, target_size: int, is_evictable: Callable[[Path], bool] = _is_evictable
+) -> Tuple[int, int]:
+    """Deletes the least recently used files until the size of the cache does not exceed the target size. Pinned
+    files, i.e. files in use by any process sharing the cache directory, are skipped.
+
+    Parameters
+    ----------
+    manifest : CacheManifest
+        Manifest of the cache directory to evict files from
+    target_size : int
+        Size of the cache in bytes, which should be reached
+    is_evictable : Callable[[Path], bool], optional
+        Function deciding whether a file may be evicted, by default _is_evictable
+
+    Returns
+    -------
+    Tuple[int, int]
+        Number of evicted files and number of reclaimed bytes
+    """
+
+    cache_size = manifest.size()
+    evicted = []
+    reclaimed = 0
+    # no file can be pinned in between checking the pins and deleting it, while the store lock is held
+    with get_store_lock(manifest.path):
+        pinned = get_pinned_files(manifest.path)
+        for file, size in manifest.least_recently_used():
+            if cache_size - reclaimed <= target_size:
+                break
+            if not is_evictable(file) or file in pinned:
+                continue
+            file.unlink(missing_ok=True)
+            log.info(f"🗑  deleted file: {file}")
+            evicted.append(file)
+            reclaimed += size
+    manifest.remove(*evicted)
+    manifest.increment("evicted_files", len(evicted))
+    manifest.increment("reclaimed_bytes", reclaimed)
+    return len(evicted), reclaimed
+
+
+def run_cleanup_job(
+    path: Path,
+    disk_cleaning_threshold: float,
+    cache_size_budget: float = CACHE_SIZE_BUDGET,
+    low_water_mark: float = CACHE_LOW_WATER_MARK,
+    ram_cleaning_threshold: Union[None, float] = RAM_CLEANING_THRESHOLD,
+) -> Tuple[int, int]:
+    """Evicts the least recently used files of the mapa cache directory in case it grew too large.
+
+    Cleaning is triggered when the disk usage exceeds the given threshold, when the cache directory exceeds its
+    size budget or, if enabled, when the ram usage exceeds the given threshold. Files are then evicted until the
+    size of the cache directory is back at the low water mark of its budget (or of its current size, if it is
+    smaller than the budget).
+
+    Parameters
+    ----------
+    path : Path
+        Path to the mapa cache directory
+    disk_cleaning_threshold : float
+        Disk usage in percent, above which files get evicted
+    cache_size_budget : float, optional
+        Maximum size of the cache directory in MB, by default CACHE_SIZE_BUDGET
+    low_water_mark : float, optional
+        Fraction of the budget down to which files get evicted, by default CACHE_LOW_WATER_MARK
+    ram_cleaning_threshold : Union[None, float], optional
+        Ram usage in percent, above which files get evicted. None disables this trigger, by default
+        RAM_CLEANING_THRESHOLD
+
+    Returns
+    -------
+    Tuple[int, int]
+        Number of evicted files and number of reclaimed bytes
+    """
+
+    # sizes and numbers of files are taken from the manifest, the directory is only scanned occasionally
+    manifest = CacheManifest(path)
+    if manifest.needs_reconciliation():
+        manifest.reconcile()
     disk_usage = _get_disk_usage(path)
     ram_usage = _get_ram_usage()
-    mapa_cache = _get_data_size_of_dir(path)
+    cache_size = manifest.size()
+    mapa_cache = round(cache_size / 1024**2, 4)
     log.info(f"💾  Disk usage: {disk_usage}%, Ram usage: {ram_usage}%, mapa files: {mapa_cache} MB")
-    stl_num = _get_number_of_files_in_dir(path, ".stl")
-    tiff_num = _get_number_of_files_in_dir(path, ".tiff")
+    stl_num = manifest.count(".stl")
+    tiff_num = manifest.count(".tiff")
     log.info(f"🗂  Number of STL files: {stl_num}, number of TIFF files: {tiff_num}")
+
     if disk_usage > disk_cleaning_threshold:
-        log.info(f"🧹  Disk usage exceeds threshold ({disk_usage}%>{disk_cleaning_threshold}%), deleting files ...")
-        _delete_files_in_dir(path, ".stl")
-        _delete_files_in_dir(path, ".zip")
-        _delete_files_in_dir(path, ".tiff", name_prefix="merged_")
-        _delete_files_in_dir(path, ".tiff", name_prefix="clipped_")
+        log.info(f"🧹  Disk usage exceeds threshold ({disk_usage}%>{disk_cleaning_threshold}%), evicting files ...")
+    elif cache_size > cache_size_budget * 1024**2:
+        log.info(f"🧹  mapa files exceed budget ({mapa_cache} MB>{cache_size_budget} MB), evicting files ...")
+    elif ram_cleaning_threshold is not None and ram_usage > ram_cleaning_threshold:
+        log.info(f"🧹  Ram usage exceeds threshold ({ram_usage}%>{ram_cleaning_threshold}%), evicting files ...")
     else:
         log.info(
             f"✅  Disk usage does not exceed threshold ({disk_usage}%<{disk_cleaning_threshold}%), no cleaning required."
         )
+        return 0, 0
+
+    target_size = int(low_water_mark * min(cache_size_budget * 1024**2, cache_size))
+    evicted, reclaimed = _evict_least_recently_used(manifest, target_size)
+    log.info(f"✅  evicted {evicted} files, reclaimed {round(reclaimed / 1024**2, 4)} MB")
+    return evicted, reclaimed
+
+
+def run_tile_cleanup_job(
+    path: Path, tile_budget: float = DEM_TILE_BUDGET, low_water_mark: float = CACHE_LOW_WATER_MARK
+) -> Tuple[int, int]:
+    """Evicts the least recently used dem tiles in case the tile store exceeds its budget.
+
+    Parameters
+    ----------
+    path : Path
+        Path to the directory of the dem tile store
+    tile_budget : float, optional
+        Maximum size of the tile store in MB, by default DEM_TILE_BUDGET
+    low_water_mark : float, optional
+        Fraction of the budget down to which tiles get evicted, by default CACHE_LOW_WATER_MARK
+
+    Returns
+    -------
+    Tuple[int, int]
+        Number of evicted tiles and number of reclaimed bytes
+    """
+
+    manifest = CacheManifest(path)
+    if manifest.needs_reconciliation():
+        manifest.reconcile()
+    tile_size = manifest.size()
+    tiles = round(tile_size / 1024**2, 4)
+    log.info(f"🗺  dem tiles: {tiles} MB, number of tiles: {manifest.count('.tiff')}")
+    if tile_size <= tile_budget * 1024**2:
+        return 0, 0
+    log.info(f"🧹  dem tiles exceed budget ({tiles} MB>{tile_budget} MB), evicting tiles ...")
+    evicted, reclaimed = _evict_least_recently_used(
+        manifest, int(low_water_mark * tile_budget * 1024**2), is_evictable=lambda f: f.suffix == ".tiff"
+    )
+    log.info(f"✅  evicted {evicted} tiles, reclaimed {round(reclaimed / 1024**2, 4)} MB")
+    return evicted, reclaimed
+
+
+def cache_exceeds_quota(
+    path: Path, disk_cleaning_threshold: float, cache_size_budget: float = CACHE_SIZE_BUDGET
+) -> bool:
+    """Cheap check whether the cleanup job needs to run, which is suitable for the request path.
+
+    Only takes the disk usage and the size of the cache directory from the manifest into account.
+    """
+
+    return _get_disk_usage(path) > disk_cleaning_threshold or CacheManifest(path).size() / 1024**2 > cache_size_budget
+
+
+class Janitor(threading.Thread):
+    """Background thread which runs the cleanup job off the request path.
+
+    The cleanup job is run periodically and whenever the janitor is woken up, but at most once per minimum interval.
+    A lease file in the cache directory ensures, that only one janitor runs the cleanup job at a time, even if
+    several processes share the same cache directory. If a tile path is given, the dem tile store gets cleaned up
+    as well, according to its own budget.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        tile_path: Union[None, Path] = None,
+        disk_cleaning_threshold: float = DISK_CLEANING_THRESHOLD,
+        interval: float = JANITOR_INTERVAL,
+        min_interval: float = JANITOR_MIN_INTERVAL,
+    ) -> None:
+        super().__init__(name="mapa-janitor", daemon=True)
+        self.path = Path(path)
+        self.tile_path = tile_path
+        self.disk_cleaning_threshold = disk_cleaning_threshold
+        self.interval = interval
+        self.min_interval = min_interval
+        self.last_run = 0.0
+        self._wake_up_event = threading.Event()
+        self._stop_event = threading.Event()
+
+    def run_once(self) -> Tuple[int, int]:
+        lease = Lease(get_lease_file(self.path, "janitor"), timeout=self.interval)
+        if not lease.acquire():
+            log.info("🧹  cleanup job is already running in another process, skipping")
+            return 0, 0
+        try:
+            self.last_run = time.time()
+            metrics = Metrics(self.path)
+            with metrics.span("cleanup"):
+                evicted, reclaimed = run_cleanup_job(
+                    path=self.path, disk_cleaning_threshold=self.disk_cleaning_threshold
+                )
+            if self.tile_path:
+                with metrics.span("tile_cleanup"):
+                    evicted_tiles, reclaimed_tiles = run_tile_cleanup_job(path=self.tile_path)
+                evicted, reclaimed = evicted + evicted_tiles, reclaimed + reclaimed_tiles
+            return evicted, reclaimed
+        finally:
+            lease.release()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            self._wake_up_event.wait(timeout=self.interval)
+            self._wake_up_event.clear()
+            # rate limit runs triggered by waking up the janitor
+            self._stop_event.wait(timeout=max(0.0, self.last_run + self.min_interval - time.time()))
+            if self._stop_event.is_set():
+                break
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("⛔️  cleanup job failed")
+
+    def wake_up(self) -> None:
+        self._wake_up_event.set()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._wake_up_event.set()
@@ -0,0 +1,297 @@
+"""Headless batch conversion of many bounding boxes, without the streamlit UI.
+
+Reads the bounding boxes and their parameters from a GeoJSON or CSV file, applies the same checks as the app,
+skips results which are already cached and converts the remaining ones in parallel worker processes. Progress is
+streamed to stderr, the archives are copied to the output directory and each result is appended to a manifest.
+
+Usage: mapa_streamlit regions.geojson --output-dir out/ [--workers 4] [--model-size 150] ...
+"""
+import argparse
+import csv
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, TextIO, Union
+
+from mapa_streamlit.admission import JobRejected
+from mapa_streamlit.caching import ResultCache, get_cache_dir, get_result_key
+from mapa_streamlit.estimation import estimate_cost
+from mapa_streamlit.jobs import JobManager, JobStatus, run_conversion
+from mapa_streamlit.settings import BATCH_MANIFEST, BATCH_POLLING_INTERVAL, MAX_WORKERS, get_tile_workers
+from mapa_streamlit.verification import PARAMS, get_default_params, get_rejection_reason, parse_params
+
+log = logging.getLogger(__name__)
+
+# columns of the bounding boxes in csv files
+_CSV_BBOX_COLUMNS = ("west", "south", "east", "north")
+
+
+class BatchStatus:
+    DONE: str = "done"
+    CACHED: str = "cached"
+    REJECTED: str = "rejected"
+    FAILED: str = "failed"
+
+
+class BatchItem(NamedTuple):
+    name: str
+    geometry: dict
+    params: dict
+    # reason why the item could not be read, such items get rejected
+    error: Union[None, str] = None
+
+
+def get_bbox_geometry(west: float, south: float, east: float, north: float) -> dict:
+    """Returns the GeoJSON polygon of the given bounding box, in the same shape as the rectangles drawn on the map."""
+
+    coordinates = [[west, south], [west, north], [east, north], [east, south], [west, south]]
+    return {"type": "Polygon", "coordinates": [coordinates]}
+
+
+def _get_invalid_item(name: str, values: dict, error: Exception) -> BatchItem:
+    # the given values of the parameters are kept as they are, so the manifest shows what was wrong
+    params = {key: value for key, value in values.items() if key in PARAMS}
+    return BatchItem(name, {}, params, error=str(error))
+
+
+def _parse_coordinate(row: dict, column: str) -> float:
+    try:
+        value = float(row[column])
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid {column}: {row[column]!r}") from None
+    if not math.isfinite(value):
+        raise ValueError(f"invalid {column}: {row[column]!r}")
+    return value
+
+
+def read_geojson(file: Path, defaults: dict) -> List[BatchItem]:
+    """Reads the polygons of a GeoJSON feature collection, feature or geometry. Parameters and the name are taken
+    from the properties of each feature. Features which cannot be read are returned along with the error, so they
+    get rejected individually."""
+
+    data = json.loads(Path(file).read_text())
+    if data.get("type") == "FeatureCollection":
+        features = data["features"]
+    elif data.get("type") == "Feature":
+        features = [data]
+    else:
+        features = [{"geometry": data, "properties": {}}]
+    items = []
+    for i, feature in enumerate(features):
+        geometry = feature.get("geometry") or {}
+        properties = feature.get("properties") or {}
+        name = str(properties.get("name", f"bbox_{i + 1}"))
+        try:
+            if geometry.get("type") != "Polygon":
+                raise ValueError(f"not a polygon: {geometry.get('type')}")
+            items.append(BatchItem(name, geometry, parse_params(properties, defaults)))
+        except ValueError as e:
+            items.append(_get_invalid_item(name, properties, e))
+    return items
+
+
+def read_csv(file: Path, defaults: dict) -> List[BatchItem]:
+    """Reads bounding boxes from a csv file with the columns west, south, east, north and optionally name and any of
+    the parameters. Rows which cannot be read are returned along with the error, so they get rejected individually."""
+
+    items = []
+    with open(file, newline="") as f:
+        reader = csv.DictReader(f)
+        missing = set(_CSV_BBOX_COLUMNS) - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"{file} is missing the column(s): {', '.join(sorted(missing))}")
+        for i, row in enumerate(reader):
+            name = row.get("name") or f"bbox_{i + 1}"
+            try:
+                geometry = get_bbox_geometry(*(_parse_coordinate(row, column) for column in _CSV_BBOX_COLUMNS))
+                items.append(BatchItem(name, geometry, parse_params(row, defaults)))
+            except ValueError as e:
+                items.append(_get_invalid_item(name, row, e))
+    return items
+
+
+def read_batch(file: Path, defaults: dict) -> List[BatchItem]:
+    if Path(file).suffix.lower() == ".csv":
+        return read_csv(file, defaults)
+    return read_geojson(file, defaults)
+
+
+def _get_file_name(name: str) -> str:
+    return re.sub(r"[^\w.-]", "_", name)
+
+
+class BatchRunner:
+    """Converts a batch of bounding boxes using a pool of worker processes.
+
+    Items resulting in the same archive are only converted once. Archives are named after their items, hence items
+    whose names map to the same file name as a previous item of the batch are rejected. Each finished item is
+    appended to the manifest in the output directory as a line of json, so the manifest is complete up to the point
+    of an interruption.
+    """
+
+    def __init__(
+        self,
+        output_dir: Path,
+        cache_dir: Path,
+        workers: int = MAX_WORKERS,
+        polling_interval: float = BATCH_POLLING_INTERVAL,
+        stream: TextIO = sys.stderr,
+    ) -> None:
+        self.output_dir = Path(output_dir)
+        self.cache_dir = Path(cache_dir)
+        self.workers = workers
+        self.tile_workers = get_tile_workers(workers)
+        self.polling_interval = polling_interval
+        self.stream = stream
+        self.manifest_file = self.output_dir / BATCH_MANIFEST
+
+    def _print(self, message: str) -> None:
+        print(message, file=self.stream, flush=True)
+
+    def _finish(self, item: BatchItem, result_key: Union[None, str], status: str, **details) -> dict:
+        entry = {"name": item.name, "status": status, "result_key": result_key, "params": item.params, **details}
+        if status in (BatchStatus.DONE, BatchStatus.CACHED):
+            archive = self.output_dir / f"{_get_file_name(item.name)}.zip"
+            shutil.copyfile(ResultCache(self.cache_dir).artifact(result_key), archive)
+            entry["archive"] = str(archive)
+        with open(self.manifest_file, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        detail = f": {details['reason']}" if "reason" in details else ""
+        self._print(f"{status:>8}  {item.name}{detail}")
+        return entry
+
+    def run(self, items: List[BatchItem]) -> List[dict]:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        result_cache = ResultCache(self.cache_dir)
+        entries = []
+        pending: Dict[str, List[BatchItem]] = {}
+        file_names = set()
+        job_manager = JobManager(path=self.cache_dir, max_workers=self.workers)
+        try:
+            for item in items:
+                if item.error:
+                    entries.append(self._finish(item, None, BatchStatus.REJECTED, reason=item.error))
+                    continue
+                if _get_file_name(item.name) in file_names:
+                    entries.append(self._finish(item, None, BatchStatus.REJECTED, reason=f"duplicate name: {item.name}"))
+                    continue
+                file_names.add(_get_file_name(item.name))
+                reason = get_rejection_reason(item.geometry, item.params, self.tile_workers)
+                if reason:
+                    entries.append(self._finish(item, None, BatchStatus.REJECTED, reason=reason))
+                    continue
+                result_key = get_result_key(item.geometry, **item.params)
+                if result_key in pending:
+                    pending[result_key].append(item)
+                    continue
+                if result_cache.lookup(result_key):
+                    entries.append(self._finish(item, result_key, BatchStatus.CACHED))
+                    continue
+                estimate = estimate_cost(
+                    item.geometry,
+                    ensure_squared=item.params["ensure_squared"],
+                    split_area_in_tiles=item.params["split_area_in_tiles"],
+                    tile_workers=self.tile_workers,
+                )
+                params = dict(item.params, max_workers=self.tile_workers)
+                try:
+                    job_manager.submit(
+                        result_key,
+                        run_conversion,
+                        item.geometry,
+                        result_key,
+                        self.cache_dir,
+                        params,
+                        memory=estimate.peak_memory,
+                    )
+                except JobRejected as e:
+                    entries.append(self._finish(item, result_key, BatchStatus.REJECTED, reason=str(e)))
+                    continue
+                pending[result_key] = [item]
+            self._print(f"🚀  converting {len(pending)} region(s) using {self.workers} worker(s)")
+            entries.extend(self._wait_for(job_manager, pending))
+        finally:
+            job_manager.shutdown()
+        return entries
+
+    def _wait_for(self, job_manager: JobManager, pending: Dict[str, List[BatchItem]]) -> List[dict]:
+        entries = []
+        total = len(pending)
+        progress: Dict[str, int] = {}
+        while pending:
+            for result_key in list(pending):
+                status = job_manager.status(result_key)
+                if status in (JobStatus.QUEUED, JobStatus.PENDING, JobStatus.RUNNING):
+                    value = job_manager.progress(result_key)
+                    if value != progress.get(result_key):
+                        progress[result_key] = value
+                        self._print(f"{value:>7}%  {pending[result_key][0].name}")
+                    continue
+                for item in pending.pop(result_key):
+                    if status == JobStatus.DONE:
+                        entries.append(self._finish(item, result_key, BatchStatus.DONE))
+                    else:
+                        error = repr(job_manager.error(result_key))
+                        entries.append(self._finish(item, result_key, BatchStatus.FAILED, reason=error))
+                self._print(f"📦  {total - len(pending)}/{total} conversion(s) finished")
+            if pending:
+                time.sleep(self.polling_interval)
+        return entries
+
+
+def _get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="mapa_streamlit", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("input", type=Path, help="GeoJSON file of polygons or csv file of bounding boxes")
+    parser.add_argument("-o", "--output-dir", type=Path, default=Path("."), help="directory to copy the archives to")
+    parser.add_argument("--cache-dir", type=Path, default=None, help="mapa cache directory, shared with the app")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="parallel conversions")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the log output of the conversions")
+    defaults = get_default_params()
+    parser.add_argument(
+        "--elevation-source",
+        default=defaults["elevation_source"],
+        help=f"stac, geotiff:<path> or synthetic[:<seed>], default: {defaults['elevation_source']}",
+    )
+    for key, cast in PARAMS.items():
+        flag = f"--{key.replace('_', '-')}"
+        if key == "ensure_squared":
+            parser.add_argument(flag, action="store_true", help="default for all regions without own value")
+        else:
+            parser.add_argument(flag, type=cast, default=defaults[key], help=f"default: {defaults[key]}")
+    return parser
+
+
+def main(argv: Union[None, List[str]] = None) -> int:
+    args = _get_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    defaults = {key: getattr(args, key) for key in PARAMS}
+    defaults["elevation_source"] = args.elevation_source
+    items = read_batch(args.input, defaults)
+    runner = BatchRunner(
+        output_dir=args.output_dir,
+        cache_dir=args.cache_dir or get_cache_dir(),
+        workers=max(1, args.workers),
+    )
+    entries = runner.run(items)
+    statuses = (BatchStatus.DONE, BatchStatus.CACHED, BatchStatus.REJECTED, BatchStatus.FAILED)
+    counts = {status: sum(entry["status"] == status for entry in entries) for status in statuses}
+    print(
+        f"✅  {counts[BatchStatus.DONE]} converted, {counts[BatchStatus.CACHED]} cached, "
+        f"{counts[BatchStatus.REJECTED]} rejected, {counts[BatchStatus.FAILED]} failed, "
+        f"see {runner.manifest_file}",
+        file=sys.stderr,
+    )
+    return 1 if counts[BatchStatus.REJECTED] or counts[BatchStatus.FAILED] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
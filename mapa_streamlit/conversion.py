@@ -0,0 +1,289 @@
+import logging
+import multiprocessing
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Tuple, Union
+
+import numpy as np
+import rasterio as rio
+from mapa import conf
+from mapa.algorithm import ModelSize, compute_all_triangles, reduce_resolution
+from mapa.raster import cut_array_to_square, remove_empty_first_and_last_rows_and_cols
+from mapa.tiling import get_x_y_from_tiles_format, split_array_into_tiles
+from mapa.utils import ProgressBar
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.io import DatasetReader
+
+from mapa_streamlit.caching import get_elevation_hash
+from mapa_streamlit.decimation import compute_decimated_triangles
+from mapa_streamlit.elevation import get_compression_options, get_elevation_source
+from mapa_streamlit.metrics import Metrics
+from mapa_streamlit.settings import DEFAULT_COMPRESSION, DEFAULT_ELEVATION_SOURCE, DEFAULT_OUTPUT_FORMAT, TILE_WORKERS
+from mapa_streamlit.store import atomic_write
+from mapa_streamlit.writers import ArchiveWriter, get_writer
+
+log = logging.getLogger(__name__)
+
+
+def _get_desired_size(array: np.ndarray, x: float, y: float, ensure_squared: bool) -> ModelSize:
+    if ensure_squared:
+        return ModelSize(x=x, y=y)
+    else:
+        rows, cols = array.shape
+        return ModelSize(x=x, y=y / rows * cols)
+
+
+def path_to_elevation_raster(bbox_hash: str, cache_dir: Path) -> Path:
+    return cache_dir / f"elevation_{bbox_hash}.tiff"
+
+
+def elevation_for_bbox_is_cached(bbox_hash: str, cache_dir: Path) -> bool:
+    return path_to_elevation_raster(bbox_hash, cache_dir).is_file()
+
+
+def _write_elevation_raster(file: Path, array: np.ndarray, elevation_scale: float) -> None:
+    profile = dict(
+        driver="GTiff",
+        count=1,
+        height=array.shape[0],
+        width=array.shape[1],
+        dtype=array.dtype,
+        **get_compression_options(array.dtype),
+    )
+    with atomic_write(file) as tmp_file:
+        with warnings.catch_warnings():
+            # the raster is not georeferenced, as the elevation scale is all the conversion needs
+            warnings.simplefilter("ignore", NotGeoreferencedWarning)
+            with rio.open(tmp_file, "w", **profile) as raster:
+                raster.write(array, 1)
+                raster.update_tags(elevation_scale=repr(float(elevation_scale)))
+
+
+@contextmanager
+def open_elevation_for_bbox(
+    bbox_geometry: dict,
+    cache_dir: Path,
+    progress_bar: Union[None, ProgressBar] = None,
+    elevation_source: str = DEFAULT_ELEVATION_SOURCE,
+) -> Iterator[DatasetReader]:
+    """Opens the cached elevation raster of the bounding box, which is fetched first unless it is cached already.
+    Its elevation scale per millimeter model size is stored in the `elevation_scale` tag.
+
+    GDAL decompresses the blocks of the raster transparently on read, hence e.g. a downsampled version of the raster
+    can be read using `out_shape` without holding the whole array in memory.
+    """
+
+    bbox_hash = get_elevation_hash(bbox_geometry, elevation_source)
+    raster_file = path_to_elevation_raster(bbox_hash, cache_dir)
+    if not elevation_for_bbox_is_cached(bbox_hash, cache_dir):
+        array, elevation_scale = get_elevation_source(elevation_source).read(bbox_geometry, cache_dir, progress_bar)
+        _write_elevation_raster(raster_file, array, elevation_scale)
+        del array
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        with rio.open(raster_file) as raster:
+            yield raster
+
+
+def get_elevation_for_bbox(
+    bbox_geometry: dict,
+    cache_dir: Path,
+    progress_bar: Union[None, ProgressBar] = None,
+    elevation_source: str = DEFAULT_ELEVATION_SOURCE,
+) -> Tuple[np.ndarray, float]:
+    """Returns the clipped elevation array of the bounding box together with its elevation scale per millimeter
+    model size.
+
+    Both only depend on the geometry and the elevation source, hence they are cached as tiled, compressed GeoTIFF
+    (with the scale as tag), so subsequent conversions which only differ in their mesh parameters can skip fetching
+    the elevation data.
+    """
+
+    bbox_hash = get_elevation_hash(bbox_geometry, elevation_source)
+    if not elevation_for_bbox_is_cached(bbox_hash, cache_dir):
+        array, elevation_scale = get_elevation_source(elevation_source).read(bbox_geometry, cache_dir, progress_bar)
+        _write_elevation_raster(path_to_elevation_raster(bbox_hash, cache_dir), array, elevation_scale)
+        return array, elevation_scale
+
+    log.info("🚀  using cached elevation array!")
+    with open_elevation_for_bbox(bbox_geometry, cache_dir, elevation_source=elevation_source) as raster:
+        return raster.read(1), float(raster.tags()["elevation_scale"])
+
+
+def _reduce_array(array: np.ndarray) -> np.ndarray:
+    # mirrors the preprocessing of `mapa.convert_array_to_stl` using max_res=False
+    x, y = array.shape
+    # when merging tiffs, sometimes an empty row/col is added, which should be dropped (in case the array size suffices)
+    if x > 1 and y > 1:
+        array = remove_empty_first_and_last_rows_and_cols(array)
+    bin_factor = round((x / conf.MAXIMUM_RESOLUTION + y / conf.MAXIMUM_RESOLUTION) / 2)
+    if bin_factor > 1:
+        array = reduce_resolution(array, bin_factor=bin_factor)
+    return array
+
+
+def _convert_tile(
+    array: np.ndarray,
+    desired_size: ModelSize,
+    z_offset: float,
+    z_scale: float,
+    elevation_scale: float,
+    output_file: str,
+    tolerance: float = 0.0,
+    output_format: str = DEFAULT_OUTPUT_FORMAT,
+) -> Path:
+    array = _reduce_array(array)
+    if tolerance > 0:
+        triangles = compute_decimated_triangles(array, desired_size, z_offset, z_scale, elevation_scale, tolerance)
+    else:
+        triangles = compute_all_triangles(array, desired_size, z_offset, z_scale, elevation_scale)
+    return get_writer(output_format).write(triangles, output_file)
+
+
+def _convert_tiles(
+    tiled_arrays: List[np.ndarray], output_files: List[str], max_workers: int = TILE_WORKERS, **kwargs
+) -> Iterator[Path]:
+    """Converts the given tiles to 3d model files across a pool of processes and yields each file as soon as it is
+    finished, i.e. not necessarily in order."""
+
+    workers = min(max_workers, len(tiled_arrays))
+    # daemonic processes, like the workers of a process pool on python < 3.9, are not allowed to have children
+    if workers <= 1 or multiprocessing.current_process().daemon:
+        for array, output_file in zip(tiled_arrays, output_files):
+            yield _convert_tile(np.asarray(array), output_file=output_file, **kwargs)
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [
+            # the tile arrays get pickled to the worker processes
+            executor.submit(_convert_tile, np.asarray(array), output_file=output_file, **kwargs)
+            for array, output_file in zip(tiled_arrays, output_files)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def convert_bbox_to_stl(
+    bbox_geometry: dict,
+    model_size: int,
+    z_offset: float,
+    z_scale: float,
+    ensure_squared: bool,
+    split_area_in_tiles: str,
+    output_file: Path,
+    cache_dir: Path,
+    progress_bar: Union[None, object] = None,
+    max_workers: int = TILE_WORKERS,
+    tolerance: float = 0.0,
+    output_format: str = DEFAULT_OUTPUT_FORMAT,
+    compression: str = DEFAULT_COMPRESSION,
+    elevation_source: str = DEFAULT_ELEVATION_SOURCE,
+) -> Path:
+    """Converts the given bounding box to zipped STL (or 3MF) file(s).
+
+    Mirrors `mapa.convert_bbox_to_stl`, but takes the elevation data from the given elevation source, by default
+    the DEM tile store, which is shared across requests, instead of fetching the STAC items for each bounding box.
+    The clipped elevation array is cached per geometry and source, so changing only the mesh parameters skips
+    straight to triangulation. Tiles are meshed in parallel and written to the zip archive as soon as they are
+    finished.
+
+    Parameters
+    ----------
+    bbox_geometry : dict
+        GeoJSON geometry of the selected bounding box
+    model_size : int
+        Desired size of the (larger side of the) 3d model in millimeter
+    z_offset : float
+        Offset distance in millimeter to be put below the 3d model
+    z_scale : float
+        Value to be multiplied to the z-axis elevation data
+    ensure_squared : bool
+        Whether the output model should be squared in x- and y-dimension
+    split_area_in_tiles : str
+        Tiling format, e.g. "1x1" or "2x3"
+    output_file : Path
+        Path to the output file without file ending
+    cache_dir : Path
+        Path to the mapa cache directory
+    progress_bar : Union[None, object], optional
+        Object with a `progress` method, e.g. a streamlit progress bar, by default None
+    max_workers : int, optional
+        Maximum number of processes used for meshing the tiles in parallel, by default TILE_WORKERS
+    tolerance : float, optional
+        Maximum deviation in millimeter of the decimated mesh from the elevation data. Flat regions collapse to a
+        few triangles, by default 0.0, i.e. no decimation
+    output_format : str, optional
+        Format of the 3d model file(s), one of `writers.WRITERS`, by default DEFAULT_OUTPUT_FORMAT
+    compression : str, optional
+        Compression of the zip archive, one of `writers.COMPRESSIONS`, by default DEFAULT_COMPRESSION
+    elevation_source : str, optional
+        Spec of the source of the elevation data, see `elevation.get_elevation_source`, by default
+        DEFAULT_ELEVATION_SOURCE
+
+    Returns
+    -------
+    Path
+        Path to the resulting zip archive
+    """
+
+    tiles = get_x_y_from_tiles_format(split_area_in_tiles)
+    if progress_bar:
+        progress_bar = ProgressBar(progress_bar=progress_bar, steps=tiles.x * tiles.y * 2)
+
+    metrics = Metrics(cache_dir)
+    with metrics.span("fetch_dem"):
+        array, elevation_scale = get_elevation_for_bbox(
+            bbox_geometry, Path(cache_dir), progress_bar, elevation_source=elevation_source
+        )
+    elevation_scale = elevation_scale * model_size
+    if ensure_squared:
+        array = cut_array_to_square(array)
+
+    desired_size = _get_desired_size(
+        array=array,
+        x=model_size / tiles.x,
+        y=model_size / tiles.y,
+        ensure_squared=ensure_squared,
+    )
+
+    tiled_arrays = split_array_into_tiles(array, tiles)
+    if len(tiled_arrays) > 1:
+        output_files = [f"{output_file}_{i + 1}" for i in range(len(tiled_arrays))]
+    else:
+        output_files = [str(output_file)]
+    model_files = _convert_tiles(
+        tiled_arrays,
+        output_files,
+        max_workers=max_workers,
+        desired_size=desired_size,
+        z_offset=z_offset,
+        z_scale=z_scale,
+        elevation_scale=elevation_scale,
+        tolerance=tolerance,
+        output_format=output_format,
+    )
+
+    # the archive is published atomically, so a failing tile never leaves a partial archive behind
+    zip_file_path = Path(f"{output_file}.zip")
+    start = time.perf_counter()
+    with atomic_write(zip_file_path) as tmp_file:
+        with ArchiveWriter(tmp_file, output_format=output_format, compression=compression) as archive:
+            for model_file in model_files:
+                if progress_bar:
+                    progress_bar.step()
+                log.info(f"📦  compressing file: {model_file.name}")
+                archive.add(model_file)
+                # the archive keeps the only, compressed copy of the model files in the cache directory
+                model_file.unlink()
+                if progress_bar:
+                    progress_bar.step()
+    # tiles are meshed while the archive is written, hence the time spent meshing is the remainder
+    metrics.observe("mesh", time.perf_counter() - start - archive.duration)
+    metrics.observe("archive", archive.duration)
+    log.info(
+        f"✅  finished compressing {output_format} files into: {zip_file_path} using {compression} compression "
+        f"in {archive.duration:.2f}s"
+    )
+    return zip_file_path
@@ -0,0 +1,178 @@
+"""Adaptive mesh decimation based on a right-triangulated irregular network (RTIN).
+
+The elevation raster is resampled to a square grid of 2^k + 1 points, which is recursively split into right
+triangles, as described in "Right-Triangulated Irregular Networks" by Evans, Kirkpatrick and Townsend. A triangle is
+only split further, in case its hypotenuse midpoint deviates more than the given tolerance from the surface. As
+errors are propagated from child to parent triangles, the resulting mesh is free of cracks, i.e. flat regions
+collapse to a few large triangles while the relief is kept.
+"""
+import logging
+from typing import Union
+
+import numba as nb
+import numpy as np
+from mapa.algorithm import ModelSize, compute_all_triangles
+
+log = logging.getLogger(__name__)
+
+
+def _resample_to_grid(raster: np.ndarray) -> np.ndarray:
+    """Bilinearly resamples the given raster to a square grid of 2^k + 1 points, covering the same extent."""
+
+    size = 2 ** int(np.ceil(np.log2(max(raster.shape) - 1))) + 1
+    rows, cols = raster.shape
+    grid_rows = np.linspace(0, rows - 1, size)
+    grid_cols = np.linspace(0, cols - 1, size)
+    resampled = np.array([np.interp(grid_cols, np.arange(cols), row) for row in raster])
+    return np.array([np.interp(grid_rows, np.arange(rows), col) for col in resampled.T]).T
+
+
+def _get_z_offset(z_offset: Union[None, float], minimum: float, elevation_scale: float) -> float:
+    # like mapa, the given z offset is the height of the lowest point of the surface, None keeps the natural height
+    if z_offset is None:
+        return minimum * elevation_scale
+    return z_offset - minimum * elevation_scale
+
+
+def _get_number_of_undecimated_triangles(rows: int, cols: int) -> int:
+    # mirrors `mapa.algorithm.compute_all_triangles`: four triangles per pixel for the surface, plus the sides and
+    # the bottom of the model
+    return 4 * rows * cols + 6 * (rows + cols) - 2
+
+
+def _create_raster(array: np.ndarray) -> np.ndarray:
+    # like mapa, the mesh vertices are the corners of the pixels, i.e. the average of the adjacent pixels
+    padded = np.pad(array, 1, mode="edge")
+    return (padded[1:, 1:] + padded[:-1, 1:] + padded[1:, :-1] + padded[:-1, :-1]) / 4
+
+
+@nb.njit(cache=True)
+def _compute_errors(grid: np.ndarray) -> np.ndarray:
+    """Returns the approximation error of each grid point, when omitting it from the mesh."""
+
+    size = grid.shape[0]
+    tile_size = size - 1
+    n_triangles = tile_size * tile_size * 2 - 2
+    n_parent_triangles = n_triangles - tile_size * tile_size
+    errors = np.zeros((size, size))
+    for i in range(n_triangles - 1, -1, -1):
+        # find the coordinates of the triangle by walking down the binary tree of triangles
+        tid = i + 2
+        ax = ay = bx = by = cx = cy = 0
+        if tid & 1:
+            bx = by = cx = tile_size
+        else:
+            ax = ay = cy = tile_size
+        tid >>= 1
+        while tid > 1:
+            mx = (ax + bx) >> 1
+            my = (ay + by) >> 1
+            if tid & 1:
+                bx, by = ax, ay
+                ax, ay = cx, cy
+            else:
+                ax, ay = bx, by
+                bx, by = cx, cy
+            cx, cy = mx, my
+            tid >>= 1
+
+        mx = (ax + bx) >> 1
+        my = (ay + by) >> 1
+        error = abs((grid[ay, ax] + grid[by, bx]) / 2 - grid[my, mx])
+        errors[my, mx] = max(errors[my, mx], error)
+        if i < n_parent_triangles:
+            cx = mx + my - ay
+            cy = my + ax - mx
+            left = errors[(ay + cy) >> 1, (ax + cx) >> 1]
+            right = errors[(by + cy) >> 1, (bx + cx) >> 1]
+            errors[my, mx] = max(errors[my, mx], left, right)
+    return errors
+
+
+@nb.njit(cache=True)
+def _extract_triangles(errors: np.ndarray, max_error: float) -> np.ndarray:
+    """Returns the grid coordinates (x = col, y = row) of the triangles of the mesh approximating the surface within
+    the given error. Triangles are oriented clockwise in the (x, y) plane."""
+
+    tile_size = errors.shape[0] - 1
+    triangles = []
+    stack = [(0, 0, tile_size, tile_size, tile_size, 0), (tile_size, tile_size, 0, 0, 0, tile_size)]
+    while stack:
+        ax, ay, bx, by, cx, cy = stack.pop()
+        mx = (ax + bx) >> 1
+        my = (ay + by) >> 1
+        if abs(ax - cx) + abs(ay - cy) > 1 and errors[my, mx] > max_error:
+            stack.append((bx, by, cx, cy, mx, my))
+            stack.append((cx, cy, ax, ay, mx, my))
+        else:
+            triangles.append((ax, ay, bx, by, cx, cy))
+    result = np.empty((len(triangles), 3, 2), dtype=np.int64)
+    for i, (ax, ay, bx, by, cx, cy) in enumerate(triangles):
+        result[i, 0, 0], result[i, 0, 1] = ax, ay
+        result[i, 1, 0], result[i, 1, 1] = bx, by
+        result[i, 2, 0], result[i, 2, 1] = cx, cy
+    return result
+
+
+def _get_boundary_edges(triangles: np.ndarray, tile_size: int) -> np.ndarray:
+    """Returns the directed edges of the given triangles, which lie on the border of the grid."""
+
+    edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    on_border = np.zeros(len(edges), dtype=bool)
+    for axis in (0, 1):
+        for border in (0, tile_size):
+            on_border |= (edges[:, 0, axis] == border) & (edges[:, 1, axis] == border)
+    return edges[on_border]
+
+
+def compute_decimated_triangles(
+    array: np.ndarray,
+    desired_size: ModelSize,
+    z_offset: float,
+    z_scale: float,
+    elevation_scale: float,
+    tolerance: float,
+) -> np.ndarray:
+    """Computes the triangles of a closed 3d model of the given elevation array, whose surface deviates at most the
+    given tolerance in millimeter from the surface through the pixel corners. Mirrors
+    `mapa.algorithm.compute_all_triangles` with respect to size, orientation and z offset of the model, which is
+    used instead in case the decimated mesh would not have fewer triangles."""
+
+    raster = _create_raster(np.asarray(array, dtype=float))
+    grid = _resample_to_grid(raster)
+    tile_size = grid.shape[0] - 1
+
+    combined_z_scale = elevation_scale * z_scale
+    max_error = tolerance / combined_z_scale if combined_z_scale > 0 else np.inf
+    triangles = _extract_triangles(_compute_errors(grid), max_error)
+    edges = _get_boundary_edges(triangles, tile_size)
+    # the grid may have more points than the array, hence small tolerances can result in more triangles than meshing
+    # every pixel. Two side and one bottom triangle are added per boundary edge
+    if len(triangles) + 3 * len(edges) >= _get_number_of_undecimated_triangles(*array.shape):
+        log.debug("✂️  decimated mesh would not be smaller than the undecimated one")
+        return compute_all_triangles(array, desired_size, z_offset, z_scale, elevation_scale)
+
+    z_offset = _get_z_offset(z_offset, raster.min(), elevation_scale)
+    x_scale, y_scale = desired_size.x / tile_size, desired_size.y / tile_size
+
+    def _to_model(points: np.ndarray, bottom: bool = False) -> np.ndarray:
+        # rows of the grid are the x-axis of the model, as in mapa. Swapping the axes turns the clockwise triangles
+        # counterclockwise, i.e. their normals face upwards
+        x, y = points[..., 1] * x_scale, points[..., 0] * y_scale
+        z = np.zeros(x.shape) if bottom else grid[points[..., 1], points[..., 0]] * combined_z_scale + z_offset
+        return np.stack([x, y, z], axis=-1)
+
+    surface = _to_model(triangles)
+    top, base = _to_model(edges), _to_model(edges, bottom=True)
+    # quads of the side walls below each boundary edge, facing outwards
+    sides = np.concatenate(
+        [
+            np.stack([top[:, 1], top[:, 0], base[:, 0]], axis=1),
+            np.stack([top[:, 1], base[:, 0], base[:, 1]], axis=1),
+        ]
+    )
+    # the bottom is a fan around its center, facing downwards
+    center = np.broadcast_to([desired_size.x / 2, desired_size.y / 2, 0.0], base[:, 0].shape)
+    bottom = np.stack([center, base[:, 1], base[:, 0]], axis=1)
+    log.debug(f"✂️  decimated mesh to {len(triangles)} surface triangles, grid has {tile_size ** 2 * 2}")
+    return np.concatenate([surface, sides, bottom])
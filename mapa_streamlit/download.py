@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import re
+import threading
+from pathlib import Path
+from typing import Optional, Union
+from urllib.parse import urlencode
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+
+from mapa_streamlit.metrics import export_metrics
+from mapa_streamlit.settings import DOWNLOAD_ADDRESS, DOWNLOAD_PORT, DOWNLOAD_URL
+from mapa_streamlit.store import Pin
+
+log = logging.getLogger(__name__)
+
+
+def get_download_url(artifact: Path, file_name: str, base_url: Union[None, str] = DOWNLOAD_URL) -> Union[None, str]:
+    """Returns the public url of the given archive or None, if no public url of the download server is set."""
+
+    if not base_url:
+        return None
+    return f"{base_url}/download/{Path(artifact).name}?{urlencode({'filename': file_name})}"
+
+
+class ArchiveHandler(tornado.web.StaticFileHandler):
+    """Serves the zip archives of the mapa cache directory.
+
+    Archives are streamed from disk in chunks and range requests are supported, so their bytes are only read once
+    a user actually downloads them instead of on every rerun of the streamlit script. Archives are pinned while they
+    are streamed, so they are not evicted by the cleanup job of any replica sharing the cache directory.
+    """
+
+    async def get(self, path: str, include_body: bool = True) -> None:
+        if not re.fullmatch(r"[\w.-]+\.zip", path):
+            # rejected by `validate_absolute_path`
+            await super().get(path, include_body=include_body)
+            return
+        # pinning waits for a running eviction, hence it is run off the event loop
+        pin = Pin(Path(self.root), Path(self.root) / path)
+        await IOLoop.current().run_in_executor(None, pin.acquire)
+        try:
+            await super().get(path, include_body=include_body)
+        finally:
+            pin.release()
+
+    def validate_absolute_path(self, root: str, absolute_path: str) -> Optional[str]:
+        # only archives are exposed, not the dem tiles or any bookkeeping files of the cache directory
+        if Path(absolute_path).suffix != ".zip" or Path(absolute_path).parent != Path(root):
+            raise tornado.web.HTTPError(404)
+        return super().validate_absolute_path(root, absolute_path)
+
+    def set_extra_headers(self, path: str) -> None:
+        file_name = re.sub(r"[^\w.-]", "_", self.get_argument("filename", Path(path).name))
+        self.set_header("Content-Type", "application/zip")
+        self.set_header("Content-Disposition", f'attachment; filename="{file_name}"')
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Serves the metrics of the mapa cache directory in the prometheus text format."""
+
+    def initialize(self, path: str) -> None:
+        self.path = Path(path)
+
+    def get(self) -> None:
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(export_metrics(self.path))
+
+
+def make_app(path: Path) -> tornado.web.Application:
+    path = str(Path(path).absolute())
+    return tornado.web.Application(
+        [(r"/download/(.*)", ArchiveHandler, {"path": path}), (r"/metrics", MetricsHandler, {"path": path})]
+    )
+
+
+class DownloadServer(threading.Thread):
+    """HTTP server serving the finished archives and the metrics, which runs its own event loop in a background
+    thread."""
+
+    def __init__(self, path: Path, port: int = DOWNLOAD_PORT, address: str = DOWNLOAD_ADDRESS) -> None:
+        super().__init__(name="mapa-download-server", daemon=True)
+        self.path = Path(path)
+        self.address = address
+        self.port = port
+        self._loop: Union[None, IOLoop] = None
+        self._ready = threading.Event()
+        self.error: Union[None, Exception] = None
+
+    def run(self) -> None:
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        try:
+            sockets = bind_sockets(self.port, self.address)
+        except OSError as e:
+            log.warning(f"⛔️  could not start download server on port {self.port}: {e}")
+            self.error = e
+            self._ready.set()
+            return
+        # port 0 binds to a random free port
+        self.port = sockets[0].getsockname()[1]
+        server = HTTPServer(self.make_app())
+        server.add_sockets(sockets)
+        self._loop = IOLoop.current()
+        log.info(f"📡  serving archives of {self.path} on port {self.port}")
+        self._ready.set()
+        self._loop.start()
+        server.stop()
+
+    def make_app(self) -> tornado.web.Application:
+        return make_app(self.path)
+
+    def start(self) -> None:
+        super().start()
+        self._ready.wait()
+
+    def is_serving(self) -> bool:
+        return self.is_alive() and self.error is None
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            self._loop.add_callback(self._loop.stop)
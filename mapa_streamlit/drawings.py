@@ -0,0 +1,49 @@
+import logging
+from typing import Dict, List, Set, Union
+
+from mapa_streamlit.caching import get_geometry_hash
+
+log = logging.getLogger(__name__)
+
+
+class DrawingIndex:
+    """Per session index of the rectangles drawn on the map, which is updated incrementally on every rerun.
+
+    The drawings returned by the map only grow at their end while the user draws, hence only drawings which differ
+    from the ones seen in the previous rerun get hashed. The active drawing is the one which was added most recently.
+    """
+
+    def __init__(self) -> None:
+        self._drawings: List[dict] = []
+        self._hashes: List[str] = []
+        self._geometries: Dict[str, dict] = {}
+        self._seen: Set[str] = set()
+        self.active: Union[None, str] = None
+
+    def update(self, drawings: List[dict]) -> Union[None, str]:
+        """Updates the index with the geometries of all drawings on the map and returns the hash of the active one."""
+
+        unchanged = 0
+        for old, new in zip(self._drawings, drawings):
+            if old != new:
+                break
+            unchanged += 1
+        if unchanged == len(self._drawings) == len(drawings):
+            return self.active
+
+        hashes = self._hashes[:unchanged] + [get_geometry_hash(d) for d in drawings[unchanged:]]
+        for geo_hash in hashes[unchanged:]:
+            if geo_hash not in self._seen:
+                self._seen.add(geo_hash)
+                self.active = geo_hash
+                log.debug(f"🎨  found new active_drawing: {geo_hash}")
+        if unchanged < len(self._drawings):
+            # drawings got edited or deleted, hence the geometries are rebuilt from the hashes
+            self._geometries = dict(zip(hashes, drawings))
+        else:
+            self._geometries.update(zip(hashes[unchanged:], drawings[unchanged:]))
+        self._drawings, self._hashes = list(drawings), hashes
+        return self.active
+
+    def geometry(self, geo_hash: Union[None, str]) -> Union[None, dict]:
+        return self._geometries.get(geo_hash)
@@ -0,0 +1,202 @@
+"""Sources of the elevation data of a bounding box.
+
+Sources are selected by a spec string, which is part of the conversion parameters and hence picklable and part of
+the result key:
+
+- `stac`: ALOS DEM tiles found via the STAC catalogue of the Planetary Computer, kept in the DEM tile store
+- `geotiff:<path>`: a local GeoTIFF (or GDAL VRT) file or a directory of GeoTIFF tiles, e.g. a mirror of the ALOS DEM
+- `synthetic` or `synthetic:<seed>`: deterministic, procedurally generated terrain, which needs no data at all
+"""
+import logging
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Tuple, Union
+
+import numpy as np
+import rasterio as rio
+from affine import Affine
+from haversine import haversine
+from mapa.caching import get_hash_of_geojson
+from mapa.utils import ProgressBar, path_to_merged_tiff
+from rasterio.mask import mask
+from rasterio.merge import merge
+
+from mapa_streamlit.settings import DEFAULT_ELEVATION_SOURCE, ELEVATION_COMPRESSION
+from mapa_streamlit.store import get_tmp_file
+from mapa_streamlit.tiles import TileStore, get_bbox, get_tile_dir
+
+log = logging.getLogger(__name__)
+
+
+def _get_elevation_scale(transform: Affine, cols: int) -> float:
+    """Returns the size of one meter in a model of 1 millimeter, like `mapa.raster.determine_elevation_scale` but
+    based on the transform of an array instead of a tiff file."""
+
+    # haversine expects lat, lon
+    top_left = rio.transform.xy(transform, 0, 0, offset="center")[::-1]
+    top_right = rio.transform.xy(transform, 0, cols, offset="center")[::-1]
+    return 1 / haversine(top_left, top_right, unit="m")
+
+
+class ElevationSource(ABC):
+    """Provides the elevation data of bounding boxes."""
+
+    @abstractmethod
+    def read(
+        self, bbox_geometry: dict, cache_dir: Path, progress_bar: Union[None, ProgressBar] = None
+    ) -> Tuple[np.ndarray, float]:
+        """Returns the elevation array in meter of the given bounding box together with its elevation scale per
+        millimeter model size."""
+
+
+def get_compression_options(dtype: np.dtype) -> dict:
+    """Returns the GeoTIFF creation options of compressed elevation rasters of the given data type."""
+
+    # floating point data compresses far better using the floating point predictor than the horizontal one
+    predictor = 3 if np.issubdtype(dtype, np.floating) else 2
+    return dict(ELEVATION_COMPRESSION, predictor=predictor)
+
+
+def _write_tiff(file: Path, array: np.ndarray, meta: dict, **options) -> Path:
+    profile = dict(meta, driver="GTiff", count=array.shape[0], height=array.shape[1], width=array.shape[2], **options)
+    with rio.open(file, "w", **profile) as tiff:
+        tiff.write(array)
+    return file
+
+
+def _merge_and_clip_tiffs(
+    tiffs: List[Path], bbox_geometry: dict, bbox_hash: str, cache_dir: Path
+) -> Tuple[np.ndarray, Affine]:
+    """Like `mapa.raster.merge_tiffs` followed by `mapa.raster.clip_tiff_to_bbox`, but the merged tiff is a
+    compressed, temporary file only and the clipped raster is returned together with its transform instead of being
+    stored. It is cached as elevation raster by `conversion.get_elevation_for_bbox` already."""
+
+    merged_tiff = get_tmp_file(path_to_merged_tiff(bbox_hash, cache_dir))
+    try:
+        if len(tiffs) > 1:
+            datasets = [rio.open(tiff) for tiff in tiffs]
+            try:
+                mosaic, transform = merge(datasets)
+                meta = dict(datasets[0].meta, transform=transform)
+            finally:
+                for dataset in datasets:
+                    dataset.close()
+            _write_tiff(merged_tiff, mosaic, meta, **get_compression_options(mosaic.dtype))
+            del mosaic
+            source = merged_tiff
+        else:
+            source = tiffs[0]
+        with rio.open(source) as dataset:
+            return mask(dataset, shapes=[bbox_geometry], crop=True)
+    finally:
+        merged_tiff.unlink(missing_ok=True)
+
+
+def _get_raster_for_bbox(
+    bbox_geometry: dict, cache_dir: Path, progress_bar: Union[None, ProgressBar] = None
+) -> Tuple[np.ndarray, Affine]:
+    tiffs = TileStore(get_tile_dir(cache_dir)).get_tiles(bbox_geometry, progress_bar)
+    return _merge_and_clip_tiffs(tiffs, bbox_geometry, get_hash_of_geojson(bbox_geometry), cache_dir)
+
+
+class StacElevationSource(ElevationSource):
+    """ALOS DEM tiles found via STAC, which are downloaded to the DEM tile store, merged and clipped like mapa does."""
+
+    def read(
+        self, bbox_geometry: dict, cache_dir: Path, progress_bar: Union[None, ProgressBar] = None
+    ) -> Tuple[np.ndarray, float]:
+        array, transform = _get_raster_for_bbox(bbox_geometry, cache_dir, progress_bar)
+        # the elevation scale is proportional to the model size
+        return array[0], _get_elevation_scale(transform, array.shape[2])
+
+
+@lru_cache(maxsize=None)
+def _get_bounds(file: Path, mtime: float) -> Tuple[float, float, float, float]:
+    # only the header is read, the modification time invalidates the cached bounds of replaced files
+    with rio.open(file) as dataset:
+        return tuple(dataset.bounds)
+
+
+class GeoTiffElevationSource(ElevationSource):
+    """Local GeoTIFF (or VRT) file or directory of GeoTIFF tiles in EPSG:4326.
+
+    Only the blocks of the rasters intersecting the bounding box are read from disk, no matter how large the rasters
+    are. Rasters are neither copied nor merged into intermediate files.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+
+    def _get_files(self, bbox: Tuple[float, float, float, float]) -> List[Path]:
+        if self.path.is_file():
+            files = [self.path]
+        else:
+            files = sorted(f for f in self.path.iterdir() if f.suffix.lower() in (".tif", ".tiff", ".vrt"))
+        min_lon, min_lat, max_lon, max_lat = bbox
+        intersecting = []
+        for file in files:
+            left, bottom, right, top = _get_bounds(file, file.stat().st_mtime)
+            if left < max_lon and right > min_lon and bottom < max_lat and top > min_lat:
+                intersecting.append(file)
+        return intersecting
+
+    def read(
+        self, bbox_geometry: dict, cache_dir: Path, progress_bar: Union[None, ProgressBar] = None
+    ) -> Tuple[np.ndarray, float]:
+        bbox = get_bbox(bbox_geometry)
+        files = self._get_files(bbox)
+        if not files:
+            raise ValueError(f"{self.path} does not contain elevation data for the bounding box: {bbox}")
+        datasets = [rio.open(file) for file in files]
+        try:
+            if len(datasets) == 1:
+                # cropping reads the window of the bounding box only
+                array, transform = mask(datasets[0], shapes=[bbox_geometry], crop=True)
+            else:
+                array, transform = merge(datasets, bounds=bbox)
+        finally:
+            for dataset in datasets:
+                dataset.close()
+        log.info(f"🗺  read elevation array with shape {array.shape[1:]} from {len(files)} local raster(s)")
+        return array[0], _get_elevation_scale(transform, array.shape[2])
+
+
+class SyntheticElevationSource(ElevationSource):
+    """Deterministic terrain made of a few superimposed waves, which depends on the coordinates only. The resolution
+    equals the one of the ALOS DEM, so the cost of a conversion is realistic."""
+
+    def __init__(self, seed: int = 0) -> None:
+        self.seed = seed
+
+    def read(
+        self, bbox_geometry: dict, cache_dir: Path, progress_bar: Union[None, ProgressBar] = None
+    ) -> Tuple[np.ndarray, float]:
+        min_lon, min_lat, max_lon, max_lat = get_bbox(bbox_geometry)
+        # 1 arc second, like the ALOS DEM
+        rows = max(2, round((max_lat - min_lat) * 3600))
+        cols = max(2, round((max_lon - min_lon) * 3600))
+        width, height = (max_lon - min_lon) / cols, (max_lat - min_lat) / rows
+        transform = rio.transform.from_origin(min_lon, max_lat, width, height)
+        lon, lat = np.meshgrid(
+            np.radians(min_lon + (np.arange(cols) + 0.5) * width),
+            np.radians(max_lat - (np.arange(rows) + 0.5) * height),
+        )
+        rng = np.random.default_rng(self.seed)
+        array = np.full((rows, cols), 1000.0)
+        # wavelengths of roughly 0.5, 0.1 and 0.02 degrees, so even small regions show some relief
+        for amplitude, frequency in ((800.0, 720.0), (300.0, 3600.0), (60.0, 18000.0)):
+            phase_lon, phase_lat = rng.uniform(0, 2 * np.pi, 2)
+            array += amplitude * np.sin(frequency * lon + phase_lon) * np.cos(frequency * lat + phase_lat)
+        return array.astype(np.float32), _get_elevation_scale(transform, cols)
+
+
+def get_elevation_source(spec: str = DEFAULT_ELEVATION_SOURCE) -> ElevationSource:
+    kind, _, arg = spec.partition(":")
+    if kind == "stac" and not arg:
+        return StacElevationSource()
+    elif kind == "geotiff" and arg:
+        return GeoTiffElevationSource(arg)
+    elif kind == "synthetic":
+        return SyntheticElevationSource(int(arg) if arg else 0)
+    raise ValueError(f"Unknown elevation source: {spec}, choose one of: stac, geotiff:<path>, synthetic[:<seed>]")
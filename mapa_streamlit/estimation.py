@@ -0,0 +1,107 @@
+import logging
+from math import radians, sin
+from typing import NamedTuple, Tuple
+
+from mapa_streamlit.settings import DEFAULT_TILING_FORMAT, DEM_BYTES_PER_PIXEL, DEM_RESOLUTION, TILE_WORKERS
+from mapa_streamlit.tiles import get_bbox, get_cells
+
+log = logging.getLogger(__name__)
+
+# mean earth radius in meter
+EARTH_RADIUS = 6371008.8
+# triangles are computed as float64 arrays, which get stacked (i.e. copied) and converted to a numpy-stl mesh
+_TRIANGLE_MEMORY = 2 * 9 * 8 + 50
+# binary stl files consist of a header, a triangle count and 50 bytes per triangle
+_STL_HEADER_SIZE = 84
+_STL_TRIANGLE_SIZE = 50
+
+
+class CostEstimate(NamedTuple):
+    # geodesic area in square kilometer
+    area: float
+    dem_pixels: int
+    # all sizes in bytes
+    fetch_size: int
+    peak_memory: int
+    triangles: int
+    output_size: int
+
+    @property
+    def fetch_memory(self) -> int:
+        # fetching the elevation data needs the mosaic and the clipped array, but no triangles
+        return self.fetch_size + self.dem_pixels * DEM_BYTES_PER_PIXEL
+
+
+def get_geodesic_area(bbox: Tuple[float, float, float, float]) -> float:
+    """Returns the area in square meter of the given min lon, min lat, max lon, max lat bounding box on the sphere."""
+
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return EARTH_RADIUS**2 * radians(max_lon - min_lon) * abs(sin(radians(max_lat)) - sin(radians(min_lat)))
+
+
+def _get_triangles_of_tile(rows: int, cols: int) -> int:
+    # mapa is imported on first use, so it does not slow down the start of the app
+    from mapa import conf
+
+    # mirrors the resolution reduction of `mapa.convert_array_to_stl` using max_res=False
+    bin_factor = round((rows / conf.MAXIMUM_RESOLUTION + cols / conf.MAXIMUM_RESOLUTION) / 2)
+    if bin_factor > 1:
+        rows, cols = rows // bin_factor, cols // bin_factor
+    # four triangles per pixel for the surface, plus the sides and the bottom of the model
+    return 4 * rows * cols + 6 * (rows + cols)
+
+
+def estimate_cost(
+    geometry: dict,
+    ensure_squared: bool = False,
+    split_area_in_tiles: str = DEFAULT_TILING_FORMAT,
+    tile_workers: int = TILE_WORKERS,
+) -> CostEstimate:
+    """Estimates the resources needed for converting the given geometry to STL file(s).
+
+    The ALOS DEM has a (roughly) constant resolution in meter, hence the number of pixels is derived from the
+    geodesic area instead of the area in squared degrees, which would overestimate regions far from the equator.
+    Fetched are the whole DEM tiles touched by the geometry, which need to be merged in memory if there are several.
+    """
+
+    from mapa.tiling import get_x_y_from_tiles_format
+
+    bbox = get_bbox(geometry)
+    min_lon, min_lat, max_lon, max_lat = bbox
+    area = get_geodesic_area(bbox)
+    height = EARTH_RADIUS * radians(max_lat - min_lat)
+    rows = max(1, round(height / DEM_RESOLUTION))
+    cols = max(1, round(area / height / DEM_RESOLUTION)) if height else 1
+    if ensure_squared:
+        rows = cols = min(rows, cols)
+    dem_pixels = rows * cols
+
+    cells = get_cells(bbox)
+    fetch_pixels = sum(get_geodesic_area((lon, lat, lon + 1, lat + 1)) / DEM_RESOLUTION**2 for lon, lat in cells)
+    fetch_size = int(fetch_pixels * DEM_BYTES_PER_PIXEL)
+
+    tiles = get_x_y_from_tiles_format(split_area_in_tiles)
+    tile_triangles = _get_triangles_of_tile(max(1, rows // tiles.x), max(1, cols // tiles.y))
+    triangles = tile_triangles * tiles.x * tiles.y
+    output_size = tiles.x * tiles.y * _STL_HEADER_SIZE + triangles * _STL_TRIANGLE_SIZE
+
+    # tiles are merged into one mosaic, the clipped array is kept while the tiles are triangulated in parallel
+    mosaic = fetch_size if len(cells) > 1 else 0
+    parallel_tiles = min(tile_workers, tiles.x * tiles.y)
+    peak_memory = mosaic + dem_pixels * DEM_BYTES_PER_PIXEL + parallel_tiles * tile_triangles * _TRIANGLE_MEMORY
+    if parallel_tiles > 1:
+        # tiles meshed by worker processes are pickled, hence each worker holds the pickled and the unpickled copy of
+        # its tile array
+        tile_pixels = max(1, rows // tiles.x) * max(1, cols // tiles.y)
+        peak_memory += parallel_tiles * 2 * tile_pixels * DEM_BYTES_PER_PIXEL
+
+    estimate = CostEstimate(
+        area=round(area / 1e6, 1),
+        dem_pixels=dem_pixels,
+        fetch_size=fetch_size,
+        peak_memory=peak_memory,
+        triangles=triangles,
+        output_size=output_size,
+    )
+    log.info(f"📏  estimated cost of selected area: {estimate}")
+    return estimate
@@ -0,0 +1,388 @@
+import cProfile
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+from mapa_streamlit.admission import AdmissionController, JobRejected
+from mapa_streamlit.caching import ResultCache, get_elevation_hash
+from mapa_streamlit.locking import Lease, LeaseHeartbeat, get_lease_file
+from mapa_streamlit.manifest import CacheManifest
+from mapa_streamlit.metrics import Metrics
+from mapa_streamlit.settings import (
+    DEFAULT_ELEVATION_SOURCE,
+    DEFAULT_OUTPUT_FORMAT,
+    DEFAULT_TILING_FORMAT,
+    FINISHED_JOB_RETENTION,
+    JOB_POLLING_INTERVAL,
+    LEASE_POLLING_INTERVAL,
+    MAX_WORKERS,
+    PROFILE_SLOW_JOBS,
+)
+from mapa_streamlit.store import Pin
+
+log = logging.getLogger(__name__)
+
+
+class JobStatus:
+    QUEUED: str = "queued"
+    PENDING: str = "pending"
+    RUNNING: str = "running"
+    DONE: str = "done"
+    FAILED: str = "failed"
+
+
+def get_progress_file(path: Path, job_id: str) -> Path:
+    return Path(path) / f"{job_id}.progress"
+
+
+class FileProgressBar:
+    """Drop-in replacement for a streamlit progress bar, which can be used in a worker process.
+
+    mapa only calls the `progress` method of the given progress bar object. Instead of updating the UI, the
+    progress value is written to a file, which is polled by the streamlit script thread.
+    """
+
+    def __init__(self, progress_file: Path) -> None:
+        self.progress_file = Path(progress_file)
+
+    def progress(self, value: int) -> None:
+        self.progress_file.write_text(str(value))
+
+
+class ProgressPoller(threading.Thread):
+    """Background thread which periodically reads the progress files of the running jobs into memory.
+
+    The progress is polled by every session of the app and every client of the api, hence it is answered from memory
+    instead of reading the progress file on each request.
+    """
+
+    def __init__(self, path: Path, get_job_ids: Callable[[], Iterable[str]], interval: float = JOB_POLLING_INTERVAL):
+        super().__init__(name="mapa-progress-poller", daemon=True)
+        self.path = Path(path)
+        self.get_job_ids = get_job_ids
+        self.interval = interval
+        self._progress: Dict[str, int] = {}
+        self._stop_event = threading.Event()
+
+    def progress(self, job_id: str) -> int:
+        return self._progress.get(job_id, 0)
+
+    def run_once(self) -> None:
+        progress = {}
+        for job_id in self.get_job_ids():
+            try:
+                progress[job_id] = int(get_progress_file(self.path, job_id).read_text())
+            except (FileNotFoundError, ValueError):
+                # e.g. the file is written right now
+                progress[job_id] = self._progress.get(job_id, 0)
+        # replaced at once, as the progress is read without holding a lock
+        self._progress = progress
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("⛔️  polling the progress of the jobs failed")
+            self._stop_event.wait(timeout=self.interval)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+
+def _get_output_files(
+    geometry: dict,
+    result_key: str,
+    cache_dir: Path,
+    split_area_in_tiles: str,
+    output_format: str = DEFAULT_OUTPUT_FORMAT,
+    elevation_source: str = DEFAULT_ELEVATION_SOURCE,
+) -> List[Path]:
+    """Returns the paths of the files written for the given conversion. The model files only exist while the
+    conversion is running, afterwards they are kept in the archive only."""
+
+    from mapa.tiling import get_x_y_from_tiles_format
+
+    from mapa_streamlit.conversion import path_to_elevation_raster
+    from mapa_streamlit.writers import get_writer
+
+    result_cache = ResultCache(cache_dir)
+    tiles = get_x_y_from_tiles_format(split_area_in_tiles)
+    suffix = get_writer(output_format).suffix
+    if tiles.x * tiles.y > 1:
+        model_files = [Path(f"{result_cache.output_file(result_key)}_{i + 1}{suffix}") for i in range(tiles.x * tiles.y)]
+    else:
+        model_files = [Path(f"{result_cache.output_file(result_key)}{suffix}")]
+    elevation_raster = path_to_elevation_raster(get_elevation_hash(geometry, elevation_source), cache_dir)
+    return [result_cache.artifact(result_key)] + model_files + [elevation_raster]
+
+
+def get_profile_file(path: Path, job_id: str) -> Path:
+    return Path(path) / f"{job_id}.prof"
+
+
+def run_conversion(
+    geometry: dict,
+    result_key: str,
+    cache_dir: Path,
+    params: dict,
+    profile_slow_jobs: Union[None, float] = PROFILE_SLOW_JOBS,
+) -> Path:
+    """Converts the given geometry to a zipped STL file and adds it to the result cache.
+
+    Is executed in a worker process, hence all arguments need to be picklable. In case another process is already
+    computing the same result, this function waits for it to finish and returns the same archive instead of
+    computing it again. The conversion and hence mapa is only imported here, i.e. in the worker process and not by
+    the streamlit app. If `profile_slow_jobs` is given, the conversion is profiled and the cProfile stats of jobs
+    taking longer than this many seconds are stored next to the archive. Work done by the processes meshing the tiles
+    of a multi-tile output is not part of the stats.
+    """
+
+    from mapa_streamlit.conversion import convert_bbox_to_stl
+
+    result_cache = ResultCache(cache_dir)
+    lease = Lease(get_lease_file(cache_dir, result_key))
+    while not lease.acquire():
+        if result_cache.contains(result_key):
+            break
+        time.sleep(LEASE_POLLING_INTERVAL)
+    heartbeat = LeaseHeartbeat(lease)
+    if lease.acquired:
+        heartbeat.start()
+    try:
+        if result_cache.contains(result_key):
+            log.info(f"🤝  result {result_key} was computed by another process")
+            return result_cache.artifact(result_key)
+        progress_file = get_progress_file(cache_dir, result_key)
+        profiler = cProfile.Profile() if profile_slow_jobs else None
+        tiling = params.get("split_area_in_tiles", DEFAULT_TILING_FORMAT)
+        output_format = params.get("output_format", DEFAULT_OUTPUT_FORMAT)
+        elevation_source = params.get("elevation_source", DEFAULT_ELEVATION_SOURCE)
+        output_files = _get_output_files(geometry, result_key, cache_dir, tiling, output_format, elevation_source)
+        # e.g. the cached elevation array must not be evicted by the cleanup job of another replica while meshing
+        pin = Pin(cache_dir, *output_files)
+        pin.acquire()
+        start = time.perf_counter()
+        try:
+            with Metrics(cache_dir).span("conversion"):
+                if profiler:
+                    profiler.enable()
+                try:
+                    convert_bbox_to_stl(
+                        bbox_geometry=geometry,
+                        output_file=result_cache.output_file(result_key),
+                        progress_bar=FileProgressBar(progress_file),
+                        cache_dir=cache_dir,
+                        **params,
+                    )
+                finally:
+                    if profiler:
+                        profiler.disable()
+            duration = time.perf_counter() - start
+            if profiler and duration > profile_slow_jobs:
+                profile_file = get_profile_file(cache_dir, result_key)
+                profiler.dump_stats(profile_file)
+                CacheManifest(cache_dir).add(profile_file)
+                log.info(f"🐢  job {result_key} took {duration:.1f}s, stored its profile in: {profile_file}")
+            result_cache.add(result_key)
+            CacheManifest(cache_dir).add(*output_files)
+        finally:
+            pin.release()
+            progress_file.unlink(missing_ok=True)
+            # worker processes exit without running exit handlers
+            Metrics(cache_dir).flush()
+        return result_cache.artifact(result_key)
+    finally:
+        heartbeat.stop()
+        lease.release()
+
+
+def fetch_elevation(geometry: dict, cache_dir: Path, elevation_source: str = DEFAULT_ELEVATION_SOURCE) -> Path:
+    """Fetches the elevation data of the given geometry into the cache directory, e.g. for showing its preview.
+
+    Is executed in a worker process, hence the elevation array is not returned but its cached raster, which is read by
+    the streamlit app.
+    """
+
+    from mapa_streamlit.conversion import get_elevation_for_bbox, path_to_elevation_raster
+
+    get_elevation_for_bbox(geometry, cache_dir, elevation_source=elevation_source)
+    return path_to_elevation_raster(get_elevation_hash(geometry, elevation_source), cache_dir)
+
+
+def get_fetch_job_id(geometry: dict, elevation_source: str = DEFAULT_ELEVATION_SOURCE) -> str:
+    return f"elevation_{get_elevation_hash(geometry, elevation_source)}"
+
+
+class JobManager:
+    """Bounded pool of worker processes, which runs jobs outside of the streamlit script thread.
+
+    Jobs are identified by an id chosen by the caller. Submitting a job with the id of a job which is still queued,
+    pending or running does not start another computation. Jobs reserve their estimated memory with the admission
+    controller before they are started and are queued in order of submission, as long as the memory budget is
+    exhausted. Finished jobs are forgotten after `retention` seconds. In case a worker process dies, e.g. as it was
+    killed by the oom killer, its jobs fail and the worker pool is restarted. The progress of the running jobs is
+    kept in memory by a background thread.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_workers: int = MAX_WORKERS,
+        admission_controller: Union[None, AdmissionController] = None,
+        retention: float = FINISHED_JOB_RETENTION,
+    ) -> None:
+        self.path = Path(path)
+        self.max_workers = max_workers
+        self.retention = retention
+        self._executor = self._create_executor()
+        self._admission_controller = admission_controller or AdmissionController()
+        self._metrics = Metrics(self.path)
+        self._jobs: Dict[str, Future] = {}
+        self._finished: Dict[str, float] = {}
+        self._queue: "OrderedDict[str, Tuple[int, Callable, tuple, dict]]" = OrderedDict()
+        # reentrant, as done callbacks of already finished futures are invoked right away by the submitting thread
+        self._lock = threading.RLock()
+        self._progress_poller = ProgressPoller(self.path, self._running_jobs)
+        self._progress_poller.start()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # use spawn instead of fork, as forking the multi-threaded streamlit server is not safe
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=get_context("spawn"))
+
+    def _restart_broken_executor(self, executor: ProcessPoolExecutor) -> None:
+        with self._lock:
+            # all jobs of a broken pool fail at once, the pool is only restarted for the first of them
+            if self._executor is not executor:
+                return
+            log.error("⛔️  a worker process died unexpectedly, restarting the worker pool")
+            self._metrics.increment("worker_pool_restarts_total")
+            executor.shutdown(wait=False)
+            self._executor = self._create_executor()
+
+    def submit(self, job_id: str, fn: Callable, *args, memory: int = 0, **kwargs) -> str:
+        """Submits the given job, which is estimated to need the given memory in bytes. Raises `JobRejected` in case
+        the job would never fit into the memory budget."""
+
+        with self._lock:
+            self._prune_finished_jobs()
+            future = self._jobs.get(job_id)
+            if job_id in self._queue or (future is not None and not future.done()):
+                log.info(f"⏳  job {job_id} is already in progress")
+                return job_id
+            try:
+                self._admission_controller.check(job_id, memory)
+            except JobRejected:
+                self._metrics.increment("jobs_rejected_total")
+                raise
+            self._queue[job_id] = (memory, fn, args, kwargs)
+            self._start_queued_jobs()
+        return job_id
+
+    def _start_queued_jobs(self) -> None:
+        with self._lock:
+            while self._queue:
+                job_id, (memory, fn, args, kwargs) = next(iter(self._queue.items()))
+                # jobs are started in order of submission, so large jobs do not starve
+                if not self._admission_controller.reserve(job_id, memory):
+                    log.info(f"⏸  queueing job {job_id}, {len(self._queue)} job(s) waiting for memory")
+                    break
+                log.info(f"🚀  submitting job {job_id}")
+                try:
+                    executor = self._executor
+                    try:
+                        future = executor.submit(fn, *args, **kwargs)
+                    except BrokenProcessPool:
+                        # the pool broke before the done callbacks of its jobs were invoked
+                        self._restart_broken_executor(executor)
+                        executor = self._executor
+                        future = executor.submit(fn, *args, **kwargs)
+                except Exception:
+                    del self._queue[job_id]
+                    self._admission_controller.release(job_id)
+                    raise
+                # job is known at all times, as status is queried without holding the lock
+                self._jobs[job_id] = future
+                self._finished.pop(job_id, None)
+                del self._queue[job_id]
+                future.add_done_callback(
+                    lambda future, job_id=job_id, executor=executor: self._on_done(job_id, future, executor)
+                )
+            self._update_gauges()
+
+    def _running_jobs(self) -> List[str]:
+        with self._lock:
+            return [job_id for job_id, future in self._jobs.items() if future.running()]
+
+    def active_jobs(self) -> int:
+        """Returns the number of queued jobs and of submitted jobs, which are not finished yet."""
+
+        with self._lock:
+            return len(self._queue) + sum(not future.done() for future in self._jobs.values())
+
+    def _update_gauges(self) -> None:
+        with self._lock:
+            self._metrics.set_gauge("jobs_queued", len(self._queue))
+            self._metrics.set_gauge("jobs_running", self.active_jobs() - len(self._queue))
+            self._metrics.set_gauge("memory_reserved_bytes", self._admission_controller.reserved)
+            self._metrics.set_gauge("memory_budget_bytes", self._admission_controller.budget)
+
+    def _on_done(self, job_id: str, future: Future, executor: ProcessPoolExecutor) -> None:
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            log.error(f"⛔️  job {job_id} failed, as its worker process died")
+            self._restart_broken_executor(executor)
+        self._metrics.increment("jobs_total", status=self.status(job_id))
+        # reservations are released no matter whether the job succeeded or failed
+        self._admission_controller.release(job_id)
+        with self._lock:
+            self._finished[job_id] = time.monotonic()
+            self._prune_finished_jobs()
+        self._start_queued_jobs()
+
+    def _prune_finished_jobs(self) -> None:
+        with self._lock:
+            for job_id, finished in list(self._finished.items()):
+                if time.monotonic() - finished > self.retention:
+                    log.debug(f"🧹  forgetting finished job {job_id}")
+                    del self._finished[job_id]
+                    self._jobs.pop(job_id, None)
+
+    def status(self, job_id: str) -> Union[None, str]:
+        if job_id in self._queue:
+            return JobStatus.QUEUED
+        future = self._jobs.get(job_id)
+        if future is None:
+            return None
+        elif future.running():
+            return JobStatus.RUNNING
+        elif not future.done():
+            return JobStatus.PENDING
+        elif future.exception() is not None:
+            return JobStatus.FAILED
+        else:
+            return JobStatus.DONE
+
+    def progress(self, job_id: str) -> int:
+        """Returns the progress of the given job in percent."""
+
+        if self.status(job_id) == JobStatus.DONE:
+            return 100
+        return self._progress_poller.progress(job_id)
+
+    def error(self, job_id: str) -> Union[None, BaseException]:
+        future = self._jobs.get(job_id)
+        if future is None or not future.done():
+            return None
+        return future.exception()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._queue.clear()
+        self._progress_poller.stop()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,178 @@
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Union
+
+import psutil
+
+from mapa_streamlit.settings import LEASE_LOCK, LEASE_RENEWAL_INTERVAL, LEASE_TIMEOUT
+
+log = logging.getLogger(__name__)
+
+
+def get_lease_file(path: Path, key: str) -> Path:
+    return Path(path) / f"{key}.lease"
+
+
+class Lease:
+    """Lease file granting exclusive ownership of a computation across processes.
+
+    The lease file is created atomically and holds the pid and host of the owner. Leases of owners which are no
+    longer alive or which are older than the given timeout are considered stale and get broken. Breaking and
+    releasing leases is serialized by a lock file in the same directory, so a lease is only ever deleted by whoever
+    checked it, i.e. a fresh lease, which replaced a stale or released one, is never deleted by accident.
+    """
+
+    def __init__(self, path: Path, timeout: float = LEASE_TIMEOUT) -> None:
+        self.path = Path(path)
+        self.timeout = timeout
+        self.acquired = False
+        self._owner: Union[None, Dict] = None
+
+    def _read_owner(self) -> Union[None, Dict]:
+        try:
+            try:
+                with open(self.path, "r") as f:
+                    return json.load(f)
+            except json.JSONDecodeError:
+                # lease file is being written right now, unless its owner died in between creating and writing it
+                return {"created": self.path.stat().st_mtime, "host": None, "pid": None}
+        except FileNotFoundError:
+            return None
+
+    def _is_stale(self) -> bool:
+        owner = self._read_owner()
+        if owner is None:
+            return False
+        if time.time() - owner["created"] > self.timeout:
+            return True
+        return owner["host"] == socket.gethostname() and not psutil.pid_exists(owner["pid"])
+
+    def _get_lock(self) -> "FileLock":
+        return FileLock(self.path.parent / LEASE_LOCK)
+
+    def break_if_stale(self) -> bool:
+        """Deletes the lease file, if it is stale. Returns whether it was deleted."""
+
+        with self._get_lock():
+            # no other process deletes the lease file while the lock is held and a new lease cannot be created as
+            # long as the file exists, hence the checked lease file is the deleted one
+            if not self._is_stale():
+                return False
+            log.info(f"🔓  breaking stale lease: {self.path}")
+            self.path.unlink(missing_ok=True)
+            return True
+
+    def acquire(self) -> bool:
+        """Tries to acquire the lease without blocking. Returns whether the lease was acquired."""
+
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if self.break_if_stale():
+                return self.acquire()
+            return False
+        owner = {"pid": os.getpid(), "host": socket.gethostname(), "created": time.time()}
+        with os.fdopen(fd, "w") as f:
+            json.dump(owner, f)
+        self._owner = owner
+        self.acquired = True
+        return True
+
+    def renew(self) -> bool:
+        """Resets the age of the lease file, if it is still the one created by this lease. Returns whether it was."""
+
+        if not self.acquired:
+            return False
+        with self._get_lock():
+            if self._read_owner() != self._owner:
+                log.warning(f"⛔️  lease was broken while it was held: {self.path}")
+                return False
+            owner = {**self._owner, "created": time.time()}
+            # readers not holding the lock take a partially written lease file for a fresh one
+            with open(self.path, "w") as f:
+                json.dump(owner, f)
+            self._owner = owner
+            return True
+
+    def is_held(self) -> bool:
+        """Whether the lease is currently held by any (non-stale) owner."""
+        return self.path.is_file() and not self._is_stale()
+
+    def release(self) -> None:
+        """Deletes the lease file, if it is still the one created by this lease, i.e. it was not broken in between."""
+
+        if not self.acquired:
+            return
+        with self._get_lock():
+            if self._read_owner() == self._owner:
+                self.path.unlink(missing_ok=True)
+            else:
+                log.warning(f"⛔️  lease was broken while it was held: {self.path}")
+        self.acquired = False
+        self._owner = None
+
+
+class LeaseHeartbeat(threading.Thread):
+    """Background thread, which renews a held lease periodically.
+
+    Leases are considered stale after their timeout, hence computations which may take longer than that, e.g. a single
+    stage of a conversion, are run while the heartbeat is renewing their lease.
+    """
+
+    def __init__(self, lease: Lease, interval: float = LEASE_RENEWAL_INTERVAL) -> None:
+        super().__init__(name="mapa-lease-heartbeat", daemon=True)
+        self.lease = lease
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run_once(self) -> bool:
+        return self.lease.renew()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(timeout=self.interval):
+            try:
+                if not self.run_once():
+                    return
+            except Exception:
+                log.exception(f"⛔️  renewing the lease failed: {self.lease.path}")
+
+    def stop(self) -> None:
+        """Stops renewing the lease and waits for the thread to finish, hence the lease can be released afterwards."""
+
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+class FileLock:
+    """Exclusive lock across processes, threads and replicas sharing a volume, based on `flock` of a lock file.
+
+    In contrast to a lease, acquiring the lock blocks and the lock is released by the operating system when its owner
+    dies, hence it is never stale. Locks are meant for short critical sections, e.g. read-modify-write cycles of
+    bookkeeping files. An instance must not be shared between threads.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._fd: Union[None, int] = None
+
+    def __enter__(self) -> "FileLock":
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
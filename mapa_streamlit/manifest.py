@@ -0,0 +1,182 @@
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import List, Tuple, Union
+
+from mapa_streamlit.settings import (
+    BOOKKEEPING_FILE_PREFIX,
+    BOOKKEEPING_FILE_SUFFIXES,
+    CACHE_MANIFEST,
+    CACHE_RECONCILIATION_INTERVAL,
+)
+from mapa_streamlit.store import locked_transaction
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, size INTEGER NOT NULL, kind TEXT NOT NULL, atime REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS files_atime ON files (atime);
+CREATE TABLE IF NOT EXISTS totals (kind TEXT PRIMARY KEY, count INTEGER NOT NULL, size INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL);
+CREATE TRIGGER IF NOT EXISTS files_insert AFTER INSERT ON files BEGIN
+    INSERT INTO totals (kind, count, size) VALUES (NEW.kind, 1, NEW.size)
+    ON CONFLICT (kind) DO UPDATE SET count = count + 1, size = size + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS files_update AFTER UPDATE OF size ON files BEGIN
+    UPDATE totals SET size = size - OLD.size + NEW.size WHERE kind = NEW.kind;
+END;
+CREATE TRIGGER IF NOT EXISTS files_delete AFTER DELETE ON files BEGIN
+    UPDATE totals SET count = count - 1, size = size - OLD.size WHERE kind = OLD.kind;
+END;
+CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, size INTEGER NOT NULL, created REAL NOT NULL, last_hit REAL NOT NULL);
+CREATE TRIGGER IF NOT EXISTS files_delete_result AFTER DELETE ON files WHEN OLD.kind = '.zip' BEGIN
+    DELETE FROM results WHERE key = substr(OLD.name, 1, length(OLD.name) - 4);
+END;
+"""  # noqa: E501
+
+
+class CacheManifest:
+    """Persistent index of the files in the mapa cache directory.
+
+    Keeps track of size, kind (i.e. file suffix) and last access time of every file. Totals per kind are
+    maintained incrementally, so the size of the cache and the number of files can be queried without walking the
+    directory. Files written without notifying the manifest are picked up by an occasional reconciliation scan. The
+    manifest also holds the index of the result cache, whose entries are removed together with their archives.
+    """
+
+    def __init__(self, path: Path, manifest_name: str = CACHE_MANIFEST) -> None:
+        self.path = Path(path)
+        self.manifest_file = self.path / manifest_name
+        with closing(self._connect()) as con:
+            con.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.manifest_file, timeout=30.0)
+
+    def _name(self, file: Path) -> str:
+        return str(Path(file).relative_to(self.path))
+
+    def _is_bookkeeping_file(self, file: Path) -> bool:
+        # e.g. the manifest itself, the lock files or the leases of running jobs
+        return Path(file).name.startswith(BOOKKEEPING_FILE_PREFIX) or Path(file).suffix in BOOKKEEPING_FILE_SUFFIXES
+
+    def add(self, *files: Path) -> None:
+        """Adds the given files to the manifest or updates their size and access time. Missing files and bookkeeping
+        files are ignored."""
+
+        now = time.time()
+        rows = []
+        for file in files:
+            if self._is_bookkeeping_file(file):
+                continue
+            try:
+                rows.append((self._name(file), Path(file).stat().st_size, Path(file).suffix, now))
+            except FileNotFoundError:
+                continue
+        with locked_transaction(self.manifest_file) as con:
+            con.executemany(
+                "INSERT INTO files (name, size, kind, atime) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET size = excluded.size, atime = excluded.atime",
+                rows,
+            )
+
+    def remove(self, *files: Path) -> None:
+        with locked_transaction(self.manifest_file) as con:
+            con.executemany("DELETE FROM files WHERE name = ?", [(self._name(f),) for f in files])
+
+    def touch(self, *files: Path) -> None:
+        """Updates the access time of the given files."""
+
+        now = time.time()
+        with locked_transaction(self.manifest_file) as con:
+            con.executemany("UPDATE files SET atime = ? WHERE name = ?", [(now, self._name(f)) for f in files])
+
+    def size(self, kind: Union[None, str] = None) -> int:
+        """Returns the size in bytes of all files or of all files of the given kind, e.g. ".stl"."""
+
+        with closing(self._connect()) as con:
+            if kind is None:
+                row = con.execute("SELECT SUM(size) FROM totals").fetchone()
+            else:
+                row = con.execute("SELECT size FROM totals WHERE kind = ?", (kind,)).fetchone()
+        return row[0] if row and row[0] else 0
+
+    def count(self, kind: Union[None, str] = None) -> int:
+        with closing(self._connect()) as con:
+            if kind is None:
+                row = con.execute("SELECT SUM(count) FROM totals").fetchone()
+            else:
+                row = con.execute("SELECT count FROM totals WHERE kind = ?", (kind,)).fetchone()
+        return row[0] if row and row[0] else 0
+
+    def files(self, kind: Union[None, str] = None) -> List[Path]:
+        with closing(self._connect()) as con:
+            if kind is None:
+                rows = con.execute("SELECT name FROM files").fetchall()
+            else:
+                rows = con.execute("SELECT name FROM files WHERE kind = ?", (kind,)).fetchall()
+        return [self.path / name for name, in rows]
+
+    def least_recently_used(self) -> List[Tuple[Path, int]]:
+        """Returns all files together with their size in bytes, ordered by last access time, oldest first."""
+
+        with closing(self._connect()) as con:
+            rows = con.execute("SELECT name, size FROM files ORDER BY atime").fetchall()
+        return [(self.path / name, size) for name, size in rows]
+
+    def increment(self, key: str, value: float = 1) -> None:
+        """Increments a persistent counter, e.g. the number of evicted files."""
+
+        with locked_transaction(self.manifest_file) as con:
+            con.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = value + ?",
+                (key, value, value),
+            )
+
+    def counter(self, key: str) -> float:
+        with closing(self._connect()) as con:
+            row = con.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def needs_reconciliation(self, interval: float = CACHE_RECONCILIATION_INTERVAL) -> bool:
+        with closing(self._connect()) as con:
+            row = con.execute("SELECT value FROM meta WHERE key = 'reconciled'").fetchone()
+        return row is None or time.time() - row[0] > interval
+
+    def reconcile(self) -> None:
+        """Rebuilds the manifest from a single scan of the cache directory.
+
+        Access times of files which are already known are preserved.
+        """
+
+        log.info(f"🔎  reconciling cache manifest of: {self.path}")
+        rows = []
+        now = time.time()
+        for root, dirs, names in os.walk(self.path):
+            # nested stores like the dem tile store keep their own manifest, bookkeeping directories like the pins
+            # are not accounted as cached data
+            dirs[:] = [
+                d
+                for d in dirs
+                if not (Path(root) / d / self.manifest_file.name).is_file() and not self._is_bookkeeping_file(Path(d))
+            ]
+            for name in names:
+                file = Path(root) / name
+                if self._is_bookkeeping_file(file):
+                    continue
+                try:
+                    rows.append((self._name(file), file.stat().st_size, file.suffix, now))
+                except FileNotFoundError:
+                    continue
+        with locked_transaction(self.manifest_file) as con:
+            con.execute("CREATE TEMP TABLE scan (name TEXT PRIMARY KEY, size INTEGER, kind TEXT, atime REAL)")
+            con.executemany("INSERT INTO scan VALUES (?, ?, ?, ?)", rows)
+            con.execute("DELETE FROM files WHERE name NOT IN (SELECT name FROM scan)")
+            con.execute(
+                "INSERT INTO files (name, size, kind, atime) SELECT name, size, kind, atime FROM scan WHERE 1 "
+                "ON CONFLICT (name) DO UPDATE SET size = excluded.size"
+            )
+            con.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('reconciled', ?)", (now,))
@@ -0,0 +1,248 @@
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import psutil
+
+from mapa_streamlit.caching import ResultCache
+from mapa_streamlit.manifest import CacheManifest
+from mapa_streamlit.settings import METRICS_BUCKETS, METRICS_DIR, METRICS_FLUSH_INTERVAL, METRICS_STORE
+from mapa_streamlit.store import locked_transaction
+
+log = logging.getLogger(__name__)
+
+_PREFIX = "mapa_streamlit"
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (name, labels));
+CREATE TABLE IF NOT EXISTS gauges (name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (name, labels));
+CREATE TABLE IF NOT EXISTS buckets (stage TEXT NOT NULL, le REAL NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (stage, le));
+CREATE TABLE IF NOT EXISTS durations (stage TEXT PRIMARY KEY, count INTEGER NOT NULL, sum REAL NOT NULL);
+"""  # noqa: E501
+
+# help texts of the exported metrics, which are not part of the prometheus text format otherwise
+_HELP = {
+    "stage_duration_seconds": "Duration of the stages of the conversion pipeline in seconds.",
+    "jobs_total": "Number of finished conversion jobs by status.",
+    "jobs_rejected_total": "Number of conversion jobs rejected by the admission control.",
+    "worker_pool_restarts_total": "Number of restarts of the worker pool after a worker process died unexpectedly.",
+    "selections_rejected_total": "Number of selected regions rejected before conversion by reason.",
+    "result_cache_hits_total": "Number of lookups which found a finished archive in the result cache.",
+    "result_cache_misses_total": "Number of lookups which did not find a finished archive in the result cache.",
+    "evicted_files_total": "Number of files evicted from the mapa cache directory.",
+    "reclaimed_bytes_total": "Number of bytes reclaimed by evicting files from the mapa cache directory.",
+    "jobs_queued": "Number of conversion jobs waiting for memory.",
+    "jobs_running": "Number of conversion jobs submitted to the worker processes, which are not finished yet.",
+    "memory_reserved_bytes": "Memory in bytes reserved by running conversion jobs.",
+    "memory_budget_bytes": "Memory in bytes, which may be reserved by conversion jobs.",
+    "cache_size_bytes": "Size in bytes of the files in the mapa cache directory.",
+    "process_resident_memory_bytes": "Resident memory in bytes of the process serving the metrics.",
+}
+
+
+def _format_labels(**labels: str) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+def _format_sample(name: str, labels: str, value: float) -> str:
+    return f"{_PREFIX}_{name}{{{labels}}} {value:g}" if labels else f"{_PREFIX}_{name} {value:g}"
+
+
+class _Buffer:
+    """Metrics recorded by the current process, which are not written to the database yet."""
+
+    def __init__(self) -> None:
+        self.counters: Dict[Tuple[str, str], float] = {}
+        self.gauges: Dict[Tuple[str, str], float] = {}
+        self.durations: Dict[str, List[float]] = {}
+        self.last_flush = time.monotonic()
+
+
+# buffers of this process by database, shared by all instances of `Metrics`
+_buffers: Dict[Path, _Buffer] = {}
+_buffers_lock = threading.Lock()
+# serializes writing the buffers, so gauges are written in the order they were set
+_flush_lock = threading.Lock()
+
+
+class Metrics:
+    """Counters, gauges and stage durations of the app, which are persisted in the mapa cache directory.
+
+    Conversions run in worker processes, hence the metrics are kept in a sqlite database, which is shared by all
+    processes. The durations of the stages are recorded as histograms. Recorded metrics are buffered in memory by
+    each process and written to the database in one transaction at most every `flush_interval` seconds, before the
+    metrics are read and when the process exits. Worker processes do not run exit handlers, hence jobs flush their
+    metrics once they are finished. Replicas sharing the mapa cache directory can keep their metrics in a local
+    `metrics_dir` instead.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        store_name: str = METRICS_STORE,
+        flush_interval: float = METRICS_FLUSH_INTERVAL,
+        metrics_dir: Optional[Union[str, Path]] = METRICS_DIR,
+    ) -> None:
+        self.path = Path(path)
+        if metrics_dir is not None:
+            Path(metrics_dir).mkdir(parents=True, exist_ok=True)
+        self.store_file = Path(metrics_dir or path) / store_name
+        self.flush_interval = flush_interval
+
+    def _connect(self) -> sqlite3.Connection:
+        # the database is only accessed when flushing or reading the metrics, hence the schema is ensured right away
+        con = sqlite3.connect(self.store_file, timeout=30.0)
+        con.executescript(_SCHEMA)
+        return con
+
+    def _record(self, kind: str, key: Union[str, Tuple[str, str]], value: float) -> None:
+        with _buffers_lock:
+            buffer = _buffers.setdefault(self.store_file, _Buffer())
+            if kind == "counters":
+                buffer.counters[key] = buffer.counters.get(key, 0) + value
+            elif kind == "gauges":
+                buffer.gauges[key] = value
+            else:
+                buffer.durations.setdefault(key, []).append(value)
+            due = time.monotonic() - buffer.last_flush > self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the metrics buffered by this process to the database."""
+
+        with _flush_lock:
+            with _buffers_lock:
+                buffer = _buffers.get(self.store_file, _Buffer())
+                _buffers[self.store_file] = _Buffer()
+            if not (buffer.counters or buffer.gauges or buffer.durations):
+                return
+            buckets = [
+                (stage, le, sum(duration <= le for duration in durations))
+                for stage, durations in buffer.durations.items()
+                for le in METRICS_BUCKETS
+            ]
+            with locked_transaction(self.store_file) as con:
+                con.executescript(_SCHEMA)
+                con.executemany(
+                    "INSERT INTO counters (name, labels, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                    [(name, labels, value) for (name, labels), value in buffer.counters.items()],
+                )
+                con.executemany(
+                    "INSERT OR REPLACE INTO gauges (name, labels, value) VALUES (?, ?, ?)",
+                    [(name, labels, value) for (name, labels), value in buffer.gauges.items()],
+                )
+                con.executemany(
+                    "INSERT INTO buckets (stage, le, count) VALUES (?, ?, ?) "
+                    "ON CONFLICT (stage, le) DO UPDATE SET count = count + excluded.count",
+                    buckets,
+                )
+                con.executemany(
+                    "INSERT INTO durations (stage, count, sum) VALUES (?, ?, ?) "
+                    "ON CONFLICT (stage) DO UPDATE SET count = count + excluded.count, sum = sum + excluded.sum",
+                    [(stage, len(durations), sum(durations)) for stage, durations in buffer.durations.items()],
+                )
+
+    def increment(self, name: str, value: float = 1, **labels: str) -> None:
+        self._record("counters", (name, _format_labels(**labels)), value)
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        self._record("gauges", (name, _format_labels(**labels)), value)
+
+    def observe(self, stage: str, duration: float) -> None:
+        """Records the duration in seconds of the given stage."""
+
+        self._record("durations", stage, duration)
+        log.debug(f"⏱  {stage} took {duration:.3f}s")
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """Records the duration of the wrapped block as the given stage, no matter whether it raised or not."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def counters(self) -> List[Tuple[str, str, float]]:
+        self.flush()
+        with closing(self._connect()) as con:
+            return con.execute("SELECT name, labels, value FROM counters ORDER BY name, labels").fetchall()
+
+    def gauges(self) -> List[Tuple[str, str, float]]:
+        self.flush()
+        with closing(self._connect()) as con:
+            return con.execute("SELECT name, labels, value FROM gauges ORDER BY name, labels").fetchall()
+
+    def durations(self) -> Dict[str, Tuple[List[Tuple[float, int]], int, float]]:
+        """Returns the cumulative buckets, the count and the sum of the durations of each stage."""
+
+        self.flush()
+        with closing(self._connect()) as con:
+            buckets = con.execute("SELECT stage, le, count FROM buckets ORDER BY stage, le").fetchall()
+            totals = con.execute("SELECT stage, count, sum FROM durations ORDER BY stage").fetchall()
+        return {stage: ([(le, n) for s, le, n in buckets if s == stage], count, total) for stage, count, total in totals}
+
+
+@atexit.register
+def _flush_all() -> None:
+    for store_file in list(_buffers):
+        try:
+            Metrics(store_file.parent, store_name=store_file.name).flush()
+        except sqlite3.Error:
+            log.exception(f"⛔️  flushing the metrics to {store_file} failed")
+
+
+def export_metrics(path: Path) -> str:
+    """Returns all metrics of the given mapa cache directory in the prometheus text format.
+
+    Besides the metrics recorded by the app, the counters kept by the result cache and the cache manifest are
+    exported, as well as the memory of the current process. Metrics buffered by other processes are exported once
+    they flushed them.
+    """
+
+    metrics = Metrics(path)
+    samples: Dict[Tuple[str, str], List[str]] = {}
+
+    def _add(name: str, kind: str, sample: str) -> None:
+        samples.setdefault((name, kind), []).append(sample)
+
+    for stage, (buckets, count, total) in metrics.durations().items():
+        name = "stage_duration_seconds"
+        for le, n in buckets:
+            _add(name, "histogram", _format_sample(f"{name}_bucket", _format_labels(stage=stage, le=f"{le:g}"), n))
+        _add(name, "histogram", _format_sample(f"{name}_bucket", _format_labels(stage=stage, le="+Inf"), count))
+        _add(name, "histogram", _format_sample(f"{name}_sum", _format_labels(stage=stage), total))
+        _add(name, "histogram", _format_sample(f"{name}_count", _format_labels(stage=stage), count))
+
+    stats = ResultCache(path).stats()
+    manifest = CacheManifest(path)
+    counters = metrics.counters() + [
+        ("result_cache_hits_total", "", stats["hits"]),
+        ("result_cache_misses_total", "", stats["misses"]),
+        ("evicted_files_total", "", manifest.counter("evicted_files")),
+        ("reclaimed_bytes_total", "", manifest.counter("reclaimed_bytes")),
+    ]
+    for name, labels, value in counters:
+        _add(name, "counter", _format_sample(name, labels, value))
+
+    gauges = metrics.gauges() + [
+        ("cache_size_bytes", "", manifest.size()),
+        ("process_resident_memory_bytes", "", psutil.Process().memory_info().rss),
+    ]
+    for name, labels, value in gauges:
+        _add(name, "gauge", _format_sample(name, labels, value))
+
+    lines = []
+    for (name, kind), values in samples.items():
+        if name in _HELP:
+            lines.append(f"# HELP {_PREFIX}_{name} {_HELP[name]}")
+        lines.append(f"# TYPE {_PREFIX}_{name} {kind}")
+        lines.extend(values)
+    return "\n".join(lines) + "\n"
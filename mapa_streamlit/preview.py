@@ -0,0 +1,104 @@
+import logging
+from math import ceil
+from pathlib import Path
+from typing import NamedTuple, Tuple, Union
+
+import numpy as np
+from mapa.tiling import get_x_y_from_tiles_format
+from mapa.utils import ProgressBar
+from rasterio.enums import Resampling
+from rasterio.io import DatasetReader
+from rasterio.windows import Window
+
+from mapa_streamlit.conversion import open_elevation_for_bbox
+from mapa_streamlit.settings import DEFAULT_ELEVATION_SOURCE, PREVIEW_RESOLUTION
+
+log = logging.getLogger(__name__)
+
+# direction of the light source used for shading the preview, in degree
+_AZIMUTH = 315.0
+_ALTITUDE = 45.0
+_TILE_BORDER_COLOR = (255, 75, 75)
+
+
+class Preview(NamedTuple):
+    image: np.ndarray
+    # dimensions of the resulting 3d model in millimeter
+    x: float
+    y: float
+    z: float
+
+
+def _read_downsampled(raster: DatasetReader, rows: int, cols: int, resolution: int) -> Tuple[np.ndarray, int]:
+    # the upper left rows x cols window is read downsampled by GDAL, so the full array is never held in memory
+    step = max(1, ceil(max(rows, cols) / resolution))
+    array = raster.read(
+        1,
+        window=Window(0, 0, cols, rows),
+        out_shape=(ceil(rows / step), ceil(cols / step)),
+        resampling=Resampling.nearest,
+    )
+    return array.astype(float), step
+
+
+def _hillshade(array: np.ndarray, pixel_size: float) -> np.ndarray:
+    """Returns the shaded relief of the given elevation array as gray values in [0, 1]."""
+
+    dy, dx = np.gradient(array, pixel_size)
+    slope = np.pi / 2 - np.arctan(np.hypot(dx, dy))
+    aspect = np.arctan2(-dx, dy)
+    azimuth, altitude = np.radians(360.0 - _AZIMUTH), np.radians(_ALTITUDE)
+    shaded = np.sin(altitude) * np.sin(slope) + np.cos(altitude) * np.cos(slope) * np.cos(azimuth - aspect)
+    return np.clip(shaded, 0, 1)
+
+
+def _draw_tile_borders(image: np.ndarray, split_area_in_tiles: str) -> np.ndarray:
+    tiles = get_x_y_from_tiles_format(split_area_in_tiles)
+    rows, cols, _ = image.shape
+    # same split positions as `np.array_split`, which is used for splitting the model into tiles
+    for border in np.cumsum([len(a) for a in np.array_split(np.arange(rows), tiles.x)])[:-1]:
+        image[border, :] = _TILE_BORDER_COLOR
+    for border in np.cumsum([len(a) for a in np.array_split(np.arange(cols), tiles.y)])[:-1]:
+        image[:, border] = _TILE_BORDER_COLOR
+    return image
+
+
+def get_preview(
+    bbox_geometry: dict,
+    cache_dir: Path,
+    model_size: int,
+    z_offset: float,
+    z_scale: float,
+    ensure_squared: bool,
+    split_area_in_tiles: str,
+    resolution: int = PREVIEW_RESOLUTION,
+    progress_bar: Union[None, ProgressBar] = None,
+    elevation_source: str = DEFAULT_ELEVATION_SOURCE,
+) -> Preview:
+    """Computes a strongly downsampled, shaded relief of the given bounding box together with the approximate
+    dimensions of the 3d model, which would be generated using the given parameters.
+
+    The preview is based on the same cached elevation raster as the STL generation, hence it takes well below a
+    second once the elevation data of the bounding box is available and also speeds up the subsequent STL generation.
+    """
+
+    with open_elevation_for_bbox(
+        bbox_geometry, Path(cache_dir), progress_bar, elevation_source=elevation_source
+    ) as raster:
+        rows, cols = raster.height, raster.width
+        if ensure_squared:
+            # like `mapa.raster.cut_array_to_square`, which drops the last rows or columns
+            rows = cols = min(rows, cols)
+        elevation_scale = float(raster.tags()["elevation_scale"]) * model_size
+        array, step = _read_downsampled(raster, rows, cols, resolution)
+
+    # the elevation scale is the size of one meter in the model, hence the model width corresponds to
+    # model_size / elevation_scale meter in reality
+    pixel_size = model_size / cols / elevation_scale * step
+    gray = _hillshade(array * z_scale, pixel_size)
+    image = (np.stack([gray] * 3, axis=-1) * 255).astype(np.uint8)
+    image = _draw_tile_borders(image, split_area_in_tiles)
+
+    height = z_offset + (array.max() - array.min()) * elevation_scale * z_scale
+    log.debug(f"🔍  computed preview with shape {image.shape[:2]} of array with shape {(rows, cols)}")
+    return Preview(image=image, x=model_size, y=model_size / rows * cols, z=round(float(height), 1))
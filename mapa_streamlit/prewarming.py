@@ -0,0 +1,230 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Callable, Dict, List, Set, Tuple, Union
+
+import psutil
+
+from mapa_streamlit.admission import JobRejected
+from mapa_streamlit.caching import ResultCache, get_geometry_hash, get_result_key
+from mapa_streamlit.cleaning import cache_exceeds_quota
+from mapa_streamlit.estimation import estimate_cost
+from mapa_streamlit.jobs import JobManager, JobStatus, run_conversion
+from mapa_streamlit.metrics import Metrics
+from mapa_streamlit.settings import (
+    ACCESS_LOG,
+    ACCESS_LOG_MAX_ENTRIES,
+    DISK_CLEANING_THRESHOLD,
+    PREWARM_CPU_THRESHOLD,
+    PREWARM_DISK_BUDGET,
+    PREWARM_FAILURE_BACKOFF,
+    PREWARM_INTERVAL,
+    PREWARM_TOP_N,
+)
+from mapa_streamlit.store import locked_transaction
+from mapa_streamlit.verification import get_default_params, get_rejection_reason
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    result_key TEXT PRIMARY KEY,
+    geometry_hash TEXT NOT NULL,
+    geometry TEXT NOT NULL,
+    params TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS requests_geometry_hash ON requests (geometry_hash);
+"""
+
+
+def _canonical_json(obj: dict) -> str:
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"))
+
+
+class AccessLog:
+    """Compact log of the requested conversions, which is kept in the mapa cache directory.
+
+    Instead of one line per request, there is one row per distinct result, counting its requests. Once the log
+    exceeds its maximum number of entries, the least requested ones are dropped.
+    """
+
+    def __init__(self, path: Path, log_name: str = ACCESS_LOG, max_entries: int = ACCESS_LOG_MAX_ENTRIES) -> None:
+        self.path = Path(path)
+        self.log_file = self.path / log_name
+        self.max_entries = max_entries
+        with closing(self._connect()) as con:
+            con.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.log_file, timeout=30.0)
+
+    def record(self, geometry: dict, params: dict) -> None:
+        with locked_transaction(self.log_file) as con:
+            con.execute(
+                "INSERT INTO requests (result_key, geometry_hash, geometry, params, count, last_access) "
+                "VALUES (?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT (result_key) DO UPDATE SET count = count + 1, last_access = excluded.last_access",
+                (
+                    get_result_key(geometry, **params),
+                    get_geometry_hash(geometry),
+                    _canonical_json(geometry),
+                    _canonical_json(params),
+                    time.time(),
+                ),
+            )
+            (entries,) = con.execute("SELECT COUNT(*) FROM requests").fetchone()
+            if entries > self.max_entries:
+                con.execute(
+                    "DELETE FROM requests WHERE result_key IN "
+                    "(SELECT result_key FROM requests ORDER BY count, last_access LIMIT ?)",
+                    (entries - self.max_entries,),
+                )
+
+    def top_geometries(self, n: int) -> List[dict]:
+        """Returns the n most requested geometries, no matter with which parameters they were requested."""
+
+        with closing(self._connect()) as con:
+            rows = con.execute(
+                "SELECT geometry FROM requests GROUP BY geometry_hash "
+                "ORDER BY SUM(count) DESC, MAX(last_access) DESC LIMIT ?",
+                (n,),
+            ).fetchall()
+        return [json.loads(geometry) for geometry, in rows]
+
+
+def _cpu_is_idle(cpu_threshold: float) -> bool:
+    # measured since the previous call, i.e. across the interval of the prewarmer
+    return psutil.cpu_percent(interval=None) < cpu_threshold
+
+
+class Prewarmer(threading.Thread):
+    """Background thread which precomputes the outputs of the most requested geometries, so they are served from
+    the cache after the cache got cleaned up or the server got redeployed.
+
+    Outputs are computed using the default parameters of the app, which also caches the elevation data of the
+    geometry for all other parameters. The prewarmer only submits a job while the job manager is idle and the cpu
+    usage is below the given threshold, one job at a time. The estimated disk usage of the top geometries, counting
+    the ones which are cached already, is limited to the given budget in MB. Results which failed to be computed or
+    which were rejected by the admission control are skipped for `failure_backoff` seconds, doubling with every
+    further failure, so a failing geometry does not block the less requested ones.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        job_manager: JobManager,
+        conversion: Callable = run_conversion,
+        top_n: int = PREWARM_TOP_N,
+        disk_budget: float = PREWARM_DISK_BUDGET,
+        cpu_threshold: float = PREWARM_CPU_THRESHOLD,
+        interval: float = PREWARM_INTERVAL,
+        disk_cleaning_threshold: float = DISK_CLEANING_THRESHOLD,
+        failure_backoff: float = PREWARM_FAILURE_BACKOFF,
+    ) -> None:
+        super().__init__(name="mapa-prewarmer", daemon=True)
+        self.path = Path(path)
+        self.job_manager = job_manager
+        self.conversion = conversion
+        self.top_n = top_n
+        self.disk_budget = disk_budget
+        self.cpu_threshold = cpu_threshold
+        self.interval = interval
+        self.disk_cleaning_threshold = disk_cleaning_threshold
+        self.failure_backoff = failure_backoff
+        # number of failures and time after which a result is retried, by result key
+        self._failures: Dict[str, Tuple[int, float]] = {}
+        self._submitted: Set[str] = set()
+        self._stop_event = threading.Event()
+        _cpu_is_idle(cpu_threshold)
+
+    def _record_failure(self, result_key: str) -> None:
+        failures = self._failures.get(result_key, (0, 0.0))[0] + 1
+        backoff = self.failure_backoff * 2 ** (failures - 1)
+        self._failures[result_key] = (failures, time.time() + backoff)
+        log.warning(f"🔥  prewarming result {result_key} failed {failures} time(s), skipping it for {backoff:.0f}s")
+
+    def _is_backing_off(self, result_key: str) -> bool:
+        failure = self._failures.get(result_key)
+        return failure is not None and time.time() < failure[1]
+
+    def _check_submitted_jobs(self) -> None:
+        for job_id in list(self._submitted):
+            status = self.job_manager.status(job_id)
+            if status in (JobStatus.QUEUED, JobStatus.PENDING, JobStatus.RUNNING):
+                continue
+            self._submitted.discard(job_id)
+            if status == JobStatus.FAILED:
+                self._record_failure(job_id)
+            elif status == JobStatus.DONE:
+                self._failures.pop(job_id, None)
+
+    def _next_candidate(self) -> Union[None, dict]:
+        params = get_default_params()
+        result_cache = ResultCache(self.path)
+        disk_usage = 0
+        for geometry in AccessLog(self.path).top_geometries(self.top_n):
+            if get_rejection_reason(geometry, params):
+                continue
+            estimate = estimate_cost(
+                geometry, ensure_squared=params["ensure_squared"], split_area_in_tiles=params["split_area_in_tiles"]
+            )
+            disk_usage += estimate.fetch_size + estimate.output_size
+            if disk_usage > self.disk_budget * 1024**2:
+                return None
+            result_key = get_result_key(geometry, **params)
+            if not self._is_backing_off(result_key) and not result_cache.contains(result_key):
+                return dict(geometry=geometry, params=params, memory=estimate.peak_memory)
+        return None
+
+    def run_once(self) -> Union[None, str]:
+        """Submits the conversion of the most requested geometry, which is not cached yet. Returns its job id or None
+        in case there is nothing to do or the server is busy."""
+
+        self._check_submitted_jobs()
+        if self.job_manager.active_jobs():
+            log.debug("🔥  job manager is busy, skipping prewarming")
+            return None
+        if not _cpu_is_idle(self.cpu_threshold):
+            log.debug("🔥  cpu usage exceeds threshold, skipping prewarming")
+            return None
+        if cache_exceeds_quota(self.path, disk_cleaning_threshold=self.disk_cleaning_threshold):
+            log.debug("🔥  cache exceeds quota, skipping prewarming")
+            return None
+        while True:
+            candidate = self._next_candidate()
+            if candidate is None:
+                return None
+            geometry, params = candidate["geometry"], candidate["params"]
+            result_key = get_result_key(geometry, **params)
+            try:
+                job_id = self.job_manager.submit(
+                    result_key, self.conversion, geometry, result_key, self.path, params, memory=candidate["memory"]
+                )
+            except JobRejected as e:
+                # moves on to the next candidate, which might be smaller
+                log.warning(f"⛔️  {e}")
+                self._record_failure(result_key)
+                continue
+            break
+        self._submitted.add(job_id)
+        Metrics(self.path).increment("prewarmed_total")
+        log.info(f"🔥  prewarming result {result_key}")
+        return job_id
+
+    def run(self) -> None:
+        # the first run happens right after startup
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("⛔️  prewarming failed")
+            self._stop_event.wait(timeout=self.interval)
+
+    def stop(self) -> None:
+        self._stop_event.set()
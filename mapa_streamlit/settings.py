@@ -1,19 +1,143 @@
+import os
+from functools import lru_cache
 from importlib.metadata import version
 from typing import Tuple
 
-from mapa_streamlit import __version__
+import mapa_streamlit
 
 MAP_CENTER = [25.0, 55.0]
 MAP_ZOOM = 3
 
+BTN_LABEL_PREVIEW = "Preview"
 BTN_LABEL_CREATE_STL = "Create STL"
 BTN_LABEL_DOWNLOAD_STL = "Download STL"
-
-MAX_ALLOWED_AREA_SIZE = 25.0
+# the download link is styled like the streamlit buttons
+DOWNLOAD_LINK_STYLE = (
+    "display: inline-block; padding: 0.25rem 0.75rem; border: 1px solid rgba(49, 51, 63, 0.2); "
+    "border-radius: 0.5rem; color: inherit; text-decoration: none;"
+)
+
+# resolution in meter and in-memory size of a pixel of the ALOS DEM, used for estimating the cost of a selection
+DEM_RESOLUTION = 30.0
+DEM_BYTES_PER_PIXEL = 4
+# limits of the estimated cost of a selection, sizes in MB
+MAX_DEM_PIXELS = 250 * 10**6
+MAX_FETCH_SIZE = 2 * 1024
+MAX_PEAK_MEMORY = 4 * 1024
+MAX_TRIANGLES = 12 * 10**6
 
 DISK_CLEANING_THRESHOLD = 60.0
-
-ABOUT = f"""
+# maximum size of the mapa cache directory in MB and fraction of it, down to which files get evicted
+CACHE_SIZE_BUDGET = 10 * 1024
+CACHE_LOW_WATER_MARK = 0.8
+# ram usage in percent, above which files get evicted. Only helpful in case the mapa cache directory is located on a
+# ram based file system like tmpfs, hence disabled by default
+RAM_CLEANING_THRESHOLD = None
+# interval (in seconds) in which the janitor runs the cleanup job and minimum interval in between two runs
+JANITOR_INTERVAL = 10 * 60
+JANITOR_MIN_INTERVAL = 30
+
+# bookkeeping files in the mapa cache directory are not accounted as cached data
+BOOKKEEPING_FILE_PREFIX = "mapa_streamlit_"
+# neither are the files coordinating the running jobs, i.e. their leases and progress
+BOOKKEEPING_FILE_SUFFIXES = (".lease", ".progress")
+CACHE_MANIFEST = f"{BOOKKEEPING_FILE_PREFIX}manifest.sqlite"
+METRICS_STORE = f"{BOOKKEEPING_FILE_PREFIX}metrics.sqlite"
+# directory of the metrics database, which defaults to the mapa cache directory. Replicas sharing the cache directory
+# can keep their metrics in a local directory instead, so they don't contend for the database
+METRICS_DIR = os.getenv("MAPA_STREAMLIT_METRICS_DIR") or None
+# upper bounds (in seconds) of the buckets of the histograms of the durations of the pipeline stages
+METRICS_BUCKETS = (0.005, 0.025, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0)
+# metrics are buffered in memory by each process and written to the database at most every this many seconds
+METRICS_FLUSH_INTERVAL = 10.0
+# conversion jobs taking longer than this (in seconds) are profiled and their cProfile stats are stored next to the
+# archive, disabled by default
+PROFILE_SLOW_JOBS = float(os.getenv("MAPA_STREAMLIT_PROFILE_SLOW_JOBS", "0")) or None
+# interval (in seconds) in which the cache manifest is reconciled with the content of the cache directory
+CACHE_RECONCILIATION_INTERVAL = 60 * 60
+# raw dem tiles are shared across requests and are kept in a sub directory of the mapa cache directory with its own
+# budget in MB
+DEM_TILE_DIR = "dem_tiles"
+DEM_TILE_INDEX = f"{BOOKKEEPING_FILE_PREFIX}tiles.sqlite"
+DEM_TILE_BUDGET = 20 * 1024
+# creation options of the elevation rasters cached per bounding box, which are stored as internally tiled, compressed
+# GeoTIFFs. GDAL decompresses them transparently on read. A predictor matching the data type is added when writing,
+# which makes elevation data far more compressible
+ELEVATION_COMPRESSION = {
+    "compress": "zstd",
+    "zstd_level": 1,
+    "tiled": True,
+    "blockxsize": 256,
+    "blockysize": 256,
+}
+
+# maximum number of pixels along the longer side of the preview image
+PREVIEW_RESOLUTION = 200
+# number of rendered previews kept in memory by the app, shared by all sessions
+PREVIEW_CACHE_ENTRIES = 64
+
+MAX_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+
+
+def get_tile_workers(workers: int) -> int:
+    """Returns the maximum number of processes per job, which mesh the tiles of a multi-tile output in parallel, in
+    case the given number of jobs run in parallel. Each job gets its share of the cores, so they do not oversubscribe
+    the cpu."""
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+TILE_WORKERS = get_tile_workers(MAX_WORKERS)
+# fraction of the total memory of the host, which may be reserved by running jobs. Jobs exceeding the remaining budget
+# are queued, jobs exceeding the whole budget are rejected
+JOB_MEMORY_BUDGET = 0.5
+JOB_POLLING_INTERVAL = 1.0
+# finished jobs are kept for this many seconds, so all sessions polling them can report their outcome
+FINISHED_JOB_RETENTION = 10 * 60
+
+# finished archives and metrics are served by a separate http server, which supports range requests. It only listens
+# on localhost by default. Archives are only streamed to the browser via this server, if its public url is set
+# explicitly, e.g. when it is exposed via a reverse proxy. Otherwise the streamlit download button is used
+DOWNLOAD_ADDRESS = os.getenv("MAPA_STREAMLIT_DOWNLOAD_ADDRESS", "127.0.0.1")
+DOWNLOAD_PORT = int(os.getenv("MAPA_STREAMLIT_DOWNLOAD_PORT", "8502"))
+DOWNLOAD_URL = os.getenv("MAPA_STREAMLIT_DOWNLOAD_URL") or None
+
+# requested conversions are counted in a compact access log. The outputs of the most requested geometries are
+# precomputed using the default parameters while the server is idle, within a budget of the estimated disk usage in MB
+ACCESS_LOG = f"{BOOKKEEPING_FILE_PREFIX}access.sqlite"
+ACCESS_LOG_MAX_ENTRIES = 10_000
+PREWARM_TOP_N = int(os.getenv("MAPA_STREAMLIT_PREWARM_TOP_N", "50"))
+PREWARM_DISK_BUDGET = 2 * 1024
+# cpu usage in percent, above which the server is not considered idle
+PREWARM_CPU_THRESHOLD = 50.0
+PREWARM_INTERVAL = 5 * 60
+# results, which failed to be prewarmed, are skipped for this many seconds, doubling with every further failure
+PREWARM_FAILURE_BACKOFF = 60 * 60
+
+# the http api for submitting conversions without the streamlit UI, see `api.py`. It has no authentication, hence it
+# only listens on localhost by default
+API_ADDRESS = os.getenv("MAPA_STREAMLIT_API_ADDRESS", "127.0.0.1")
+API_PORT = int(os.getenv("MAPA_STREAMLIT_API_PORT", "8503"))
+
+# results of the batch cli are appended to this file in the output directory, one line of json per region
+BATCH_MANIFEST = "manifest.jsonl"
+BATCH_POLLING_INTERVAL = 0.5
+
+# leases older than this (in seconds) are considered stale, even if their owner is still alive
+LEASE_TIMEOUT = 30 * 60
+LEASE_POLLING_INTERVAL = 1.0
+# leases of running conversions are renewed this often (in seconds), hence conversions taking longer than the timeout
+# are not considered stale as long as their process is alive
+LEASE_RENEWAL_INTERVAL = LEASE_TIMEOUT / 10
+# breaking stale leases and releasing leases is serialized by a lock file next to the lease files
+LEASE_LOCK = f"{BOOKKEEPING_FILE_PREFIX}leases.lock"
+# several replicas may share the mapa cache directory. Files in use, e.g. archives being downloaded, are pinned
+# against eviction by pin files, which are considered stale after this many seconds. Read-modify-write cycles of
+# shared bookkeeping files are serialized by lock files
+PIN_DIR = f"{BOOKKEEPING_FILE_PREFIX}pins"
+PIN_TIMEOUT = 2 * 60 * 60
+STORE_LOCK = f"{BOOKKEEPING_FILE_PREFIX}store.lock"
+
+_ABOUT = """
 # mapa 🌍
 Hi my name is Fabian Gebhart :wave: and I am the author of mapa. mapa let's you create 3D-printable STL files
 from every region around the globe. The elevation data is retrieved from
@@ -25,16 +149,28 @@ For more details please refer to:
 * the [mapa-streamlit repo](https://github.com/fgebhart/mapa-streamlit) which contains the source code of this streamlit app or
 * the original [mapa repo](https://github.com/fgebhart/mapa) which contains the source code of the [mapa python package](https://pypi.org/project/mapa/)
 
-Made with mapa-streamlit v{__version__}
+Made with mapa-streamlit v{mapa_streamlit_version}
 
-Made with mapa v{version('mapa')}
+Made with mapa v{mapa_version}
 """
 
 
+@lru_cache(maxsize=None)
+def get_about() -> str:
+    # version metadata is resolved once on first use instead of at import time
+    return _ABOUT.format(mapa_streamlit_version=mapa_streamlit.__version__, mapa_version=version("mapa"))
+
+
 DEFAULT_Z_OFFSET = 2
 DEFAULT_Z_SCALE = 2.0
 DEFAULT_MODEL_SIZE = 100
 DEFAULT_TILING_FORMAT = "1x1"
+DEFAULT_TOLERANCE = 0.0
+DEFAULT_OUTPUT_FORMAT = "STL"
+DEFAULT_COMPRESSION = "default"
+# source of the elevation data, see `elevation.py`. Local sources allow running without network access
+DEFAULT_ELEVATION_SOURCE = "stac"
+ELEVATION_SOURCE = os.getenv("MAPA_STREAMLIT_ELEVATION_SOURCE", DEFAULT_ELEVATION_SOURCE)
 
 
 class ZOffsetSlider:
@@ -66,6 +202,18 @@ class ModelSizeSlider:
     )
 
 
+class ToleranceSlider:
+    label: str = "Mesh tolerance:"
+    min_value: float = 0.0
+    max_value: float = 1.0
+    value: float = DEFAULT_TOLERANCE
+    step: float = 0.05
+    help: str = (
+        "Maximum deviation (in millimeter) of the 3D model from the elevation data. Larger values merge the triangles "
+        "of flat regions like lakes or plains, which shrinks the STL file. Use 0 to keep all triangles."
+    )
+
+
 class SquaredCheckbox:
     label: str = "Squared model output?"
     help: str = (
@@ -83,3 +231,22 @@ class TilingSelect:
         "aiming for a print larger than the printer area. The first number splits the north-south axis and the "
         "second number splits the west-east axis."
     )
+
+
+class OutputFormatSelect:
+    label: str = "Output format:"
+    options: Tuple[str] = (DEFAULT_OUTPUT_FORMAT, "3MF")
+    help: str = (
+        "File format of the 3D model. STL is supported by every slicer, 3MF files store each corner of the model "
+        "only once and are therefore considerably smaller."
+    )
+
+
+class CompressionSelect:
+    label: str = "Archive compression:"
+    options: Tuple[str] = (DEFAULT_COMPRESSION, "fast", "best", "store")
+    help: str = (
+        "Compression of the zip archive containing the 3D model file(s). 'fast' and 'store' finish the archive "
+        "quicker, 'best' results in slightly smaller downloads. 3MF files are always stored, as they are compressed "
+        "already."
+    )
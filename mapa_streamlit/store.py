@@ -0,0 +1,106 @@
+"""Primitives for sharing the mapa cache directory between several replicas of the app, e.g. on a shared volume.
+
+- Files are written to a unique temporary file and published by an atomic rename, so readers never see partial
+  files. Temporary files are unique across hosts, since replicas running in containers often share their pids.
+- Files in use are pinned, so the cleanup job of any replica does not evict them. Pins are checked and created
+  while holding the store lock of the directory, hence a file is never pinned in between checking and evicting it.
+- Writers of the sqlite databases in the cache directory are serialized by a lock file next to the database, instead
+  of relying on the file locking of sqlite only, which is broken on some network filesystems. Still, the shared
+  volume needs to support `flock`, e.g. a local disk, a block volume or NFSv4, but not e.g. NFSv3 or SMB.
+"""
+import logging
+import os
+import sqlite3
+import uuid
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Iterator, List, Set
+
+from mapa_streamlit.locking import FileLock, Lease
+from mapa_streamlit.settings import PIN_DIR, PIN_TIMEOUT, STORE_LOCK
+
+log = logging.getLogger(__name__)
+
+
+def get_tmp_file(file: Path) -> Path:
+    return Path(file).with_name(f"{Path(file).name}.{uuid.uuid4().hex}.tmp")
+
+
+@contextmanager
+def atomic_write(file: Path) -> Iterator[Path]:
+    """Yields a temporary file, which replaces the given file once the block finished without raising."""
+
+    tmp_file = get_tmp_file(file)
+    try:
+        yield tmp_file
+        os.replace(tmp_file, file)
+    finally:
+        tmp_file.unlink(missing_ok=True)
+
+
+@contextmanager
+def locked_transaction(database: Path) -> Iterator[sqlite3.Connection]:
+    """Yields a connection to the given sqlite database, whose transaction is committed once the block finished
+    without raising. Writers of the database are serialized by a lock file."""
+
+    database = Path(database)
+    with FileLock(database.with_name(f"{database.name}.lock")):
+        with closing(sqlite3.connect(database, timeout=30.0)) as con, con:
+            yield con
+
+
+def get_store_lock(path: Path) -> FileLock:
+    return FileLock(Path(path) / STORE_LOCK)
+
+
+class Pin:
+    """Pins the given files of a cache directory against eviction while the pin is held.
+
+    Each pinned file gets a lease file in the pin directory, so pins of owners which died are detected like stale
+    leases. Pinning files, which do not exist (yet), is fine, e.g. the outputs of a running conversion.
+    """
+
+    def __init__(self, path: Path, *files: Path, timeout: float = PIN_TIMEOUT) -> None:
+        self.path = Path(path)
+        self.files = files
+        self.timeout = timeout
+        self._leases: List[Lease] = []
+
+    def acquire(self) -> None:
+        pin_dir = self.path / PIN_DIR
+        pin_dir.mkdir(exist_ok=True)
+        with get_store_lock(self.path):
+            for file in self.files:
+                lease = Lease(pin_dir / f"{Path(file).name}.{uuid.uuid4().hex}.pin", timeout=self.timeout)
+                lease.acquire()
+                self._leases.append(lease)
+
+    def release(self) -> None:
+        for lease in self._leases:
+            lease.release()
+        self._leases = []
+
+    def __enter__(self) -> "Pin":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+def get_pinned_files(path: Path, timeout: float = PIN_TIMEOUT) -> Set[Path]:
+    """Returns the pinned files of the given cache directory and removes stale pins. Should be called while holding
+    the store lock, so no pins are added in the meantime."""
+
+    pin_dir = Path(path) / PIN_DIR
+    if not pin_dir.is_dir():
+        return set()
+    pinned = set()
+    for pin_file in pin_dir.glob("*.pin"):
+        lease = Lease(pin_file, timeout=timeout)
+        if lease.is_held():
+            # strips the unique id and the suffix of the pin
+            pinned.add(Path(path) / pin_file.name.rsplit(".", 2)[0])
+        elif lease.break_if_stale():
+            log.info(f"🔓  removed stale pin: {pin_file}")
+    return pinned
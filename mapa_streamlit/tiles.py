@@ -0,0 +1,157 @@
+import logging
+import sqlite3
+import time
+from contextlib import closing
+from math import ceil, floor
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Tuple, Union
+from urllib import request
+
+from mapa_streamlit.locking import Lease, get_lease_file
+from mapa_streamlit.manifest import CacheManifest
+from mapa_streamlit.settings import DEM_TILE_DIR, DEM_TILE_INDEX, LEASE_POLLING_INTERVAL
+from mapa_streamlit.store import atomic_write, locked_transaction
+
+if TYPE_CHECKING:
+    from mapa.utils import ProgressBar
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cells (lon INTEGER NOT NULL, lat INTEGER NOT NULL, PRIMARY KEY (lon, lat));
+CREATE TABLE IF NOT EXISTS tiles (
+    id TEXT PRIMARY KEY,
+    href TEXT NOT NULL,
+    min_lon REAL NOT NULL,
+    min_lat REAL NOT NULL,
+    max_lon REAL NOT NULL,
+    max_lat REAL NOT NULL
+);
+"""
+
+
+def get_tile_dir(path: Path) -> Path:
+    tile_dir = Path(path) / DEM_TILE_DIR
+    if not tile_dir.is_dir():
+        tile_dir.mkdir()
+    return tile_dir
+
+
+def get_bbox(geometry: dict) -> Tuple[float, float, float, float]:
+    """Returns min lon, min lat, max lon and max lat of the given GeoJSON polygon."""
+
+    lons = [c[0] for c in geometry["coordinates"][0]]
+    lats = [c[1] for c in geometry["coordinates"][0]]
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def get_cells(bbox: Tuple[float, float, float, float]) -> List[Tuple[int, int]]:
+    """Returns the 1x1 degree grid cells (identified by their south west corner) touched by the bounding box."""
+
+    min_lon, min_lat, max_lon, max_lat = bbox
+    lons = range(floor(min_lon), max(ceil(max_lon), floor(min_lon) + 1))
+    lats = range(floor(min_lat), max(ceil(max_lat), floor(min_lat) + 1))
+    return [(lon, lat) for lon in lons for lat in lats]
+
+
+def _search_tiles(bbox: Tuple[float, float, float, float]) -> List[Tuple[str, str, Tuple[float, float, float, float]]]:
+    """Searches the STAC catalogue for DEM tiles intersecting the bounding box. Returns id, href and bbox of each."""
+
+    from mapa import conf
+    from pystac_client import Client
+
+    client = Client.open(conf.PLANETARY_COMPUTER_API_URL, ignore_conformance=True)
+    search = client.search(collections=[conf.PLANETARY_COMPUTER_COLLECTION], bbox=list(bbox))
+    return [(item.id, item.assets["data"].href, tuple(item.bbox)) for item in search.items()]
+
+
+def _download_file(url: str, local_file: Path) -> Path:
+    request.urlretrieve(url, local_file)
+    return local_file
+
+
+class TileStore:
+    """Store of raw DEM tiles, which is shared by all sessions and requests.
+
+    Tiles are kept in their own directory and are keyed by their STAC item id. The footprints of all tiles found
+    so far are indexed per 1x1 degree grid cell, so the STAC catalogue only needs to be searched for cells which
+    were not searched before and only tiles which are missing get downloaded. The tile directory keeps its own
+    manifest, which allows evicting tiles independent of the per-request outputs.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.index_file = self.path / DEM_TILE_INDEX
+        self.manifest = CacheManifest(self.path)
+        with closing(self._connect()) as con:
+            con.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.index_file, timeout=30.0)
+
+    def tile_path(self, tile_id: str) -> Path:
+        return self.path / f"{tile_id}.tiff"
+
+    def _find_tiles(self, bbox: Tuple[float, float, float, float]) -> List[Tuple[str, str]]:
+        cells = get_cells(bbox)
+        with closing(self._connect()) as con:
+            known_cells = set(con.execute("SELECT lon, lat FROM cells").fetchall())
+        if not set(cells).issubset(known_cells):
+            # search the whole grid cells, so they never need to be searched again
+            min_lon, min_lat = cells[0]
+            max_lon, max_lat = cells[-1]
+            log.info(f"🔎  searching stac items for grid cells: {cells}")
+            tiles = _search_tiles((min_lon, min_lat, max_lon + 1, max_lat + 1))
+            with locked_transaction(self.index_file) as con:
+                con.executemany(
+                    "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?)",
+                    [(tile_id, href, *tile_bbox) for tile_id, href, tile_bbox in tiles],
+                )
+                con.executemany("INSERT OR IGNORE INTO cells VALUES (?, ?)", cells)
+        with closing(self._connect()) as con:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            return con.execute(
+                "SELECT id, href FROM tiles WHERE min_lon < ? AND max_lon > ? AND min_lat < ? AND max_lat > ? "
+                "ORDER BY id",
+                (max_lon, min_lon, max_lat, min_lat),
+            ).fetchall()
+
+    def _fetch_tile(self, tile_id: str, href: str) -> Path:
+        """Downloads the given tile, unless it is already present. Concurrent downloads of the same tile by other
+        processes are awaited instead of downloading the tile twice."""
+
+        tile = self.tile_path(tile_id)
+        lease = Lease(get_lease_file(self.path, tile_id))
+        while not tile.is_file():
+            if not lease.acquire():
+                time.sleep(LEASE_POLLING_INTERVAL)
+                continue
+            try:
+                if not tile.is_file():
+                    with atomic_write(tile) as tmp_file:
+                        _download_file(href, tmp_file)
+                    self.manifest.add(tile)
+            finally:
+                lease.release()
+        return tile
+
+    def get_tiles(self, bbox_geometry: dict, progress_bar: Union[None, "ProgressBar"] = None) -> List[Path]:
+        from mapa.exceptions import NoSTACItemFound
+
+        tiles = self._find_tiles(get_bbox(bbox_geometry))
+        n = len(tiles)
+        if n == 0:
+            raise NoSTACItemFound("Could not find the desired STAC item for the given bounding box.")
+        if progress_bar:
+            progress_bar.steps += n
+        files = []
+        for cnt, (tile_id, href) in enumerate(tiles):
+            if self.tile_path(tile_id).is_file():
+                log.info(f"🚀  {cnt + 1}/{n} using cached dem tile {tile_id}")
+            else:
+                log.info(f"🏞  {cnt + 1}/{n} downloading dem tile {tile_id}")
+            files.append(self._fetch_tile(tile_id, href))
+            if progress_bar:
+                progress_bar.step()
+        self.manifest.touch(*files)
+        return files
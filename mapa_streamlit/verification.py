@@ -1,25 +1,101 @@
 import logging
-from math import sqrt
-from typing import List
+import math
+from typing import List, Union
+
+from mapa_streamlit.estimation import CostEstimate, estimate_cost
+from mapa_streamlit.settings import (
+    DEFAULT_COMPRESSION,
+    DEFAULT_OUTPUT_FORMAT,
+    DEFAULT_TILING_FORMAT,
+    ELEVATION_SOURCE,
+    MAX_DEM_PIXELS,
+    MAX_FETCH_SIZE,
+    MAX_PEAK_MEMORY,
+    MAX_TRIANGLES,
+    TILE_WORKERS,
+    CompressionSelect,
+    ModelSizeSlider,
+    OutputFormatSelect,
+    TilingSelect,
+    ToleranceSlider,
+    ZOffsetSlider,
+    ZScaleSlider,
+)
 
 log = logging.getLogger(__name__)
 
 
-def _get_distance(c1: List[float], c2: List[float]) -> float:
-    return sqrt((c1[0] - c2[0]) ** 2 + (c1[1] - c2[1]) ** 2)
+def _to_int(value: Union[str, int, float]) -> int:
+    # integral floats like 100.0 are accepted, e.g. as written by spreadsheets
+    number = float(value)
+    if not number.is_integer():
+        raise ValueError(f"not an integer: {value}")
+    return int(number)
 
 
-def _get_area(bbox: List[List[float]]) -> float:
-    width = _get_distance(c1=bbox[0], c2=bbox[1])
-    height = _get_distance(c1=bbox[1], c2=bbox[2])
-    return round(abs(width * height), 2)
+# parameters which can be given per selection by the batch cli or the http api, along with their type. The elevation
+# source is the same for all selections, since it is a setting of the server rather than of the model
+PARAMS = {
+    "model_size": _to_int,
+    "z_scale": float,
+    "z_offset": float,
+    "ensure_squared": lambda value: str(value).strip().lower() in ("1", "true", "yes"),
+    "split_area_in_tiles": str,
+    "tolerance": float,
+    "output_format": str,
+    "compression": str,
+}
 
 
-def selected_bbox_too_large(geometry: dict, threshold: float) -> bool:
-    bbox = geometry["coordinates"][0]
-    area = _get_area(bbox=bbox)
-    log.info(f"📏  area with size: {area} was selected, threshold is: {threshold}")
-    return area > threshold
+def get_default_params() -> dict:
+    return dict(
+        model_size=ModelSizeSlider.value,
+        z_scale=ZScaleSlider.value,
+        z_offset=ZOffsetSlider.value,
+        ensure_squared=False,
+        split_area_in_tiles=DEFAULT_TILING_FORMAT,
+        tolerance=ToleranceSlider.value,
+        output_format=DEFAULT_OUTPUT_FORMAT,
+        compression=DEFAULT_COMPRESSION,
+        elevation_source=ELEVATION_SOURCE,
+    )
+
+
+def parse_params(values: dict, defaults: dict) -> dict:
+    """Returns the given defaults, updated with the known parameters among the given values, cast to their type.
+    Raises a ValueError naming the parameter, in case a value cannot be cast."""
+
+    params = dict(defaults)
+    for key, value in values.items():
+        if key in PARAMS and value not in (None, ""):
+            try:
+                params[key] = PARAMS[key](value)
+            except (TypeError, ValueError, OverflowError):
+                raise ValueError(f"invalid {key}: {value!r}") from None
+    return params
+
+
+def exceeded_cost_limits(
+    estimate: CostEstimate,
+    max_dem_pixels: int = MAX_DEM_PIXELS,
+    max_fetch_size: float = MAX_FETCH_SIZE,
+    max_peak_memory: float = MAX_PEAK_MEMORY,
+    max_triangles: int = MAX_TRIANGLES,
+) -> List[str]:
+    """Returns the names of all limits exceeded by the estimated cost of a selection. Sizes are given in MB."""
+
+    exceeded = []
+    if estimate.dem_pixels > max_dem_pixels:
+        exceeded.append("elevation data points")
+    if estimate.fetch_size > max_fetch_size * 1024**2:
+        exceeded.append("data to download")
+    if estimate.peak_memory > max_peak_memory * 1024**2:
+        exceeded.append("memory")
+    if estimate.triangles > max_triangles:
+        exceeded.append("triangles")
+    if exceeded:
+        log.info(f"📏  selected area exceeds the limits of: {exceeded}")
+    return exceeded
 
 
 class CoordinateBoundaries:
@@ -29,6 +105,23 @@ class CoordinateBoundaries:
     lat_max: int = 90
 
 
+def _is_position(position: list) -> bool:
+    return (
+        isinstance(position, (list, tuple))
+        and len(position) >= 2
+        and all(isinstance(c, (int, float)) and not isinstance(c, bool) and math.isfinite(c) for c in position[:2])
+    )
+
+
+def has_valid_coordinates(geometry: dict) -> bool:
+    """Whether the outer ring of the given polygon is a list of at least four positions of finite coordinates."""
+
+    rings = geometry.get("coordinates")
+    if not isinstance(rings, list) or not rings or not isinstance(rings[0], list) or len(rings[0]) < 4:
+        return False
+    return all(_is_position(position) for position in rings[0])
+
+
 def selected_bbox_in_boundary(geometry: dict, boundary: CoordinateBoundaries = CoordinateBoundaries) -> bool:
     bbox = geometry["coordinates"][0]
     for coordinate in bbox:
@@ -39,3 +132,45 @@ def selected_bbox_in_boundary(geometry: dict, boundary: CoordinateBoundaries = C
         elif lat < boundary.lat_min or lat > boundary.lat_max:
             return False
     return True
+
+
+# numeric parameters, which are bounded by the sliders of the app
+_SLIDERS = {
+    "model_size": ModelSizeSlider,
+    "z_scale": ZScaleSlider,
+    "z_offset": ZOffsetSlider,
+    "tolerance": ToleranceSlider,
+}
+
+
+def get_rejection_reason(geometry: dict, params: dict, tile_workers: int = TILE_WORKERS) -> Union[None, str]:
+    """Applies the checks of the app to a selection submitted without the UI, i.e. by the batch cli or the http api.
+    Besides the geometry, the parameters are restricted to the options and ranges offered by the app. Returns the
+    reason, why the given geometry and conversion parameters get rejected, otherwise None."""
+
+    if not isinstance(geometry, dict) or geometry.get("type") != "Polygon" or not geometry.get("coordinates"):
+        return "geometry is not a polygon"
+    if not has_valid_coordinates(geometry):
+        return "polygon has invalid coordinates"
+    if params["output_format"] not in OutputFormatSelect.options:
+        return f"unknown output format: {params['output_format']}"
+    if params["compression"] not in CompressionSelect.options:
+        return f"unknown compression: {params['compression']}"
+    if params["split_area_in_tiles"] not in TilingSelect.options:
+        return f"invalid tiling format: {params['split_area_in_tiles']}"
+    for name, slider in _SLIDERS.items():
+        # also rejects nan
+        if not slider.min_value <= params[name] <= slider.max_value:
+            return f"{name} is not within {slider.min_value} and {slider.max_value}: {params[name]}"
+    if not selected_bbox_in_boundary(geometry):
+        return "not within the boundaries of the world map"
+    estimate = estimate_cost(
+        geometry,
+        ensure_squared=params["ensure_squared"],
+        split_area_in_tiles=params["split_area_in_tiles"],
+        tile_workers=tile_workers,
+    )
+    exceeded = exceeded_cost_limits(estimate)
+    if exceeded:
+        return f"exceeds the limits of: {', '.join(exceeded)}"
+    return None
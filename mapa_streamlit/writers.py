@@ -0,0 +1,139 @@
+import logging
+import time
+import zipfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import BinaryIO, Dict, Tuple, Union
+
+import numpy as np
+from mapa.stl_file import save_to_stl_file
+
+from mapa_streamlit.settings import DEFAULT_COMPRESSION, DEFAULT_OUTPUT_FORMAT
+
+log = logging.getLogger(__name__)
+
+# zip compression method and level per user facing compression option
+COMPRESSIONS: Dict[str, Tuple[int, Union[None, int]]] = {
+    "default": (zipfile.ZIP_DEFLATED, 6),
+    "fast": (zipfile.ZIP_DEFLATED, 1),
+    "best": (zipfile.ZIP_DEFLATED, 9),
+    "store": (zipfile.ZIP_STORED, None),
+}
+
+_3MF_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>
+</Types>
+"""
+_3MF_RELS = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>
+</Relationships>
+"""
+_3MF_MODEL_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<model unit="millimeter" xml:lang="en-US" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">
+<resources><object id="1" type="model"><mesh><vertices>
+"""
+_3MF_MODEL_FOOTER = """</triangles></mesh></object></resources>
+<build><item objectid="1"/></build>
+</model>
+"""
+
+
+def _write_rows(stream: BinaryIO, fmt: str, rows: np.ndarray, chunk_size: int = 2**16) -> None:
+    # formatting a whole chunk at once is several times faster than np.savetxt, which formats row by row
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:][:chunk_size]
+        stream.write((fmt * len(chunk) % tuple(chunk.ravel().tolist())).encode())
+
+
+class OutputWriter(ABC):
+    """Writes the triangles of a 3d model to a file of a certain format."""
+
+    suffix: str = ""
+    # whether files of this format shrink when being deflated, otherwise they are stored in the archive as they are
+    compressible: bool = True
+
+    @abstractmethod
+    def write(self, triangles: np.ndarray, output_file: Union[str, Path]) -> Path:
+        """Writes the given (n, 3, 3) triangles to the given output file without file ending."""
+
+
+class BinarySTLWriter(OutputWriter):
+    suffix = ".stl"
+
+    def write(self, triangles: np.ndarray, output_file: Union[str, Path]) -> Path:
+        return Path(save_to_stl_file(triangles, f"{output_file}{self.suffix}", as_ascii=False))
+
+
+class ThreeMFWriter(OutputWriter):
+    """3D Manufacturing Format, i.e. a zip container with an indexed mesh, which is much smaller than STL as shared
+    vertices are only stored once."""
+
+    suffix = ".3mf"
+    compressible = False
+
+    def write(self, triangles: np.ndarray, output_file: Union[str, Path]) -> Path:
+        # vertices are merged on a 0.1 micrometer grid. Comparing them as raw bytes is much faster than np.unique on
+        # the rows of a float array, big endian keeps the vertices sorted, which results in better compression
+        quantized = np.ascontiguousarray(np.round(triangles.reshape(-1, 3) * 1e4).astype(">i8"))
+        keys, indices = np.unique(quantized.view(np.dtype((np.void, 24))).ravel(), return_inverse=True)
+        vertices = keys.view(">i8").reshape(-1, 3) / 1e4
+        indices = indices.reshape(-1, 3)
+        # degenerated triangles are not allowed in 3mf files
+        indices = indices[(indices[:, 0] != indices[:, 1]) & (indices[:, 1] != indices[:, 2])]
+        indices = indices[indices[:, 0] != indices[:, 2]]
+
+        output_file = Path(f"{output_file}{self.suffix}")
+        with zipfile.ZipFile(output_file, "w", zipfile.ZIP_DEFLATED) as container:
+            container.writestr("[Content_Types].xml", _3MF_CONTENT_TYPES)
+            container.writestr("_rels/.rels", _3MF_RELS)
+            with container.open("3D/3dmodel.model", "w", force_zip64=True) as model:
+                model.write(_3MF_MODEL_HEADER.encode())
+                _write_rows(model, '<vertex x="%.4f" y="%.4f" z="%.4f"/>\n', vertices)
+                model.write(b"</vertices><triangles>\n")
+                _write_rows(model, '<triangle v1="%d" v2="%d" v3="%d"/>\n', indices)
+                model.write(_3MF_MODEL_FOOTER.encode())
+        log.info(f"🎉  successfully generated 3MF file: {output_file.absolute()}")
+        return output_file
+
+
+WRITERS: Dict[str, OutputWriter] = {"STL": BinarySTLWriter(), "3MF": ThreeMFWriter()}
+
+
+def get_writer(output_format: str = DEFAULT_OUTPUT_FORMAT) -> OutputWriter:
+    try:
+        return WRITERS[output_format]
+    except KeyError:
+        raise ValueError(f"Unknown output format: {output_format}, choose one of: {list(WRITERS)}")
+
+
+class ArchiveWriter:
+    """Zip archive, to which the output files are added one by one."""
+
+    def __init__(
+        self, output_file: Path, output_format: str = DEFAULT_OUTPUT_FORMAT, compression: str = DEFAULT_COMPRESSION
+    ) -> None:
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}, choose one of: {list(COMPRESSIONS)}")
+        method, level = COMPRESSIONS[compression]
+        if not get_writer(output_format).compressible:
+            # deflating already compressed files costs time without saving space
+            method, level = zipfile.ZIP_STORED, None
+        self._zip_file = zipfile.ZipFile(output_file, "w", compression=method, compresslevel=level)
+        self.duration = 0.0
+
+    def add(self, file: Path) -> None:
+        start = time.perf_counter()
+        self._zip_file.write(file, file.name)
+        self.duration += time.perf_counter() - start
+
+    def close(self) -> None:
+        self._zip_file.close()
+
+    def __enter__(self) -> "ArchiveWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -8,7 +8,14 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.wait import WebDriverWait
 
 from mapa_streamlit import __version__
-from mapa_streamlit.settings import DEFAULT_TILING_FORMAT, ModelSizeSlider, TilingSelect, ZOffsetSlider, ZScaleSlider
+from mapa_streamlit.settings import (
+    DEFAULT_TILING_FORMAT,
+    ModelSizeSlider,
+    TilingSelect,
+    ToleranceSlider,
+    ZOffsetSlider,
+    ZScaleSlider,
+)
 
 DELAY = 3
 IGNORED_EXCEPTIONS = (
@@ -31,6 +38,7 @@ def test_streamlit_app__basic(live_server, webdriver) -> None:
     assert "Click the black square on the map" in li
     assert "Draw a rectangle on the map" in li
     assert "Optional: Apply customizations below" in li
+    assert "Click on Preview to check your selection and customizations" in li
     assert "Click on Create STL" in li
     assert "Wait for the computation to finish" in li
     assert "Click on Download STL" in li
@@ -41,6 +49,7 @@ def test_streamlit_app__basic(live_server, webdriver) -> None:
     )
 
     buttons = [e.text for e in webdriver.find_elements(By.TAG_NAME, "button")]
+    assert "Preview" in buttons
     assert "Create STL" in buttons
     assert "Download STL" in buttons
 
@@ -63,6 +72,11 @@ def test_streamlit_app__basic(live_server, webdriver) -> None:
     assert str(ModelSizeSlider.min_value) in model_size_slider
     assert str(ModelSizeSlider.value) in model_size_slider
 
+    tolerance_slider = sliders[3]
+    assert ToleranceSlider.label in tolerance_slider
+    assert str(ToleranceSlider.max_value) in tolerance_slider
+    assert str(ToleranceSlider.min_value) in tolerance_slider
+
     select_box = webdriver.find_element(By.CLASS_NAME, "stSelectbox").text
     assert TilingSelect.label in select_box
     assert DEFAULT_TILING_FORMAT in select_box
@@ -0,0 +1,61 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.transform import from_origin
+
+from mapa_streamlit import tiles
+
+
+def _create_dem_tile(path: Path, lon: int, lat: int, pixels: int = 120) -> Path:
+    # simple slope with a hill in the center of the tile
+    x, y = np.meshgrid(np.linspace(-1, 1, pixels), np.linspace(-1, 1, pixels))
+    elevation = (1000 * np.exp(-(x**2 + y**2) * 4) + 100 * (x + 1) + 10).astype(np.int16)
+    with rio.open(
+        path,
+        "w",
+        driver="GTiff",
+        height=pixels,
+        width=pixels,
+        count=1,
+        dtype=elevation.dtype,
+        crs="EPSG:4326",
+        transform=from_origin(lon, lat + 1, 1 / pixels, 1 / pixels),
+    ) as tiff:
+        tiff.write(elevation, 1)
+    return path
+
+
+@pytest.fixture
+def stac_catalogue(tmp_path, monkeypatch):
+    """Replaces the STAC catalogue with local, synthetic 1x1 degree dem tiles for lon 7-9 and lat 47-49."""
+
+    catalogue_dir = tmp_path / "catalogue"
+    catalogue_dir.mkdir()
+    catalogue = {}
+    for lon in range(7, 9):
+        for lat in range(47, 49):
+            tile_id = f"ALPSMLC30_N{lat:03d}E{lon:03d}"
+            tile = _create_dem_tile(catalogue_dir / f"{tile_id}.tif", lon, lat)
+            catalogue[tile_id] = (tile, (lon, lat, lon + 1, lat + 1))
+    calls = {"search": [], "download": []}
+
+    def _search_tiles(bbox):
+        calls["search"].append(bbox)
+        min_lon, min_lat, max_lon, max_lat = bbox
+        return [
+            (tile_id, str(href), tile_bbox)
+            for tile_id, (href, tile_bbox) in catalogue.items()
+            if tile_bbox[0] < max_lon and tile_bbox[2] > min_lon and tile_bbox[1] < max_lat and tile_bbox[3] > min_lat
+        ]
+
+    def _download_file(url, local_file):
+        calls["download"].append(url)
+        shutil.copy(url, local_file)
+        return local_file
+
+    monkeypatch.setattr(tiles, "_search_tiles", _search_tiles)
+    monkeypatch.setattr(tiles, "_download_file", _download_file)
+    return calls
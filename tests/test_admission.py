@@ -0,0 +1,26 @@
+import pytest
+
+from mapa_streamlit.admission import AdmissionController, JobRejected, get_memory_budget
+
+
+def test_get_memory_budget() -> None:
+    assert 0 < get_memory_budget(0.5) < get_memory_budget(1.0)
+
+
+def test_admission_controller() -> None:
+    controller = AdmissionController(budget=100)
+    assert controller.reserve("foo", 60) is True
+    assert controller.reserve("baa", 50) is False
+    assert controller.reserve("baz", 40) is True
+    # reserving twice for the same job does not count twice
+    assert controller.reserve("foo", 60) is True
+    assert controller.reserved == 100
+
+    controller.release("foo")
+    controller.release("foo")
+    assert controller.reserved == 40
+    assert controller.reserve("baa", 50) is True
+
+    with pytest.raises(JobRejected, match="exceeds the memory budget"):
+        controller.reserve("too_large", 101)
+    assert controller.reserved == 90
@@ -0,0 +1,134 @@
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from mapa_streamlit.api import ApiServer
+from mapa_streamlit.caching import ResultCache
+from mapa_streamlit.cli import get_bbox_geometry
+from mapa_streamlit.jobs import FileProgressBar, JobManager, JobStatus, get_progress_file
+
+
+def _stubbed_conversion(geometry: dict, result_key: str, cache_dir: Path, params: dict) -> Path:
+    # stands in for the conversion, so no elevation data needs to be fetched
+    FileProgressBar(get_progress_file(cache_dir, result_key)).progress(50)
+    time.sleep(0.5)
+    if params["model_size"] == 13:
+        raise ValueError("foo")
+    result_cache = ResultCache(cache_dir)
+    result_cache.artifact(result_key).write_text(json.dumps(params))
+    result_cache.add(result_key)
+    return result_cache.artifact(result_key)
+
+
+@pytest.fixture
+def api_url(tmp_path):
+    job_manager = JobManager(path=tmp_path, max_workers=2)
+    server = ApiServer(
+        path=tmp_path, job_manager=job_manager, conversion=_stubbed_conversion, port=0, address="127.0.0.1"
+    )
+    server.start()
+    yield f"http://127.0.0.1:{server.port}"
+    server.stop()
+    server.join(timeout=5)
+    job_manager.shutdown()
+
+
+def _request(url: str, body: dict = None):
+    data = None if body is None else json.dumps(body).encode()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=10) as response:
+            return response.status, response.read(), response.headers
+    except urllib.error.HTTPError as e:
+        return e.code, e.read(), e.headers
+
+
+def _wait_for(url: str, job_id: str, timeout: float = 30.0) -> dict:
+    start = time.time()
+    while True:
+        status, body, _ = _request(f"{url}/jobs/{job_id}")
+        assert status == 200
+        response = json.loads(body)
+        if response["status"] not in (JobStatus.QUEUED, JobStatus.PENDING, JobStatus.RUNNING):
+            return response
+        assert time.time() - start < timeout
+        time.sleep(0.05)
+
+
+def test_api(api_url) -> None:
+    geometry = get_bbox_geometry(7.0, 47.8, 7.3, 48.1)
+    status, body, headers = _request(f"{api_url}/jobs", {"geometry": geometry, "params": {"model_size": 150}})
+    assert status == 202
+    job = json.loads(body)
+    assert job["status"] in (JobStatus.PENDING, JobStatus.RUNNING)
+    assert headers["Location"] == f"/jobs/{job['job_id']}"
+
+    # many clients can poll at the same time
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        responses = list(executor.map(lambda _: _request(f"{api_url}/jobs/{job['job_id']}"), range(256)))
+    assert {status for status, _, _ in responses} == {200}
+
+    job = _wait_for(api_url, job["job_id"])
+    assert job["status"] == JobStatus.DONE
+    assert job["progress"] == 100
+    status, body, headers = _request(f"{api_url}{job['archive']}?filename=foo.zip")
+    assert status == 200
+    assert json.loads(body)["model_size"] == 150
+    assert headers["Content-Disposition"] == 'attachment; filename="foo.zip"'
+
+    # submitting the same conversion again returns the cached result
+    status, body, _ = _request(f"{api_url}/jobs", {"geometry": geometry, "params": {"model_size": 150}})
+    assert status == 200
+    assert json.loads(body) == job
+
+
+def test_api__failing_job(api_url) -> None:
+    geometry = get_bbox_geometry(7.0, 47.8, 7.3, 48.1)
+    status, body, _ = _request(f"{api_url}/jobs", {"geometry": geometry, "params": {"model_size": 13}})
+    assert status == 202
+    job = _wait_for(api_url, json.loads(body)["job_id"])
+    assert job["status"] == JobStatus.FAILED
+    assert "ValueError" in job["error"]
+    assert "archive" not in job
+
+
+def test_api__cached_job(tmp_path, api_url) -> None:
+    # jobs submitted before a restart of the server are only known to the result cache
+    result_cache = ResultCache(tmp_path)
+    result_cache.artifact("0123abc").write_text("foo")
+    result_cache.add("0123abc")
+    status, body, _ = _request(f"{api_url}/jobs/0123abc")
+    assert status == 200
+    assert json.loads(body) == {
+        "job_id": "0123abc",
+        "status": JobStatus.DONE,
+        "progress": 100,
+        "archive": "/jobs/0123abc/archive",
+    }
+
+
+def test_api__invalid_requests(api_url) -> None:
+    for body, error in [
+        ({"params": {}}, "invalid request"),
+        ({"geometry": get_bbox_geometry(7.0, 47.8, 7.3, 48.1), "params": {"model_size": "foo"}}, "invalid request"),
+        ({"geometry": {"type": "Point", "coordinates": [1, 2]}}, "polygon"),
+        # coordinates which are valid json, but no positions
+        ({"geometry": {"type": "Polygon", "coordinates": [[["a", 1], [2, 3], [4, 5], ["a", 1]]]}}, "coordinates"),
+        ({"geometry": {"type": "Polygon", "coordinates": [[1, 2, 3, 4]]}}, "coordinates"),
+        ({"geometry": {"type": "Polygon", "coordinates": "foo"}}, "coordinates"),
+        ({"geometry": get_bbox_geometry(179, 0, 181, 1)}, "boundaries"),
+        ({"geometry": get_bbox_geometry(0, 0, 40, 40)}, "limits"),
+    ]:
+        status, response, _ = _request(f"{api_url}/jobs", body)
+        assert status == 400
+        assert error in json.loads(response)["error"]
+
+    status, response, _ = _request(f"{api_url}/jobs/0123abc")
+    assert status == 404
+    assert json.loads(response) == {"error": "unknown job: 0123abc"}
+    status, _, _ = _request(f"{api_url}/jobs/0123abc/archive")
+    assert status == 404
@@ -0,0 +1,130 @@
+from multiprocessing import get_context
+
+from mapa.caching import get_hash_of_geojson
+from mapa.utils import TMPDIR
+
+from mapa_streamlit.caching import ResultCache, get_cache_dir, get_elevation_hash, get_geometry_hash, get_result_key
+from mapa_streamlit.manifest import CacheManifest
+
+GEOMETRY = {
+    "type": "Polygon",
+    "coordinates": [
+        [
+            [8.076906, 48.098505],
+            [8.076906, 48.115011],
+            [8.107111, 48.115011],
+            [8.107111, 48.098505],
+            [8.076906, 48.098505],
+        ]
+    ],
+}
+PARAMS = dict(model_size=100, z_scale=2.0, z_offset=2, ensure_squared=False, split_area_in_tiles="1x1")
+
+
+def test_mirrors_mapa() -> None:
+    assert get_cache_dir() == TMPDIR()
+    assert get_geometry_hash(GEOMETRY) == get_hash_of_geojson(GEOMETRY)
+
+
+def test_get_result_key() -> None:
+    key = get_result_key(GEOMETRY, **PARAMS)
+    assert isinstance(key, str)
+    assert key == get_result_key(GEOMETRY, **PARAMS)
+
+    # int and float values of the same parameter result in the same key
+    assert key == get_result_key(GEOMETRY, **{**PARAMS, "z_scale": 2, "z_offset": 2.0})
+
+    # every output affecting parameter changes the key
+    assert key != get_result_key(GEOMETRY, **{**PARAMS, "model_size": 101})
+    assert key != get_result_key(GEOMETRY, **{**PARAMS, "z_scale": 2.1})
+    assert key != get_result_key(GEOMETRY, **{**PARAMS, "z_offset": 3})
+    assert key != get_result_key(GEOMETRY, **{**PARAMS, "ensure_squared": True})
+    assert key != get_result_key(GEOMETRY, **{**PARAMS, "split_area_in_tiles": "2x2"})
+    assert key != get_result_key(GEOMETRY, **{**PARAMS, "tolerance": 0.1})
+    assert key == get_result_key(GEOMETRY, **{**PARAMS, "tolerance": 0.0})
+    assert key != get_result_key(GEOMETRY, **{**PARAMS, "output_format": "3MF"})
+    assert key != get_result_key(GEOMETRY, **{**PARAMS, "compression": "store"})
+    assert key == get_result_key(GEOMETRY, **{**PARAMS, "output_format": "STL", "compression": "default"})
+    assert key != get_result_key(GEOMETRY, **{**PARAMS, "elevation_source": "synthetic"})
+    assert key == get_result_key(GEOMETRY, **{**PARAMS, "elevation_source": "stac"})
+
+
+def test_get_elevation_hash() -> None:
+    # elevation arrays cached for the default source keep their name
+    assert get_elevation_hash(GEOMETRY) == get_geometry_hash(GEOMETRY)
+    assert get_elevation_hash(GEOMETRY, "synthetic") != get_geometry_hash(GEOMETRY)
+    assert get_elevation_hash(GEOMETRY, "synthetic") != get_elevation_hash(GEOMETRY, "synthetic:1")
+
+
+def test_result_cache(tmp_path) -> None:
+    cache = ResultCache(tmp_path)
+    key = get_result_key(GEOMETRY, **PARAMS)
+    assert cache.output_file(key) == tmp_path / key
+    assert cache.artifact(key) == tmp_path / f"{key}.zip"
+    assert cache.stats() == {"entries": 0, "hits": 0, "misses": 0}
+
+    # empty cache results in a miss
+    assert cache.contains(key) is False
+    assert cache.lookup(key) is None
+    assert cache.stats() == {"entries": 0, "hits": 0, "misses": 1}
+
+    # archive which is still being written is not contained yet
+    cache.artifact(key).write_text("foo")
+    assert cache.contains(key) is False
+
+    # once the archive is added, lookups are hits
+    cache.add(key)
+    assert cache.contains(key) is True
+    assert cache.lookup(key) == cache.artifact(key)
+    assert cache.lookup(key) == cache.artifact(key)
+    assert cache.stats() == {"entries": 1, "hits": 2, "misses": 1}
+
+    # index is persisted in the manifest
+    entry = ResultCache(tmp_path).entry(key)
+    assert entry["size"] == 3
+    assert entry["created"] <= entry["last_hit"]
+
+    # contains does not affect the counters
+    cache.contains(key)
+    assert cache.stats() == {"entries": 1, "hits": 2, "misses": 1}
+
+    # archives deleted by the cleanup job are treated as miss and removed from the index
+    cache.artifact(key).unlink()
+    assert cache.lookup(key) is None
+    assert cache.stats() == {"entries": 0, "hits": 2, "misses": 2}
+
+
+def test_result_cache__evicted(tmp_path) -> None:
+    cache = ResultCache(tmp_path)
+    keys = ["foo", "baa"]
+    for key in keys:
+        cache.artifact(key).write_text(key)
+        cache.add(key)
+    CacheManifest(tmp_path).add(*[cache.artifact(key) for key in keys])
+
+    # entries are removed together with the evicted archives, other files do not affect the index
+    cache.artifact("foo").unlink()
+    CacheManifest(tmp_path).remove(cache.artifact("foo"), tmp_path / "baa.tiff")
+    assert cache.entry("foo") is None
+    assert cache.entry("baa") is not None
+    # as well as when reconciling the manifest finds them missing
+    cache.artifact("baa").unlink()
+    CacheManifest(tmp_path).reconcile()
+    assert cache.stats() == {"entries": 0, "hits": 0, "misses": 0}
+
+
+def _add_results(path, keys) -> None:
+    cache = ResultCache(path)
+    for key in keys:
+        cache.artifact(key).write_text(key)
+        cache.add(key)
+        cache.lookup(key)
+
+
+def test_result_cache__shared(tmp_path) -> None:
+    # replicas sharing the cache directory do not lose each others updates of the index
+    keys = [[f"{i}{j}" for j in range(20)] for i in range(3)]
+    with get_context("spawn").Pool(3) as pool:
+        pool.starmap(_add_results, [(tmp_path, k) for k in keys])
+    assert ResultCache(tmp_path).stats() == {"entries": 60, "hits": 60, "misses": 0}
+    assert not list(tmp_path.glob("*.tmp"))
@@ -1,10 +1,19 @@
+import time
+
+from mapa_streamlit.caching import ResultCache
 from mapa_streamlit.cleaning import (
+    Janitor,
     _delete_files_in_dir,
     _get_data_size_of_dir,
     _get_disk_usage,
     _get_number_of_files_in_dir,
+    cache_exceeds_quota,
     run_cleanup_job,
+    run_tile_cleanup_job,
 )
+from mapa_streamlit.locking import Lease, get_lease_file
+from mapa_streamlit.manifest import CacheManifest
+from mapa_streamlit.store import Pin
 
 
 def test__get_disk_usage():
@@ -104,7 +113,8 @@ def test_run_cleanup_job(tmp_path) -> None:
     zip.write_text("foo")
     assert zip.is_file()
 
-    run_cleanup_job(tmp_path, disk_cleaning_threshold=0.0)
+    # evict down to an empty cache, downloaded stac items are not evicted
+    run_cleanup_job(tmp_path, disk_cleaning_threshold=0.0, low_water_mark=0.0)
     assert not stl.is_file()
     assert tiff.is_file()
     assert not zip.is_file()
@@ -120,3 +130,133 @@ def test_run_cleanup_job(tmp_path) -> None:
     run_cleanup_job(tmp_path, disk_cleaning_threshold=100.0)
     assert stl.is_file()
     assert tiff.is_file()
+
+
+def test_run_cleanup_job__lru(tmp_path) -> None:
+    manifest = CacheManifest(tmp_path)
+    files = []
+    for name in ["a.zip", "b.stl", "clipped_c.tiff", "d.tiff", "merged_e.tiff", "f.zip"]:
+        file = tmp_path / name
+        file.write_bytes(b"\0" * 100)
+        manifest.add(file)
+        files.append(file)
+        time.sleep(0.01)
+    manifest.reconcile()
+    ResultCache(tmp_path).add("f")
+    # recently used files are kept
+    manifest.touch(files[0])
+
+    # cache of 600 bytes exceeds a budget of 400 bytes, 0.75 * 400 = 300 bytes are kept
+    evicted, reclaimed = run_cleanup_job(
+        tmp_path, disk_cleaning_threshold=100.0, cache_size_budget=400 / 1024**2, low_water_mark=0.75
+    )
+    assert (evicted, reclaimed) == (3, 300)
+    assert [f.name for f in files if f.is_file()] == ["a.zip", "d.tiff", "f.zip"]
+    assert manifest.size() == 300
+    assert manifest.counter("evicted_files") == 3
+    assert manifest.counter("reclaimed_bytes") == 300
+
+    # cache is within budget, nothing to do
+    assert run_cleanup_job(tmp_path, disk_cleaning_threshold=100.0, cache_size_budget=400 / 1024**2) == (0, 0)
+
+    # ram usage exceeds threshold
+    evicted, reclaimed = run_cleanup_job(
+        tmp_path, disk_cleaning_threshold=100.0, low_water_mark=0.7, ram_cleaning_threshold=0.0
+    )
+    assert (evicted, reclaimed) == (1, 100)
+    assert [f.name for f in files if f.is_file()] == ["a.zip", "d.tiff"]
+    # the result cache entries of evicted archives are removed as well
+    assert ResultCache(tmp_path).entry("f") is None
+
+
+def test_run_cleanup_job__manifest(tmp_path) -> None:
+    stl = tmp_path / "baa.stl"
+    stl.write_text("foo")
+    tiff = tmp_path / "baa.tiff"
+    tiff.write_text("foo")
+
+    # manifest gets reconciled initially and is kept up to date when deleting files
+    run_cleanup_job(tmp_path, disk_cleaning_threshold=0.0)
+    manifest = CacheManifest(tmp_path)
+    assert manifest.needs_reconciliation() is False
+    assert manifest.count(".stl") == 0
+    assert manifest.files(".tiff") == [tiff]
+
+
+def test_run_cleanup_job__pinned(tmp_path) -> None:
+    manifest = CacheManifest(tmp_path)
+    files = []
+    for name in ["a.zip", "b.zip", "c.zip"]:
+        file = tmp_path / name
+        file.write_bytes(b"\0" * 100)
+        manifest.add(file)
+        files.append(file)
+        time.sleep(0.01)
+    manifest.reconcile()
+
+    # least recently used archive is being downloaded by another replica, hence the next one gets evicted
+    with Pin(tmp_path, files[0]):
+        evicted = run_cleanup_job(tmp_path, disk_cleaning_threshold=100.0, cache_size_budget=250 / 1024**2)
+    assert evicted == (1, 100)
+    assert [f.name for f in files if f.is_file()] == ["a.zip", "c.zip"]
+    # pins are not accounted as cached data
+    manifest.reconcile()
+    assert manifest.count() == 2
+
+
+def test_run_tile_cleanup_job(tmp_path) -> None:
+    manifest = CacheManifest(tmp_path)
+    tiles = []
+    for name in ["a.tiff", "b.tiff", "c.tiff"]:
+        tile = tmp_path / name
+        tile.write_bytes(b"\0" * 100)
+        manifest.add(tile)
+        tiles.append(tile)
+        time.sleep(0.01)
+    manifest.reconcile()
+
+    # tile store within budget
+    assert run_tile_cleanup_job(tmp_path, tile_budget=300 / 1024**2) == (0, 0)
+
+    # least recently used tiles get evicted down to the low water mark
+    assert run_tile_cleanup_job(tmp_path, tile_budget=250 / 1024**2, low_water_mark=0.5) == (2, 200)
+    assert [t.name for t in tiles if t.is_file()] == ["c.tiff"]
+
+
+def test_cache_exceeds_quota(tmp_path) -> None:
+    assert cache_exceeds_quota(tmp_path, disk_cleaning_threshold=0.0) is True
+    assert cache_exceeds_quota(tmp_path, disk_cleaning_threshold=100.0) is False
+
+    stl = tmp_path / "baa.stl"
+    stl.write_text("foo")
+    CacheManifest(tmp_path).add(stl)
+    assert cache_exceeds_quota(tmp_path, disk_cleaning_threshold=100.0, cache_size_budget=1 / 1024**2) is True
+
+
+def test_janitor(tmp_path) -> None:
+    stl = tmp_path / "baa.stl"
+    stl.write_text("foo")
+    CacheManifest(tmp_path).add(stl)
+
+    # janitor does not run while another process holds the lease
+    janitor = Janitor(tmp_path, disk_cleaning_threshold=0.0, interval=60.0, min_interval=0.0)
+    lease = Lease(get_lease_file(tmp_path, "janitor"))
+    assert lease.acquire()
+    assert janitor.run_once() == (0, 0)
+    assert stl.is_file()
+    lease.release()
+
+    # waking up the janitor runs the cleanup job in the background
+    janitor.start()
+    try:
+        janitor.wake_up()
+        start = time.time()
+        while stl.is_file():
+            assert time.time() - start < 5
+            time.sleep(0.01)
+        assert janitor.last_run > 0.0
+    finally:
+        janitor.stop()
+        janitor.join(timeout=5)
+    assert not janitor.is_alive()
+    assert not get_lease_file(tmp_path, "janitor").is_file()
@@ -0,0 +1,165 @@
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+from mapa_streamlit import cli
+from mapa_streamlit.caching import ResultCache
+from mapa_streamlit.cli import BatchItem, BatchRunner, BatchStatus, get_bbox_geometry, read_batch
+from mapa_streamlit.verification import get_default_params
+
+
+def _fake_conversion(geometry: dict, result_key: str, cache_dir: Path, params: dict) -> Path:
+    if params["model_size"] == 13:
+        raise ValueError("foo")
+    # parallel jobs share the cores of the batch
+    assert params["max_workers"] >= 1
+    result_cache = ResultCache(cache_dir)
+    result_cache.artifact(result_key).write_text(json.dumps(params))
+    result_cache.add(result_key)
+    return result_cache.artifact(result_key)
+
+
+def test_read_batch(tmp_path) -> None:
+    defaults = get_default_params()
+    csv_file = tmp_path / "regions.csv"
+    csv_file.write_text(
+        "name,west,south,east,north,model_size,ensure_squared\nfoo,7.0,47.8,7.3,48.1,150,true\n,1,2,3,4,,\n"
+    )
+    foo, unnamed = read_batch(csv_file, defaults)
+    assert foo == BatchItem(
+        "foo", get_bbox_geometry(7.0, 47.8, 7.3, 48.1), dict(defaults, model_size=150, ensure_squared=True)
+    )
+    assert unnamed.name == "bbox_2"
+    assert unnamed.params == defaults
+
+    geojson_file = tmp_path / "regions.geojson"
+    features = [
+        {"type": "Feature", "geometry": foo.geometry, "properties": {"name": "baa", "z_scale": "3"}},
+        {"type": "Feature", "geometry": unnamed.geometry, "properties": None},
+    ]
+    geojson_file.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+    baa, unnamed = read_batch(geojson_file, defaults)
+    assert baa == BatchItem("baa", foo.geometry, dict(defaults, z_scale=3.0))
+    assert unnamed == BatchItem("bbox_2", get_bbox_geometry(1, 2, 3, 4), defaults)
+
+    geojson_file.write_text(json.dumps({"type": "Point", "coordinates": [1, 2]}))
+    (point,) = read_batch(geojson_file, defaults)
+    assert point.error == "not a polygon: Point"
+    csv_file.write_text("west,south,east\n1,2,3\n")
+    with pytest.raises(ValueError, match="north"):
+        read_batch(csv_file, defaults)
+
+
+def test_read_batch__malformed(tmp_path) -> None:
+    defaults = get_default_params()
+    csv_file = tmp_path / "regions.csv"
+    csv_file.write_text(
+        "name,west,south,east,north,model_size\n"
+        "blank,,47.8,7.3,48.1,\n"
+        "text,foo,47.8,7.3,48.1,\n"
+        "nan,nan,47.8,7.3,48.1,\n"
+        "short,7.0,47.8\n"
+        "fraction,7.0,47.8,7.3,48.1,100.5\n"
+        "integral,7.0,47.8,7.3,48.1,100.0\n"
+    )
+    items = {item.name: item for item in read_batch(csv_file, defaults)}
+    assert items["blank"].error == "invalid west: ''"
+    assert items["text"].error == "invalid west: 'foo'"
+    assert items["nan"].error == "invalid west: 'nan'"
+    assert items["short"].error == "invalid east: None"
+    assert items["fraction"].error == "invalid model_size: '100.5'"
+    assert items["fraction"].params == {"model_size": "100.5"}
+    assert items["integral"].error is None
+    assert items["integral"].params["model_size"] == 100
+
+    geojson_file = tmp_path / "regions.geojson"
+    geometry = get_bbox_geometry(7.0, 47.8, 7.3, 48.1)
+    features = [
+        {"type": "Feature", "geometry": geometry, "properties": {"name": "foo", "z_scale": "high"}},
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": [1, 2]}, "properties": {"name": "baa"}},
+        {"type": "Feature", "geometry": None, "properties": None},
+        {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [[["a", 1]]]}, "properties": None},
+    ]
+    geojson_file.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+    foo, baa, empty, malformed = read_batch(geojson_file, defaults)
+    assert foo.error == "invalid z_scale: 'high'"
+    assert baa.error == "not a polygon: Point"
+    assert empty == BatchItem("bbox_3", {}, {}, error="not a polygon: None")
+    # malformed coordinates are rejected by the checks of the batch runner
+    assert malformed.error is None
+
+
+def test_batch_runner__malformed(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(cli, "run_conversion", _fake_conversion)
+    defaults = get_default_params()
+    csv_file = tmp_path / "regions.csv"
+    csv_file.write_text("name,west,south,east,north,model_size\nfoo,7.0,47.8,7.3,48.1,100.0\nbaa,,47.8,7.3,48.1,\n")
+    geojson_file = tmp_path / "regions.geojson"
+    malformed = {"type": "Polygon", "coordinates": [[["a", 1], [2, 3], [4, 5], ["a", 1]]]}
+    geojson_file.write_text(json.dumps({"type": "Feature", "geometry": malformed, "properties": {"name": "qux"}}))
+
+    items = read_batch(csv_file, defaults) + read_batch(geojson_file, defaults)
+    runner = BatchRunner(tmp_path / "out", tmp_path / "cache", workers=1, polling_interval=0.01, stream=io.StringIO())
+    entries = {entry["name"]: entry for entry in runner.run(items)}
+    # malformed items are rejected one by one, the rest of the batch gets converted
+    assert {name: entry["status"] for name, entry in entries.items()} == {
+        "foo": BatchStatus.DONE,
+        "baa": BatchStatus.REJECTED,
+        "qux": BatchStatus.REJECTED,
+    }
+    assert entries["baa"]["reason"] == "invalid west: ''"
+    assert entries["qux"]["reason"] == "polygon has invalid coordinates"
+
+
+def test_batch_runner(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(cli, "run_conversion", _fake_conversion)
+    defaults = get_default_params()
+    geometry = get_bbox_geometry(7.0, 47.8, 7.3, 48.1)
+    items = [
+        BatchItem("foo", geometry, defaults),
+        # same result as foo, hence only converted once
+        BatchItem("foo/copy", geometry, defaults),
+        BatchItem("outside", get_bbox_geometry(179, 0, 181, 1), defaults),
+        BatchItem("failing", geometry, dict(defaults, model_size=13)),
+        # would overwrite the archive of foo/copy
+        BatchItem("foo_copy", geometry, dict(defaults, model_size=150)),
+    ]
+    stream = io.StringIO()
+    runner = BatchRunner(tmp_path / "out", tmp_path / "cache", workers=2, polling_interval=0.01, stream=stream)
+    entries = {entry["name"]: entry for entry in runner.run(items)}
+    assert {name: entry["status"] for name, entry in entries.items()} == {
+        "foo": BatchStatus.DONE,
+        "foo/copy": BatchStatus.DONE,
+        "outside": BatchStatus.REJECTED,
+        "failing": BatchStatus.FAILED,
+        "foo_copy": BatchStatus.REJECTED,
+    }
+    assert "duplicate name" in entries["foo_copy"]["reason"]
+    assert entries["foo"]["result_key"] == entries["foo/copy"]["result_key"]
+    assert Path(entries["foo"]["archive"]) == tmp_path / "out" / "foo.zip"
+    assert Path(entries["foo/copy"]["archive"]) == tmp_path / "out" / "foo_copy.zip"
+    assert json.loads((tmp_path / "out" / "foo_copy.zip").read_text())["model_size"] == defaults["model_size"]
+    assert "ValueError" in entries["failing"]["reason"]
+    assert "2/2 conversion(s) finished" in stream.getvalue()
+
+    # the manifest lists every item, results of later runs are appended
+    runner.run(items[:1])
+    manifest = [json.loads(line) for line in runner.manifest_file.read_text().splitlines()]
+    assert sorted(entry["name"] for entry in manifest) == ["failing", "foo", "foo", "foo/copy", "foo_copy", "outside"]
+    assert manifest[-1]["status"] == BatchStatus.CACHED
+
+
+def test_main(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(cli, "run_conversion", _fake_conversion)
+    csv_file = tmp_path / "regions.csv"
+    csv_file.write_text("name,west,south,east,north\nfoo,7.0,47.8,7.3,48.1\n")
+    args = [str(csv_file), "-o", str(tmp_path / "out"), "--cache-dir", str(tmp_path / "cache"), "--model-size", "150"]
+    assert cli.main(args) == 0
+    (entry,) = [json.loads(line) for line in (tmp_path / "out" / "manifest.jsonl").read_text().splitlines()]
+    assert entry["status"] == BatchStatus.DONE
+    assert entry["params"]["model_size"] == 150
+
+    csv_file.write_text("name,west,south,east,north\nfoo,179,0,181,1\n")
+    assert cli.main(args) == 1
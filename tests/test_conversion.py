@@ -0,0 +1,185 @@
+import warnings
+import zipfile
+
+import numpy as np
+import pytest
+import rasterio as rio
+from mapa import convert_array_to_stl
+from mapa.algorithm import ModelSize
+from mapa.caching import get_hash_of_geojson
+from rasterio.enums import Compression
+from rasterio.errors import NotGeoreferencedWarning
+
+from mapa_streamlit import conversion, elevation
+from mapa_streamlit.conversion import convert_bbox_to_stl, path_to_elevation_raster
+from mapa_streamlit.tiles import get_tile_dir
+
+GEOMETRY = {
+    "type": "Polygon",
+    "coordinates": [
+        [
+            [7.9, 47.8],
+            [7.9, 48.1],
+            [8.2, 48.1],
+            [8.2, 47.8],
+            [7.9, 47.8],
+        ]
+    ],
+}
+
+
+class _ProgressBar:
+    def __init__(self) -> None:
+        self.values = []
+
+    def progress(self, value: int) -> None:
+        self.values.append(value)
+
+
+def test_convert_bbox_to_stl(tmp_path, stac_catalogue) -> None:
+    progress_bar = _ProgressBar()
+    output = convert_bbox_to_stl(
+        bbox_geometry=GEOMETRY,
+        model_size=100,
+        z_offset=2.0,
+        z_scale=2.0,
+        ensure_squared=False,
+        split_area_in_tiles="1x2",
+        output_file=tmp_path / "foo",
+        cache_dir=tmp_path,
+        progress_bar=progress_bar,
+    )
+    assert output == tmp_path / "foo.zip"
+    with zipfile.ZipFile(output) as zip_file:
+        assert sorted(zip_file.namelist()) == ["foo_1.stl", "foo_2.stl"]
+    assert progress_bar.values[-1] == 100
+    assert len(list(get_tile_dir(tmp_path).glob("*.tiff"))) == 4
+    # only the archive and the compressed elevation raster are kept in the cache directory
+    assert not list(tmp_path.glob("*.stl"))
+    raster_file = path_to_elevation_raster(get_hash_of_geojson(GEOMETRY), tmp_path)
+    assert [f.name for f in tmp_path.glob("*.tiff")] == [raster_file.name]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        with rio.open(raster_file) as raster:
+            assert raster.compression == Compression.zstd
+            assert raster.block_shapes == [(256, 256)]
+            assert raster.tags()["elevation_scale"]
+            array = raster.read(1)
+    assert raster_file.stat().st_size < array.nbytes / 2
+
+    # second conversion of the same bounding box reuses the cached elevation array
+    convert_bbox_to_stl(
+        bbox_geometry=GEOMETRY,
+        model_size=50,
+        z_offset=2.0,
+        z_scale=1.0,
+        ensure_squared=True,
+        split_area_in_tiles="1x1",
+        output_file=tmp_path / "baa",
+        cache_dir=tmp_path,
+    )
+    with zipfile.ZipFile(tmp_path / "baa.zip") as zip_file:
+        assert zip_file.namelist() == ["baa.stl"]
+    assert len(stac_catalogue["search"]) == 1
+    assert len(stac_catalogue["download"]) == 4
+
+
+def test_convert_bbox_to_stl__cached_elevation_array(tmp_path, stac_catalogue, monkeypatch) -> None:
+    params = {"model_size": 100, "z_offset": 2.0, "ensure_squared": False, "split_area_in_tiles": "1x1"}
+    convert_bbox_to_stl(bbox_geometry=GEOMETRY, z_scale=1.0, output_file=tmp_path / "foo", cache_dir=tmp_path, **params)
+    raster_file = path_to_elevation_raster(get_hash_of_geojson(GEOMETRY), tmp_path)
+    assert raster_file.is_file()
+
+    def _get_raster_for_bbox(*args, **kwargs):
+        raise AssertionError("elevation data should not be read again")
+
+    # only the mesh parameters changed, hence the conversion skips straight to triangulation
+    monkeypatch.setattr(elevation, "_get_raster_for_bbox", _get_raster_for_bbox)
+    convert_bbox_to_stl(bbox_geometry=GEOMETRY, z_scale=3.0, output_file=tmp_path / "baa", cache_dir=tmp_path, **params)
+    # same footprint, but higher elevation
+    with zipfile.ZipFile(tmp_path / "foo.zip") as foo, zipfile.ZipFile(tmp_path / "baa.zip") as baa:
+        assert foo.getinfo("foo.stl").file_size == baa.getinfo("baa.stl").file_size
+
+    # raster got evicted, hence the elevation array gets recomputed
+    raster_file.unlink()
+    with pytest.raises(AssertionError, match="elevation data should not be read again"):
+        convert_bbox_to_stl(
+            bbox_geometry=GEOMETRY, z_scale=1.0, output_file=tmp_path / "foo", cache_dir=tmp_path, **params
+        )
+
+
+def test_convert_bbox_to_stl__parallel_tiles(tmp_path, stac_catalogue) -> None:
+    params = {"model_size": 100, "z_offset": 2.0, "z_scale": 1.0, "ensure_squared": True, "split_area_in_tiles": "2x2"}
+    sequential = convert_bbox_to_stl(
+        bbox_geometry=GEOMETRY, output_file=tmp_path / "foo", cache_dir=tmp_path, max_workers=1, **params
+    )
+    parallel = convert_bbox_to_stl(
+        bbox_geometry=GEOMETRY, output_file=tmp_path / "baa", cache_dir=tmp_path, max_workers=4, **params
+    )
+    with zipfile.ZipFile(sequential) as foo, zipfile.ZipFile(parallel) as baa:
+        assert sorted(i.file_size for i in foo.infolist()) == sorted(i.file_size for i in baa.infolist())
+        assert sorted(baa.namelist()) == [f"baa_{i}.stl" for i in range(1, 5)]
+    # no temporary archives are left behind
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_convert_bbox_to_stl__failing_tile(tmp_path, stac_catalogue, monkeypatch) -> None:
+    def _convert_tile(*args, **kwargs):
+        raise ValueError("foo")
+
+    monkeypatch.setattr(conversion, "_convert_tile", _convert_tile)
+    with pytest.raises(ValueError):
+        convert_bbox_to_stl(
+            bbox_geometry=GEOMETRY,
+            model_size=100,
+            z_offset=2.0,
+            z_scale=1.0,
+            ensure_squared=False,
+            split_area_in_tiles="1x1",
+            output_file=tmp_path / "foo",
+            cache_dir=tmp_path,
+        )
+    assert not (tmp_path / "foo.zip").is_file()
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_convert_bbox_to_stl__decimated(tmp_path, stac_catalogue) -> None:
+    params = {"model_size": 100, "z_offset": 2.0, "z_scale": 1.0, "ensure_squared": False, "split_area_in_tiles": "1x1"}
+    convert_bbox_to_stl(bbox_geometry=GEOMETRY, output_file=tmp_path / "foo", cache_dir=tmp_path, **params)
+    convert_bbox_to_stl(
+        bbox_geometry=GEOMETRY, output_file=tmp_path / "baa", cache_dir=tmp_path, tolerance=0.5, **params
+    )
+    with zipfile.ZipFile(tmp_path / "foo.zip") as foo, zipfile.ZipFile(tmp_path / "baa.zip") as baa:
+        assert baa.getinfo("baa.stl").file_size < foo.getinfo("foo.stl").file_size / 2
+
+
+def test_convert_tile__matches_mapa(tmp_path) -> None:
+    array = np.random.default_rng(42).random((1000, 1200)) * 500
+    params = {"desired_size": ModelSize(x=100, y=120), "z_offset": 2.0, "z_scale": 1.5, "elevation_scale": 0.01}
+    output = conversion._convert_tile(array, output_file=str(tmp_path / "foo"), **params)
+    assert output == tmp_path / "foo.stl"
+    convert_array_to_stl(array, as_ascii=False, max_res=False, output_file=tmp_path / "baa.stl", **params)
+    # the header contains the file name and creation time
+    assert output.read_bytes()[80:] == (tmp_path / "baa.stl").read_bytes()[80:]
+
+
+def test_convert_bbox_to_stl__output_format(tmp_path, stac_catalogue) -> None:
+    params = {"model_size": 100, "z_offset": 2.0, "z_scale": 1.0, "ensure_squared": False, "split_area_in_tiles": "1x2"}
+    stl = convert_bbox_to_stl(bbox_geometry=GEOMETRY, output_file=tmp_path / "foo", cache_dir=tmp_path, **params)
+    three_mf = convert_bbox_to_stl(
+        bbox_geometry=GEOMETRY, output_file=tmp_path / "baa", cache_dir=tmp_path, output_format="3MF", **params
+    )
+    with zipfile.ZipFile(stl) as foo, zipfile.ZipFile(three_mf) as baa:
+        assert sorted(baa.namelist()) == ["baa_1.3mf", "baa_2.3mf"]
+        # 3mf files are zip containers themselves, hence they are not deflated again
+        assert {i.compress_type for i in baa.infolist()} == {zipfile.ZIP_STORED}
+        assert sum(i.file_size for i in baa.infolist()) < sum(i.file_size for i in foo.infolist()) / 4
+
+    stored = convert_bbox_to_stl(
+        bbox_geometry=GEOMETRY, output_file=tmp_path / "foobar", cache_dir=tmp_path, compression="store", **params
+    )
+    assert stored.stat().st_size > stl.stat().st_size
+    with pytest.raises(ValueError, match="Unknown compression"):
+        convert_bbox_to_stl(
+            bbox_geometry=GEOMETRY, output_file=tmp_path / "foo", cache_dir=tmp_path, compression="foo", **params
+        )
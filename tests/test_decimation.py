@@ -0,0 +1,99 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+from mapa.algorithm import ModelSize, compute_all_triangles
+
+from mapa_streamlit.decimation import (
+    _compute_errors,
+    _extract_triangles,
+    _get_number_of_undecimated_triangles,
+    _resample_to_grid,
+    compute_decimated_triangles,
+)
+
+
+def _get_terrain() -> np.ndarray:
+    # plain with a rough hill in its center
+    rng = np.random.default_rng(42)
+    array = np.full((60, 90), 300.0)
+    array[20:40, 30:60] += rng.random((20, 30)) * 100 + 200
+    return array
+
+
+def _is_closed(triangles: np.ndarray) -> bool:
+    # every edge needs to be shared by exactly two triangles, which traverse it in opposite directions
+    edges = Counter()
+    for triangle in np.round(triangles, 6):
+        for i, j in ((0, 1), (1, 2), (2, 0)):
+            edges[(tuple(triangle[i]), tuple(triangle[j]))] += 1
+    return all(edges[(v, u)] == n for (u, v), n in edges.items())
+
+
+def _get_volume(triangles: np.ndarray) -> float:
+    # signed volume, which is positive in case all normals face outwards
+    return np.einsum("ij,ij->i", triangles[:, 0], np.cross(triangles[:, 1], triangles[:, 2])).sum() / 6
+
+
+def test__resample_to_grid() -> None:
+    raster = np.arange(12, dtype=float).reshape(3, 4)
+    grid = _resample_to_grid(raster)
+    assert grid.shape == (5, 5)
+    # corners are kept, values in between are interpolated
+    assert grid[0, 0] == raster[0, 0] and grid[-1, -1] == raster[-1, -1] and grid[0, -1] == raster[0, -1]
+    assert grid[2, 2] == (raster[1, 1] + raster[1, 2]) / 2
+
+
+def test__extract_triangles__error_is_bounded() -> None:
+    grid = _resample_to_grid(_get_terrain()[:33, :33])
+    errors = _compute_errors(grid)
+    size = grid.shape[0]
+    for max_error in (0.0, 5.0, 50.0):
+        triangles = _extract_triangles(errors, max_error)
+        # triangles cover the whole grid
+        area = sum(abs(np.cross(t[1] - t[0], t[2] - t[0])) / 2 for t in triangles)
+        assert area == (size - 1) ** 2
+        # each grid point inside a triangle deviates at most max_error from the linear interpolation
+        for t in triangles:
+            (ax, ay), (bx, by), (cx, cy) = t
+            for x in range(min(ax, bx, cx), max(ax, bx, cx) + 1):
+                for y in range(min(ay, by, cy), max(ay, by, cy) + 1):
+                    det = (by - cy) * (ax - cx) + (cx - bx) * (ay - cy)
+                    u = ((by - cy) * (x - cx) + (cx - bx) * (y - cy)) / det
+                    v = ((cy - ay) * (x - cx) + (ax - cx) * (y - cy)) / det
+                    if min(u, v, 1 - u - v) < 0:
+                        continue
+                    interpolated = u * grid[ay, ax] + v * grid[by, bx] + (1 - u - v) * grid[cy, cx]
+                    assert abs(interpolated - grid[y, x]) <= max_error + 1e-9
+
+
+def test_compute_decimated_triangles() -> None:
+    array = _get_terrain()
+    params = dict(desired_size=ModelSize(x=100, y=150), z_offset=2.0, z_scale=1.5, elevation_scale=0.01)
+    full = compute_all_triangles(array, **params)
+
+    n_triangles = []
+    for tolerance in (0.01, 0.05, 0.25):
+        triangles = compute_decimated_triangles(array, tolerance=tolerance, **params)
+        assert _is_closed(triangles)
+        # same dimensions and roughly the same volume as the undecimated model
+        assert triangles[..., 0].max() == 100 and triangles[..., 1].max() == 150
+        assert triangles[..., 2].min() == 0
+        assert _get_volume(triangles) == pytest.approx(_get_volume(full), rel=0.02)
+        n_triangles.append(len(triangles))
+    assert n_triangles[0] < len(full) / 2
+    assert n_triangles == sorted(n_triangles, reverse=True)
+
+    # the mesh never gets larger than the undecimated one, even if the grid has more points than the array
+    rough = np.random.default_rng(42).random((34, 34)) * 1000
+    assert np.array_equal(
+        compute_decimated_triangles(rough, tolerance=1e-6, **params), compute_all_triangles(rough, **params)
+    )
+    assert _get_number_of_undecimated_triangles(*rough.shape) == len(compute_all_triangles(rough, **params))
+
+    # a flat plain collapses to a box
+    plain = np.full((50, 50), 100.0)
+    flat = compute_decimated_triangles(plain, tolerance=0.05, **params)
+    assert len(flat) == 2 + 4 * 2 + 4
+    assert _is_closed(flat)
+    assert _get_volume(flat) == pytest.approx(_get_volume(compute_all_triangles(plain, **params)))
@@ -0,0 +1,78 @@
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from mapa_streamlit.download import DownloadServer, get_download_url
+from mapa_streamlit.metrics import Metrics
+from mapa_streamlit.settings import PIN_DIR
+from mapa_streamlit.store import get_pinned_files
+
+
+@pytest.fixture
+def download_server(tmp_path):
+    server = DownloadServer(path=tmp_path, port=0, address="127.0.0.1")
+    server.start()
+    yield server
+    server.stop()
+    server.join(timeout=5)
+
+
+def _get(url: str, headers: dict = None):
+    return urllib.request.urlopen(urllib.request.Request(url, headers=headers or {}), timeout=5)
+
+
+def test_get_download_url(tmp_path) -> None:
+    url = get_download_url(tmp_path / "foo.zip", "baa 1.zip", base_url="http://localhost:8502")
+    assert url == "http://localhost:8502/download/foo.zip?filename=baa+1.zip"
+    # without a public url, the download button of streamlit is used
+    assert get_download_url(tmp_path / "foo.zip", "baa.zip", base_url=None) is None
+
+
+def test_download_server(tmp_path, download_server) -> None:
+    assert download_server.is_serving()
+    assert download_server.port != 0
+    artifact = tmp_path / "foo.zip"
+    artifact.write_bytes(bytes(range(256)) * 4)
+    base_url = f"http://127.0.0.1:{download_server.port}"
+
+    with _get(get_download_url(artifact, "baa.zip", base_url=base_url)) as response:
+        assert response.read() == artifact.read_bytes()
+        assert response.headers["Content-Type"] == "application/zip"
+        assert response.headers["Content-Disposition"] == 'attachment; filename="baa.zip"'
+    # the archive is only pinned while it is streamed, the pin is released right after the response is finished
+    deadline = time.monotonic() + 5
+    while get_pinned_files(tmp_path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert get_pinned_files(tmp_path) == set()
+    assert (tmp_path / PIN_DIR).is_dir()
+
+    # range requests allow resuming downloads
+    with _get(f"{base_url}/download/foo.zip", headers={"Range": "bytes=10-19"}) as response:
+        assert response.status == 206
+        assert response.read() == bytes(range(10, 20))
+
+    # only archives of the cache directory are served
+    (tmp_path / "foo.tiff").write_text("foo")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "baa.zip").write_text("baa")
+    for path in ["foo.tiff", "missing.zip", "sub/baa.zip", "../foo.zip"]:
+        with pytest.raises(urllib.error.HTTPError) as e:
+            _get(f"{base_url}/download/{path}")
+        assert e.value.code in (403, 404)
+
+
+def test_download_server__metrics(tmp_path, download_server) -> None:
+    Metrics(tmp_path).increment("jobs_rejected_total")
+    with _get(f"http://127.0.0.1:{download_server.port}/metrics") as response:
+        assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert "mapa_streamlit_jobs_rejected_total 1" in response.read().decode().splitlines()
+
+
+def test_download_server__port_in_use(tmp_path, download_server) -> None:
+    other = DownloadServer(path=tmp_path, port=download_server.port, address="127.0.0.1")
+    other.start()
+    other.join(timeout=5)
+    assert not other.is_serving()
+    assert other.error is not None
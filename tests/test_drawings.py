@@ -0,0 +1,44 @@
+from mapa.caching import get_hash_of_geojson
+
+from mapa_streamlit import drawings as drawings_module
+from mapa_streamlit.drawings import DrawingIndex
+
+
+def _get_rectangle(lon: float) -> dict:
+    return {
+        "type": "Polygon",
+        "coordinates": [[[lon, 47.8], [lon, 48.1], [lon + 0.3, 48.1], [lon + 0.3, 47.8], [lon, 47.8]]],
+    }
+
+
+def test_drawing_index(monkeypatch) -> None:
+    hashed = []
+
+    def _get_geometry_hash(geometry):
+        hashed.append(geometry)
+        return get_hash_of_geojson(geometry)
+
+    monkeypatch.setattr(drawings_module, "get_geometry_hash", _get_geometry_hash)
+    foo, baa, foobar = _get_rectangle(7.9), _get_rectangle(8.9), _get_rectangle(9.9)
+    index = DrawingIndex()
+    assert index.update([]) is None
+    assert index.geometry(None) is None
+
+    assert index.update([foo]) == get_hash_of_geojson(foo)
+    assert index.geometry(get_hash_of_geojson(foo)) == foo
+    # the newly added drawing becomes active, only it gets hashed
+    assert index.update([foo, baa]) == get_hash_of_geojson(baa)
+    assert hashed == [foo, baa]
+    # reruns without changes do not hash anything
+    assert index.update([foo, baa]) == get_hash_of_geojson(baa)
+    assert hashed == [foo, baa]
+
+    # deleting a drawing keeps the active one
+    assert index.update([baa]) == get_hash_of_geojson(baa)
+    assert index.geometry(get_hash_of_geojson(foo)) is None
+    assert index.update([baa, foobar]) == get_hash_of_geojson(foobar)
+    assert index.geometry(get_hash_of_geojson(baa)) == baa
+    assert index.geometry(get_hash_of_geojson(foobar)) == foobar
+
+    # deleting the active drawing leaves no geometry to work with
+    assert index.geometry(index.update([baa])) is None
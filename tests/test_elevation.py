@@ -0,0 +1,105 @@
+import zipfile
+
+import numpy as np
+import pytest
+import rasterio as rio
+from mapa.raster import clip_tiff_to_bbox, determine_elevation_scale, merge_tiffs
+
+from mapa_streamlit.caching import get_elevation_hash
+from mapa_streamlit.conversion import convert_bbox_to_stl, get_elevation_for_bbox
+from mapa_streamlit.elevation import (
+    ElevationSource,
+    GeoTiffElevationSource,
+    StacElevationSource,
+    SyntheticElevationSource,
+    _get_elevation_scale,
+    _merge_and_clip_tiffs,
+    get_elevation_source,
+)
+from tests.test_conversion import GEOMETRY
+
+
+def test_get_elevation_source(tmp_path) -> None:
+    assert isinstance(get_elevation_source(), StacElevationSource)
+    assert str(get_elevation_source(f"geotiff:{tmp_path}").path) == str(tmp_path)
+    assert get_elevation_source("synthetic:3").seed == 3
+    assert get_elevation_source("synthetic").seed == 0
+    for spec in ("foo", "geotiff", "stac:foo"):
+        with pytest.raises(ValueError, match="Unknown elevation source"):
+            get_elevation_source(spec)
+    # sources need to implement `read`
+    with pytest.raises(TypeError):
+        ElevationSource()
+
+
+def test_merge_and_clip_tiffs__mirrors_mapa(tmp_path, stac_catalogue) -> None:
+    tiffs = sorted((tmp_path / "catalogue").glob("*.tif"))
+    expected = clip_tiff_to_bbox(merge_tiffs(tiffs, "foo", tmp_path), GEOMETRY, "foo", tmp_path)
+    (tmp_path / "mapa").mkdir()
+    array, transform = _merge_and_clip_tiffs(tiffs, GEOMETRY, "foo", tmp_path / "mapa")
+    with rio.open(expected) as mapa_tiff:
+        assert np.array_equal(array, mapa_tiff.read())
+        assert transform == mapa_tiff.transform
+        assert _get_elevation_scale(transform, array.shape[2]) == pytest.approx(determine_elevation_scale(mapa_tiff, 1))
+    # neither the merged nor the clipped tiff is kept, the clipped raster is cached as elevation array only
+    assert list((tmp_path / "mapa").iterdir()) == []
+
+
+def test_geotiff_elevation_source(tmp_path, stac_catalogue) -> None:
+    expected, expected_scale = StacElevationSource().read(GEOMETRY, tmp_path)
+
+    # the bounding box covers four tiles of the directory
+    array, elevation_scale = GeoTiffElevationSource(tmp_path / "catalogue").read(GEOMETRY, tmp_path)
+    assert abs(array.shape[0] - expected.shape[0]) <= 1
+    assert abs(array.shape[1] - expected.shape[1]) <= 1
+    assert elevation_scale == pytest.approx(expected_scale, rel=0.02)
+    rows, cols = min(array.shape[0], expected.shape[0]), min(array.shape[1], expected.shape[1])
+    assert np.abs(array[:rows, :cols].astype(float) - expected[:rows, :cols]).mean() < 50
+
+    # a single file is cropped to the bounding box
+    geometry = {"type": "Polygon", "coordinates": [[[7.2, 47.2], [7.2, 47.5], [7.6, 47.5], [7.6, 47.2], [7.2, 47.2]]]}
+    array, _ = GeoTiffElevationSource(tmp_path / "catalogue" / "ALPSMLC30_N047E007.tif").read(geometry, tmp_path)
+    assert array.shape == (36, 48)
+
+    with pytest.raises(ValueError, match="does not contain elevation data"):
+        outside = {"type": "Polygon", "coordinates": [[[1, 1], [1, 2], [2, 2], [2, 1], [1, 1]]]}
+        GeoTiffElevationSource(tmp_path / "catalogue").read(outside, tmp_path)
+
+
+def test_synthetic_elevation_source(tmp_path) -> None:
+    array, elevation_scale = SyntheticElevationSource().read(GEOMETRY, tmp_path)
+    # 0.3 degree at 1 arc second
+    assert array.shape == (1080, 1080)
+    assert array.dtype == np.float32
+    assert np.ptp(array) > 100
+    assert elevation_scale == pytest.approx(1 / 22_400, rel=0.01)
+    assert np.array_equal(array, SyntheticElevationSource().read(GEOMETRY, tmp_path)[0])
+    assert not np.array_equal(array, SyntheticElevationSource(seed=1).read(GEOMETRY, tmp_path)[0])
+
+
+def test_convert_bbox_to_stl__synthetic(tmp_path) -> None:
+    # the full pipeline runs without fetching any elevation data
+    output = convert_bbox_to_stl(
+        bbox_geometry=GEOMETRY,
+        model_size=100,
+        z_offset=2.0,
+        z_scale=1.0,
+        ensure_squared=False,
+        split_area_in_tiles="1x2",
+        output_file=tmp_path / "foo",
+        cache_dir=tmp_path,
+        elevation_source="synthetic",
+    )
+    with zipfile.ZipFile(output) as zip_file:
+        assert sorted(zip_file.namelist()) == ["foo_1.stl", "foo_2.stl"]
+    # no dem tiles were downloaded, only the elevation raster is cached
+    assert [f.name for f in tmp_path.glob("*.tiff")] == [f"elevation_{get_elevation_hash(GEOMETRY, 'synthetic')}.tiff"]
+
+    # the elevation arrays of different sources are cached separately
+    array, elevation_scale = get_elevation_for_bbox(GEOMETRY, tmp_path, elevation_source="synthetic")
+    cached, cached_scale = get_elevation_for_bbox(GEOMETRY, tmp_path, elevation_source="synthetic")
+    assert np.array_equal(array, cached) and cached.dtype == np.float32
+    assert cached_scale == elevation_scale
+    assert len(list(tmp_path.glob("elevation_*.tiff"))) == 1
+    get_elevation_for_bbox(GEOMETRY, tmp_path, elevation_source="synthetic:1")
+    assert len(list(tmp_path.glob("elevation_*.tiff"))) == 2
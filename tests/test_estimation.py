@@ -0,0 +1,65 @@
+import pytest
+
+from mapa_streamlit.estimation import (
+    _TRIANGLE_MEMORY,
+    EARTH_RADIUS,
+    _get_triangles_of_tile,
+    estimate_cost,
+    get_geodesic_area,
+)
+from mapa_streamlit.settings import DEM_BYTES_PER_PIXEL
+from tests.test_conversion import GEOMETRY
+
+
+def _get_geometry(min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> dict:
+    return {
+        "type": "Polygon",
+        "coordinates": [
+            [[min_lon, min_lat], [min_lon, max_lat], [max_lon, max_lat], [max_lon, min_lat], [min_lon, min_lat]]
+        ],
+    }
+
+
+def test_get_geodesic_area() -> None:
+    # the whole sphere
+    assert get_geodesic_area((-180, -90, 180, 90)) == pytest.approx(4 * 3.141592653589793 * EARTH_RADIUS**2)
+    # one degree cell at the equator is roughly 111 km x 111 km
+    assert get_geodesic_area((0, 0, 1, 1)) / 1e6 == pytest.approx(12364, rel=0.01)
+    # cells of the same size in degree get smaller towards the poles
+    assert get_geodesic_area((0, 60, 1, 61)) == pytest.approx(get_geodesic_area((0, 0, 1, 1)) / 2, rel=0.02)
+
+
+def test__get_triangles_of_tile() -> None:
+    assert _get_triangles_of_tile(10, 20) == 4 * 10 * 20 + 6 * 30
+    # large tiles get reduced to a resolution of about 800 pixels
+    assert _get_triangles_of_tile(8000, 8000) == _get_triangles_of_tile(800, 800)
+
+
+def test_estimate_cost() -> None:
+    estimate = estimate_cost(GEOMETRY)
+    # 0.3 x 0.3 degree at a latitude of about 48 degree
+    assert estimate.area == pytest.approx(33.4 * 22.4, rel=0.01)
+    assert estimate.dem_pixels == pytest.approx(estimate.area * 1e6 / 30**2, rel=0.01)
+    # geometry touches four dem tiles, which need to be merged
+    assert estimate.fetch_size == pytest.approx(4 * 4 * 111e3 * 74e3 / 30**2, rel=0.02)
+    assert estimate.peak_memory > estimate.fetch_size
+    # fetching the elevation data for the preview does not compute any triangles
+    assert estimate.fetch_size < estimate.fetch_memory < estimate.peak_memory
+    assert estimate.output_size > estimate.triangles * 50
+
+    squared = estimate_cost(GEOMETRY, ensure_squared=True)
+    assert squared.dem_pixels < estimate.dem_pixels
+    tiled = estimate_cost(GEOMETRY, split_area_in_tiles="2x2", tile_workers=1)
+    assert tiled.triangles > estimate.triangles
+    assert tiled.peak_memory < estimate.peak_memory
+    # tiles meshed in parallel need their memory at the same time, including the copies of their arrays
+    parallel = estimate_cost(GEOMETRY, split_area_in_tiles="2x2", tile_workers=4)
+    triangle_memory = 3 * tiled.triangles / 4 * _TRIANGLE_MEMORY
+    array_copies = 2 * tiled.dem_pixels * DEM_BYTES_PER_PIXEL
+    assert parallel.peak_memory - tiled.peak_memory == pytest.approx(triangle_memory + array_copies, rel=0.01)
+
+    # the same area in degree costs less near the poles than at the equator
+    equator = estimate_cost(_get_geometry(10.1, 0.1, 10.9, 0.9))
+    north = estimate_cost(_get_geometry(10.1, 70.1, 10.9, 70.9))
+    assert north.dem_pixels < equator.dem_pixels / 2
+    assert north.fetch_size < equator.fetch_size / 2
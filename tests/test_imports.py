@@ -0,0 +1,33 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import tomli
+
+import mapa_streamlit
+
+ROOT = Path(__file__).parent.parent
+
+
+def _get_imported_modules(statement: str) -> set:
+    result = subprocess.run(
+        [sys.executable, "-c", f"import json, sys; {statement}; print(json.dumps(list(sys.modules)))"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(json.loads(result.stdout.splitlines()[-1]))
+
+
+def test_app_defers_heavy_imports() -> None:
+    modules = _get_imported_modules("import app")
+    for deferred in ("mapa", "folium", "streamlit_folium", "rasterio", "numba", "mapa_streamlit.conversion"):
+        assert deferred not in modules
+
+
+def test_version_is_resolved_lazily() -> None:
+    assert "tomli" not in _get_imported_modules("import mapa_streamlit.settings")
+    with open(ROOT / "pyproject.toml", "rb") as f:
+        assert mapa_streamlit.__version__ == tomli.load(f)["tool"]["poetry"]["version"]
@@ -0,0 +1,236 @@
+import os
+import pstats
+import signal
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pytest
+
+from mapa_streamlit import conversion, jobs
+from mapa_streamlit.admission import AdmissionController, JobRejected
+from mapa_streamlit.caching import ResultCache, get_elevation_hash
+from mapa_streamlit.conversion import elevation_for_bbox_is_cached, path_to_elevation_raster
+from mapa_streamlit.jobs import (
+    FileProgressBar,
+    JobManager,
+    JobStatus,
+    ProgressPoller,
+    fetch_elevation,
+    get_fetch_job_id,
+    get_profile_file,
+    get_progress_file,
+    run_conversion,
+)
+from mapa_streamlit.locking import Lease, get_lease_file
+from mapa_streamlit.manifest import CacheManifest
+from mapa_streamlit.metrics import Metrics
+from tests.test_conversion import GEOMETRY
+
+
+def _slow_job(path: Path, job_id: str) -> str:
+    FileProgressBar(get_progress_file(path, job_id)).progress(50)
+    time.sleep(1)
+    return job_id
+
+
+def _failing_job() -> None:
+    raise ValueError("foo")
+
+
+def _killed_job() -> None:
+    # e.g. killed by the oom killer
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def _wait_for(job_manager: JobManager, job_id: str, timeout: float = 30.0) -> str:
+    start = time.time()
+    while job_manager.status(job_id) in (JobStatus.QUEUED, JobStatus.PENDING, JobStatus.RUNNING):
+        assert time.time() - start < timeout
+        time.sleep(0.1)
+    return job_manager.status(job_id)
+
+
+def test_file_progress_bar(tmp_path) -> None:
+    progress_file = get_progress_file(tmp_path, "foo")
+    assert progress_file == tmp_path / "foo.progress"
+    FileProgressBar(progress_file).progress(42)
+    assert progress_file.read_text() == "42"
+
+
+def test_progress_poller(tmp_path) -> None:
+    job_ids = ["foo", "baa"]
+    poller = ProgressPoller(tmp_path, lambda: job_ids)
+    FileProgressBar(get_progress_file(tmp_path, "foo")).progress(42)
+    assert poller.progress("foo") == 0
+    poller.run_once()
+    # progress is answered from memory, jobs without progress file are at 0
+    get_progress_file(tmp_path, "foo").write_text("")
+    assert poller.progress("foo") == 42
+    assert poller.progress("baa") == 0
+    # partially written files keep the last progress, finished jobs are forgotten
+    poller.run_once()
+    assert poller.progress("foo") == 42
+    job_ids.remove("foo")
+    poller.run_once()
+    assert poller.progress("foo") == 0
+
+
+def test_run_conversion(tmp_path, monkeypatch) -> None:
+    def _convert_bbox_to_stl(bbox_geometry, output_file, progress_bar, cache_dir, **kwargs):
+        progress_bar.progress(50)
+        assert get_progress_file(cache_dir, "foo").is_file()
+        Path(f"{output_file}.zip").write_text("foo")
+
+    monkeypatch.setattr(conversion, "convert_bbox_to_stl", _convert_bbox_to_stl)
+    artifact = run_conversion({}, "foo", tmp_path, {"model_size": 100})
+    assert artifact == tmp_path / "foo.zip"
+    assert ResultCache(tmp_path).contains("foo")
+    assert CacheManifest(tmp_path).files(".zip") == [artifact]
+    # progress and lease files get cleaned up
+    assert not get_progress_file(tmp_path, "foo").is_file()
+    assert not get_lease_file(tmp_path, "foo").is_file()
+    assert "conversion" in Metrics(tmp_path).durations()
+    # jobs are only profiled if enabled
+    assert not get_profile_file(tmp_path, "foo").is_file()
+
+
+def test_run_conversion__profile_slow_jobs(tmp_path, monkeypatch) -> None:
+    def _convert_bbox_to_stl(output_file, **kwargs):
+        time.sleep(0.1)
+        Path(f"{output_file}.zip").write_text("foo")
+
+    monkeypatch.setattr(conversion, "convert_bbox_to_stl", _convert_bbox_to_stl)
+    run_conversion({}, "fast", tmp_path, {}, profile_slow_jobs=60.0)
+    assert not get_profile_file(tmp_path, "fast").is_file()
+
+    run_conversion({}, "slow", tmp_path, {}, profile_slow_jobs=0.05)
+    profile_file = get_profile_file(tmp_path, "slow")
+    assert profile_file == tmp_path / "slow.prof"
+    assert any(name == "_convert_bbox_to_stl" for _, _, name in pstats.Stats(str(profile_file)).stats)
+    # profiles are evicted like any other result
+    assert profile_file in CacheManifest(tmp_path).files(".prof")
+
+
+def test_run_conversion__single_flight(tmp_path, monkeypatch) -> None:
+    def _convert_bbox_to_stl(**kwargs):
+        raise AssertionError("result should not be computed twice")
+
+    monkeypatch.setattr(conversion, "convert_bbox_to_stl", _convert_bbox_to_stl)
+    monkeypatch.setattr(jobs, "LEASE_POLLING_INTERVAL", 0.01)
+
+    # another process holds the lease and is computing the same result
+    lease = Lease(get_lease_file(tmp_path, "foo"))
+    assert lease.acquire()
+    results = []
+    thread = threading.Thread(target=lambda: results.append(run_conversion({}, "foo", tmp_path, {})))
+    thread.start()
+    time.sleep(0.1)
+    assert thread.is_alive()
+
+    # once the other process finished, the waiting conversion returns the very same archive
+    ResultCache(tmp_path).artifact("foo").write_text("foo")
+    ResultCache(tmp_path).add("foo")
+    lease.release()
+    thread.join(timeout=5)
+    assert results == [tmp_path / "foo.zip"]
+
+
+def test_fetch_elevation(tmp_path) -> None:
+    raster_file = fetch_elevation(GEOMETRY, tmp_path, elevation_source="synthetic")
+    assert raster_file == path_to_elevation_raster(get_elevation_hash(GEOMETRY, "synthetic"), tmp_path)
+    assert elevation_for_bbox_is_cached(get_elevation_hash(GEOMETRY, "synthetic"), tmp_path)
+    assert get_fetch_job_id(GEOMETRY, "synthetic") != get_fetch_job_id(GEOMETRY)
+
+
+def test_job_manager(tmp_path) -> None:
+    job_manager = JobManager(path=tmp_path, max_workers=1)
+    try:
+        assert job_manager.status("foo") is None
+        assert job_manager.progress("foo") == 0
+
+        assert job_manager.submit("foo", _slow_job, tmp_path, "foo") == "foo"
+        assert job_manager.status("foo") in (JobStatus.PENDING, JobStatus.RUNNING)
+        # submitting the same job again does not start another computation
+        future = job_manager._jobs["foo"]
+        job_manager.submit("foo", _slow_job, tmp_path, "foo")
+        assert job_manager._jobs["foo"] is future
+
+        assert _wait_for(job_manager, "foo") == JobStatus.DONE
+        assert job_manager.progress("foo") == 100
+        assert job_manager.error("foo") is None
+
+        job_manager.submit("baa", _failing_job)
+        assert _wait_for(job_manager, "baa") == JobStatus.FAILED
+        with pytest.raises(ValueError):
+            raise job_manager.error("baa")
+    finally:
+        job_manager.shutdown()
+
+
+def test_job_manager__worker_died(tmp_path) -> None:
+    job_manager = JobManager(path=tmp_path, max_workers=1)
+    try:
+        job_manager.submit("killed", _killed_job)
+        assert _wait_for(job_manager, "killed") == JobStatus.FAILED
+        assert isinstance(job_manager.error("killed"), BrokenProcessPool)
+        # the worker pool is restarted, so later jobs succeed
+        job_manager.submit("foo", _slow_job, tmp_path, "foo")
+        assert _wait_for(job_manager, "foo") == JobStatus.DONE
+        assert ("worker_pool_restarts_total", "", 1) in Metrics(tmp_path).counters()
+    finally:
+        job_manager.shutdown()
+
+
+def test_job_manager__retention(tmp_path) -> None:
+    job_manager = JobManager(path=tmp_path, max_workers=1, retention=0.5)
+    try:
+        job_manager.submit("foo", _slow_job, tmp_path, "foo")
+        assert _wait_for(job_manager, "foo") == JobStatus.DONE
+        time.sleep(0.5)
+        # finished jobs are forgotten once the retention passed
+        job_manager.submit("baa", _failing_job)
+        assert job_manager.status("foo") is None
+        assert "foo" not in job_manager._jobs
+        assert _wait_for(job_manager, "baa") == JobStatus.FAILED
+    finally:
+        job_manager.shutdown()
+
+
+def test_job_manager__admission_control(tmp_path) -> None:
+    admission_controller = AdmissionController(budget=100)
+    job_manager = JobManager(path=tmp_path, max_workers=2, admission_controller=admission_controller)
+    try:
+        with pytest.raises(JobRejected):
+            job_manager.submit("too_large", _slow_job, tmp_path, "too_large", memory=101)
+        assert job_manager.status("too_large") is None
+        assert ("jobs_rejected_total", "", 1) in Metrics(tmp_path).counters()
+
+        job_manager.submit("foo", _slow_job, tmp_path, "foo", memory=60)
+        # baa does not fit into the remaining budget and needs to wait for foo, even though a worker is idle
+        job_manager.submit("baa", _slow_job, tmp_path, "baa", memory=60)
+        assert job_manager.status("baa") == JobStatus.QUEUED
+        assert job_manager.progress("baa") == 0
+        # submitting a queued job again does not queue it twice
+        job_manager.submit("baa", _slow_job, tmp_path, "baa", memory=60)
+        assert list(job_manager._queue) == ["baa"]
+
+        assert _wait_for(job_manager, "foo") == JobStatus.DONE
+        assert _wait_for(job_manager, "baa") == JobStatus.DONE
+
+        # reservations are released on failure as well
+        job_manager.submit("failing", _failing_job, memory=100)
+        assert _wait_for(job_manager, "failing") == JobStatus.FAILED
+        start = time.time()
+        while admission_controller.reserved:
+            assert time.time() - start < 5
+            time.sleep(0.01)
+
+        metrics = Metrics(tmp_path)
+        assert ("jobs_total", 'status="done"', 2) in metrics.counters()
+        assert ("jobs_total", 'status="failed"', 1) in metrics.counters()
+        assert ("memory_budget_bytes", "", 100) in metrics.gauges()
+        assert ("jobs_queued", "", 0) in metrics.gauges()
+    finally:
+        job_manager.shutdown()
@@ -0,0 +1,140 @@
+import json
+import os
+import socket
+import threading
+import time
+
+from mapa_streamlit.locking import FileLock, Lease, LeaseHeartbeat, get_lease_file
+
+
+def test_lease(tmp_path) -> None:
+    lease_file = get_lease_file(tmp_path, "foo")
+    assert lease_file == tmp_path / "foo.lease"
+
+    lease = Lease(lease_file)
+    assert lease.is_held() is False
+    assert lease.acquire() is True
+    assert lease.is_held() is True
+    owner = json.loads(lease_file.read_text())
+    assert owner["pid"] == os.getpid()
+
+    # a second lease on the same file cannot be acquired
+    other = Lease(lease_file)
+    assert other.acquire() is False
+    # releasing a lease which was not acquired does not affect the owner
+    other.release()
+    assert lease_file.is_file()
+
+    lease.release()
+    assert not lease_file.is_file()
+    assert other.acquire() is True
+    other.release()
+
+
+def test_lease__stale(tmp_path) -> None:
+    lease_file = get_lease_file(tmp_path, "foo")
+
+    # owner of the lease is no longer alive
+    dead_pid = 2**22 + 1
+    lease_file.write_text(json.dumps({"pid": dead_pid, "host": socket.gethostname(), "created": time.time()}))
+    lease = Lease(lease_file)
+    assert lease.is_held() is False
+    assert lease.acquire() is True
+    lease.release()
+
+    # owner of the lease is alive, but the lease timed out
+    lease_file.write_text(json.dumps({"pid": os.getpid(), "host": socket.gethostname(), "created": time.time()}))
+    assert Lease(lease_file).acquire() is False
+    lease = Lease(lease_file, timeout=0.0)
+    assert lease.acquire() is True
+    lease.release()
+
+    # leases of other hosts cannot be checked for liveness
+    lease_file.write_text(json.dumps({"pid": dead_pid, "host": "other-host", "created": time.time()}))
+    assert Lease(lease_file).acquire() is False
+
+
+def test_lease__broken_while_held(tmp_path) -> None:
+    lease_file = get_lease_file(tmp_path, "foo")
+    lease = Lease(lease_file)
+    assert lease.acquire() is True
+
+    # the lease timed out from the perspective of another owner, which breaks and acquires it
+    other = Lease(lease_file, timeout=0.0)
+    assert other.acquire() is True
+    # releasing the broken lease keeps the lease of the new owner
+    lease.release()
+    assert lease_file.is_file()
+    assert Lease(lease_file).is_held() is True
+    other.release()
+    assert not lease_file.is_file()
+
+
+def test_lease__break_if_stale(tmp_path) -> None:
+    lease_file = get_lease_file(tmp_path, "foo")
+    lease = Lease(lease_file)
+    assert lease.break_if_stale() is False
+    assert lease.acquire() is True
+    assert Lease(lease_file).break_if_stale() is False
+    assert lease_file.is_file()
+    assert Lease(lease_file, timeout=0.0).break_if_stale() is True
+    assert not lease_file.is_file()
+
+
+def test_lease__renew(tmp_path) -> None:
+    lease_file = get_lease_file(tmp_path, "foo")
+    lease = Lease(lease_file, timeout=0.2)
+    assert lease.renew() is False
+    assert lease.acquire() is True
+    time.sleep(0.15)
+    assert lease.renew() is True
+    time.sleep(0.15)
+    # older than the timeout since it was acquired, but not since it was renewed
+    assert lease.is_held() is True
+    assert Lease(lease_file, timeout=0.2).break_if_stale() is False
+
+    # a broken lease is not renewed and the lease file of the new owner is kept
+    assert Lease(lease_file, timeout=0.0).break_if_stale() is True
+    other = Lease(lease_file)
+    assert other.acquire() is True
+    assert lease.renew() is False
+    assert json.loads(lease_file.read_text())["created"] == other._owner["created"]
+
+
+def test_lease_heartbeat(tmp_path) -> None:
+    lease_file = get_lease_file(tmp_path, "foo")
+    lease = Lease(lease_file, timeout=0.2)
+    assert lease.acquire() is True
+    heartbeat = LeaseHeartbeat(lease, interval=0.05)
+    heartbeat.start()
+    try:
+        time.sleep(0.5)
+        assert lease.is_held() is True
+    finally:
+        heartbeat.stop()
+    assert not heartbeat.is_alive()
+    lease.release()
+    assert not lease_file.is_file()
+
+
+def test_file_lock(tmp_path) -> None:
+    lock_file = tmp_path / "foo.lock"
+    events = []
+
+    def _hold_lock() -> None:
+        with FileLock(lock_file):
+            events.append("acquired")
+            time.sleep(0.2)
+            events.append("released")
+
+    thread = threading.Thread(target=_hold_lock)
+    thread.start()
+    while not events:
+        time.sleep(0.01)
+    # blocks until the other thread released the lock
+    with FileLock(lock_file):
+        events.append("acquired")
+    thread.join()
+    assert events == ["acquired", "released", "acquired"]
+    # the lock file is kept, so it can be reused
+    assert lock_file.is_file()
@@ -0,0 +1,83 @@
+import time
+
+from mapa_streamlit.manifest import CacheManifest
+
+
+def test_cache_manifest(tmp_path) -> None:
+    manifest = CacheManifest(tmp_path)
+    assert manifest.size() == 0
+    assert manifest.count() == 0
+    assert manifest.files() == []
+
+    stl = tmp_path / "foo.stl"
+    stl.write_text("foo")
+    tiff = tmp_path / "foo.tiff"
+    tiff.write_text("foobaa")
+    # missing files are ignored
+    manifest.add(stl, tiff, tmp_path / "missing.zip")
+    assert manifest.size() == 9
+    assert manifest.size(".stl") == 3
+    assert manifest.size(".zip") == 0
+    assert manifest.count() == 2
+    assert manifest.count(".tiff") == 1
+    assert manifest.files(".stl") == [stl]
+
+    # adding a file again updates its size instead of adding it twice
+    stl.write_text("foofoo")
+    manifest.add(stl)
+    assert manifest.size() == 12
+    assert manifest.count(".stl") == 1
+
+    manifest.remove(stl)
+    assert manifest.size() == 6
+    assert manifest.count(".stl") == 0
+
+    # manifest is persisted
+    assert CacheManifest(tmp_path).files() == [tiff]
+
+
+def test_cache_manifest__touch(tmp_path) -> None:
+    manifest = CacheManifest(tmp_path)
+    stl = tmp_path / "foo.stl"
+    stl.write_text("foo")
+    manifest.add(stl)
+
+    def _atime():
+        return manifest._connect().execute("SELECT atime FROM files").fetchone()[0]
+
+    atime = _atime()
+    time.sleep(0.01)
+    manifest.touch(stl)
+    assert _atime() > atime
+
+
+def test_cache_manifest__reconcile(tmp_path) -> None:
+    manifest = CacheManifest(tmp_path)
+    assert manifest.needs_reconciliation() is True
+
+    # files written without notifying the manifest
+    (tmp_path / "foo.stl").write_text("foo")
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    (sub / "foo.tiff").write_text("foo")
+    # files removed without notifying the manifest
+    zip = tmp_path / "foo.zip"
+    zip.write_text("foo")
+    manifest.add(zip)
+    zip.unlink()
+    assert manifest.count() == 1
+    # leases and progress of running jobs are no cached data
+    for name in ("foo.lease", "foo.progress"):
+        (tmp_path / name).write_text("foo")
+        manifest.add(tmp_path / name)
+    assert manifest.count() == 1
+
+    manifest.reconcile()
+    assert manifest.needs_reconciliation() is False
+    assert manifest.needs_reconciliation(interval=0.0) is True
+    assert manifest.count() == 2
+    assert manifest.count(".stl") == 1
+    assert manifest.count(".tiff") == 1
+    assert manifest.count(".zip") == 0
+    assert manifest.size() == 6
+    assert sorted(manifest.files()) == sorted([tmp_path / "foo.stl", sub / "foo.tiff"])
@@ -0,0 +1,104 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from mapa_streamlit.caching import ResultCache
+from mapa_streamlit.manifest import CacheManifest
+from mapa_streamlit.metrics import Metrics, export_metrics
+
+
+def test_metrics(tmp_path) -> None:
+    metrics = Metrics(tmp_path)
+    assert metrics.counters() == []
+    assert metrics.gauges() == []
+    assert metrics.durations() == {}
+
+    metrics.increment("foo_total")
+    metrics.increment("foo_total", 2)
+    metrics.increment("foo_total", reason="baa")
+    metrics.set_gauge("queued", 3)
+    metrics.set_gauge("queued", 1)
+    assert metrics.counters() == [("foo_total", "", 3), ("foo_total", 'reason="baa"', 1)]
+    assert metrics.gauges() == [("queued", "", 1)]
+
+    metrics.observe("mesh", 0.3)
+    metrics.observe("mesh", 2.0)
+    buckets, count, total = metrics.durations()["mesh"]
+    assert count == 2
+    assert total == pytest.approx(2.3)
+    assert dict(buckets)[0.1] == 0
+    assert dict(buckets)[0.5] == 1
+    assert dict(buckets)[5.0] == 2
+
+    # metrics are shared by all instances using the same directory, e.g. by worker processes
+    with Metrics(tmp_path).span("archive"):
+        pass
+    assert metrics.durations()["archive"][1] == 1
+    # failing stages are recorded as well
+    with pytest.raises(ValueError):
+        with metrics.span("archive"):
+            raise ValueError("foo")
+    assert metrics.durations()["archive"][1] == 2
+
+
+def _stored_counters(metrics: Metrics) -> list:
+    if not metrics.store_file.is_file():
+        return []
+    with closing(sqlite3.connect(metrics.store_file)) as con:
+        return con.execute("SELECT name, labels, value FROM counters").fetchall()
+
+
+def test_metrics__buffered(tmp_path) -> None:
+    metrics = Metrics(tmp_path, flush_interval=3600)
+    metrics.increment("foo_total")
+    metrics.observe("mesh", 0.3)
+    # metrics are buffered in memory of the process, until they are flushed
+    assert _stored_counters(metrics) == []
+    metrics.flush()
+    assert _stored_counters(metrics) == [("foo_total", "", 1)]
+    # reading the metrics flushes them
+    Metrics(tmp_path, flush_interval=3600).increment("foo_total")
+    assert metrics.counters() == [("foo_total", "", 2)]
+    assert metrics.durations()["mesh"][1] == 1
+
+    # buffered metrics are flushed once the interval passed
+    metrics = Metrics(tmp_path, flush_interval=0.0)
+    metrics.increment("foo_total")
+    assert _stored_counters(metrics) == [("foo_total", "", 3)]
+
+
+def test_metrics__metrics_dir(tmp_path) -> None:
+    metrics = Metrics(tmp_path / "cache", metrics_dir=tmp_path / "local")
+    metrics.increment("foo_total")
+    assert metrics.counters() == [("foo_total", "", 1)]
+    assert (tmp_path / "local" / "mapa_streamlit_metrics.sqlite").is_file()
+    assert not (tmp_path / "cache").exists()
+
+
+def test_export_metrics(tmp_path) -> None:
+    metrics = Metrics(tmp_path)
+    metrics.observe("fetch_dem", 0.3)
+    metrics.increment("selections_rejected_total", reason="boundary")
+    metrics.set_gauge("jobs_queued", 2)
+    ResultCache(tmp_path).lookup("missing")
+    (tmp_path / "foo.stl").write_text("foo")
+    CacheManifest(tmp_path).add(tmp_path / "foo.stl")
+
+    lines = export_metrics(tmp_path).splitlines()
+    assert "# TYPE mapa_streamlit_stage_duration_seconds histogram" in lines
+    assert 'mapa_streamlit_stage_duration_seconds_bucket{le="0.1",stage="fetch_dem"} 0' in lines
+    assert 'mapa_streamlit_stage_duration_seconds_bucket{le="0.5",stage="fetch_dem"} 1' in lines
+    assert 'mapa_streamlit_stage_duration_seconds_bucket{le="+Inf",stage="fetch_dem"} 1' in lines
+    assert 'mapa_streamlit_stage_duration_seconds_count{stage="fetch_dem"} 1' in lines
+    assert "# TYPE mapa_streamlit_selections_rejected_total counter" in lines
+    assert 'mapa_streamlit_selections_rejected_total{reason="boundary"} 1' in lines
+    assert "mapa_streamlit_result_cache_misses_total 1" in lines
+    assert "mapa_streamlit_evicted_files_total 0" in lines
+    assert "# TYPE mapa_streamlit_jobs_queued gauge" in lines
+    assert "mapa_streamlit_jobs_queued 2" in lines
+    assert "mapa_streamlit_cache_size_bytes 3" in lines
+    assert any(line.startswith("mapa_streamlit_process_resident_memory_bytes ") for line in lines)
+    # each metric is announced exactly once
+    types = [line for line in lines if line.startswith("# TYPE")]
+    assert len(types) == len(set(types))
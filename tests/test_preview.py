@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from mapa_streamlit import elevation
+from mapa_streamlit.preview import _draw_tile_borders, _hillshade, get_preview
+from tests.test_conversion import GEOMETRY
+
+
+def test_hillshade() -> None:
+    flat = _hillshade(np.zeros((10, 10)), pixel_size=30.0)
+    assert flat.shape == (10, 10)
+    assert np.allclose(flat, flat[0, 0])
+
+    # slopes facing the light source (north west) are brighter than slopes facing away from it
+    slope = np.tile(np.arange(10, dtype=float) * 30.0, (10, 1))
+    assert _hillshade(-slope, pixel_size=30.0).mean() > _hillshade(slope, pixel_size=30.0).mean()
+    assert _hillshade(slope, pixel_size=30.0).min() >= 0
+
+
+def test_draw_tile_borders() -> None:
+    image = _draw_tile_borders(np.zeros((10, 9, 3), dtype=np.uint8), "2x3")
+    assert (image[5, :] != 0).all()
+    assert (image[:, 3] != 0).all()
+    assert (image[:, 6] != 0).all()
+    assert (image[0, 0] == 0).all()
+
+
+def test_get_preview(tmp_path, stac_catalogue, monkeypatch) -> None:
+    params = {"model_size": 100, "z_offset": 2.0, "ensure_squared": False, "split_area_in_tiles": "1x1"}
+    preview = get_preview(GEOMETRY, tmp_path, z_scale=1.0, resolution=50, **params)
+    assert max(preview.image.shape[:2]) <= 50
+    assert preview.image.dtype == np.uint8
+    assert preview.x == 100
+    assert preview.z > 2.0
+
+    def _get_raster_for_bbox(*args, **kwargs):
+        raise AssertionError("elevation data should not be read again")
+
+    # subsequent previews with other parameters only use the cached elevation array
+    monkeypatch.setattr(elevation, "_get_raster_for_bbox", _get_raster_for_bbox)
+    higher = get_preview(GEOMETRY, tmp_path, z_scale=2.0, resolution=50, **params)
+    assert higher.z - 2.0 == pytest.approx((preview.z - 2.0) * 2, abs=0.1)
+    squared = get_preview(GEOMETRY, tmp_path, z_scale=1.0, resolution=50, **{**params, "ensure_squared": True})
+    assert squared.x == squared.y == 100
+    assert len(stac_catalogue["search"]) == 1
@@ -0,0 +1,129 @@
+import json
+import time
+from pathlib import Path
+
+from mapa_streamlit.caching import ResultCache, get_result_key
+from mapa_streamlit.cli import get_bbox_geometry
+from mapa_streamlit.jobs import JobManager, JobStatus
+from mapa_streamlit.metrics import Metrics
+from mapa_streamlit.prewarming import AccessLog, Prewarmer
+from mapa_streamlit.verification import get_default_params
+
+
+def _stubbed_conversion(geometry: dict, result_key: str, cache_dir: Path, params: dict) -> Path:
+    result_cache = ResultCache(cache_dir)
+    result_cache.artifact(result_key).write_text(json.dumps(params))
+    result_cache.add(result_key)
+    return result_cache.artifact(result_key)
+
+
+def _failing_conversion(geometry: dict, result_key: str, cache_dir: Path, params: dict) -> Path:
+    raise ValueError("foo")
+
+
+def _wait_for(job_manager: JobManager, job_id: str, timeout: float = 30.0) -> str:
+    start = time.time()
+    while job_manager.status(job_id) in (JobStatus.QUEUED, JobStatus.PENDING, JobStatus.RUNNING):
+        assert time.time() - start < timeout
+        time.sleep(0.05)
+    return job_manager.status(job_id)
+
+
+def test_access_log(tmp_path) -> None:
+    access_log = AccessLog(tmp_path, max_entries=3)
+    assert access_log.top_geometries(10) == []
+    params = get_default_params()
+    foo, baa, baz = (get_bbox_geometry(lon, 47.8, lon + 0.3, 48.1) for lon in (7.0, 8.0, 9.0))
+
+    access_log.record(foo, params)
+    # requests of the same geometry with different parameters add up
+    access_log.record(baa, params)
+    access_log.record(baa, dict(params, model_size=150))
+    assert access_log.top_geometries(10) == [baa, foo]
+    assert access_log.top_geometries(1) == [baa]
+
+    # the least requested entry is dropped, i.e. baa with default parameters as it was requested before the others
+    access_log.record(foo, params)
+    access_log.record(foo, params)
+    access_log.record(baz, params)
+    assert access_log.top_geometries(10) == [foo, baz, baa]
+    access_log.record(baz, params)
+    access_log.record(baz, params)
+    assert access_log.top_geometries(2) == [baz, foo]
+
+
+def test_prewarmer(tmp_path) -> None:
+    params = get_default_params()
+    foo, baa = get_bbox_geometry(7.0, 47.8, 7.3, 48.1), get_bbox_geometry(8.0, 47.8, 8.3, 48.1)
+    outside = get_bbox_geometry(179, 0, 181, 1)
+    access_log = AccessLog(tmp_path)
+    for geometry, requests in [(outside, 3), (foo, 2), (baa, 1)]:
+        for _ in range(requests):
+            access_log.record(geometry, dict(params, model_size=150))
+
+    job_manager = JobManager(path=tmp_path, max_workers=1)
+    try:
+        prewarmer = Prewarmer(tmp_path, job_manager, conversion=_stubbed_conversion, cpu_threshold=101.0)
+        # the most requested geometry, which is allowed and not cached yet, is computed using the default parameters
+        job_id = prewarmer.run_once()
+        assert job_id == get_result_key(foo, **params)
+        # no further job is submitted while the job manager is busy
+        assert prewarmer.run_once() is None
+        assert _wait_for(job_manager, job_id) == JobStatus.DONE
+        assert ResultCache(tmp_path).contains(job_id)
+
+        job_id = prewarmer.run_once()
+        assert job_id == get_result_key(baa, **params)
+        assert _wait_for(job_manager, job_id) == JobStatus.DONE
+        # all top geometries are cached
+        assert prewarmer.run_once() is None
+        assert ("prewarmed_total", "", 2) in Metrics(tmp_path).counters()
+
+        # only geometries within the disk budget are computed
+        ResultCache(tmp_path).artifact(job_id).unlink()
+        prewarmer.disk_budget = 1e-6
+        assert prewarmer.run_once() is None
+    finally:
+        job_manager.shutdown()
+
+
+def test_prewarmer__failures(tmp_path) -> None:
+    params = get_default_params()
+    foo, baa = get_bbox_geometry(7.0, 47.8, 7.3, 48.1), get_bbox_geometry(8.0, 47.8, 8.3, 48.1)
+    access_log = AccessLog(tmp_path)
+    for geometry, requests in [(foo, 2), (baa, 1)]:
+        for _ in range(requests):
+            access_log.record(geometry, params)
+
+    job_manager = JobManager(path=tmp_path, max_workers=1)
+    try:
+        prewarmer = Prewarmer(tmp_path, job_manager, conversion=_failing_conversion, cpu_threshold=101.0)
+        job_id = prewarmer.run_once()
+        assert job_id == get_result_key(foo, **params)
+        assert _wait_for(job_manager, job_id) == JobStatus.FAILED
+        # the failed result is skipped, the next candidate is submitted instead
+        assert prewarmer.run_once() == get_result_key(baa, **params)
+        assert _wait_for(job_manager, get_result_key(baa, **params)) == JobStatus.FAILED
+        assert prewarmer.run_once() is None
+        assert prewarmer._failures[job_id][0] == 1
+
+        # failed results are retried after the backoff, which doubles with every failure
+        prewarmer._failures = {key: (failures, 0.0) for key, (failures, _) in prewarmer._failures.items()}
+        assert prewarmer.run_once() == job_id
+        assert _wait_for(job_manager, job_id) == JobStatus.FAILED
+        prewarmer.conversion = _stubbed_conversion
+        assert prewarmer.run_once() == get_result_key(baa, **params)
+        failures, retry = prewarmer._failures[job_id]
+        assert failures == 2
+        assert retry - time.time() > 1.5 * prewarmer.failure_backoff
+        assert _wait_for(job_manager, get_result_key(baa, **params)) == JobStatus.DONE
+        prewarmer.run_once()
+        assert get_result_key(baa, **params) not in prewarmer._failures
+
+        # results rejected by the admission control are skipped right away
+        prewarmer._failures = {}
+        job_manager._admission_controller.budget = 0
+        assert prewarmer.run_once() is None
+        assert prewarmer._is_backing_off(job_id)
+    finally:
+        job_manager.shutdown()
@@ -0,0 +1,91 @@
+import json
+import socket
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from mapa_streamlit.settings import PIN_DIR
+from mapa_streamlit.store import Pin, atomic_write, get_pinned_files, get_tmp_file, locked_transaction
+
+
+def test_get_tmp_file(tmp_path) -> None:
+    tmp_file = get_tmp_file(tmp_path / "foo.zip")
+    assert tmp_file.parent == tmp_path
+    assert tmp_file.name.startswith("foo.zip.") and tmp_file.suffix == ".tmp"
+    assert tmp_file != get_tmp_file(tmp_path / "foo.zip")
+
+
+def test_atomic_write(tmp_path) -> None:
+    file = tmp_path / "foo.json"
+    with atomic_write(file) as tmp_file:
+        tmp_file.write_text("foo")
+        # the file is only published once it is complete
+        assert not file.exists()
+    assert file.read_text() == "foo"
+
+    # failed writes neither replace the file nor leave the temporary file behind
+    with pytest.raises(ValueError):
+        with atomic_write(file) as tmp_file:
+            tmp_file.write_text("baa")
+            raise ValueError
+    assert file.read_text() == "foo"
+    assert list(tmp_path.iterdir()) == [file]
+
+
+def test_locked_transaction(tmp_path) -> None:
+    database = tmp_path / "foo.sqlite"
+    with locked_transaction(database) as con:
+        con.execute("CREATE TABLE foo (value INTEGER)")
+    assert (tmp_path / "foo.sqlite.lock").is_file()
+
+    # failed transactions are rolled back
+    with pytest.raises(ValueError):
+        with locked_transaction(database) as con:
+            con.execute("INSERT INTO foo VALUES (1)")
+            raise ValueError
+
+    # writers are serialized, even if they read before writing
+    def _increment() -> None:
+        for _ in range(20):
+            with locked_transaction(database) as con:
+                value = con.execute("SELECT COUNT(*) FROM foo").fetchone()[0]
+                con.execute("INSERT INTO foo VALUES (?)", (value,))
+
+    threads = [threading.Thread(target=_increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    con = sqlite3.connect(database)
+    assert [v for v, in con.execute("SELECT value FROM foo ORDER BY value")] == list(range(80))
+    con.close()
+
+
+def test_pin(tmp_path) -> None:
+    foo, baa = tmp_path / "foo.zip", tmp_path / "baa.npy"
+    assert get_pinned_files(tmp_path) == set()
+    with Pin(tmp_path, foo, baa):
+        assert get_pinned_files(tmp_path) == {foo, baa}
+        # the same file may be pinned several times
+        with Pin(tmp_path, foo):
+            assert get_pinned_files(tmp_path) == {foo, baa}
+        assert get_pinned_files(tmp_path) == {foo, baa}
+    assert get_pinned_files(tmp_path) == set()
+    assert not list((tmp_path / PIN_DIR).glob("*.pin"))
+
+
+def test_pin__stale(tmp_path) -> None:
+    Pin(tmp_path).acquire()
+    # owner of the pin is no longer alive
+    pin_file = tmp_path / PIN_DIR / "foo.zip.0123.pin"
+    pin_file.write_text(json.dumps({"pid": 2**22 + 1, "host": socket.gethostname(), "created": time.time()}))
+    assert get_pinned_files(tmp_path) == set()
+    assert not pin_file.exists()
+
+    # pins time out
+    pin = Pin(tmp_path, tmp_path / "foo.zip", timeout=0.0)
+    pin.acquire()
+    assert get_pinned_files(tmp_path, timeout=0.0) == set()
+    pin.release()
@@ -0,0 +1,80 @@
+import pytest
+from mapa.exceptions import NoSTACItemFound
+
+from mapa_streamlit.manifest import CacheManifest
+from mapa_streamlit.tiles import TileStore, get_bbox, get_cells, get_tile_dir
+
+
+def _geometry(min_lon, min_lat, max_lon, max_lat) -> dict:
+    return {
+        "type": "Polygon",
+        "coordinates": [
+            [
+                [min_lon, min_lat],
+                [min_lon, max_lat],
+                [max_lon, max_lat],
+                [max_lon, min_lat],
+                [min_lon, min_lat],
+            ]
+        ],
+    }
+
+
+def test_get_bbox() -> None:
+    assert get_bbox(_geometry(8.1, 47.5, 8.4, 48.2)) == (8.1, 47.5, 8.4, 48.2)
+
+
+def test_get_cells() -> None:
+    assert get_cells((8.1, 47.5, 8.4, 47.7)) == [(8, 47)]
+    assert get_cells((7.9, 47.5, 8.4, 48.2)) == [(7, 47), (7, 48), (8, 47), (8, 48)]
+    assert get_cells((-0.5, -0.5, -0.1, -0.1)) == [(-1, -1)]
+    # bounding box on the edge of a cell
+    assert get_cells((8.0, 47.0, 9.0, 48.0)) == [(8, 47)]
+
+
+def test_get_tile_dir(tmp_path) -> None:
+    assert get_tile_dir(tmp_path) == tmp_path / "dem_tiles"
+    assert (tmp_path / "dem_tiles").is_dir()
+    # calling it again does not fail
+    get_tile_dir(tmp_path)
+
+
+def test_tile_store(tmp_path, stac_catalogue) -> None:
+    store = TileStore(get_tile_dir(tmp_path))
+
+    # bounding box within a single tile
+    tiles = store.get_tiles(_geometry(8.1, 47.5, 8.4, 47.7))
+    assert tiles == [store.tile_path("ALPSMLC30_N047E008")]
+    assert all(t.is_file() for t in tiles)
+    assert len(stac_catalogue["search"]) == 1
+    assert len(stac_catalogue["download"]) == 1
+
+    # overlapping bounding box within the same cell neither searches nor downloads again
+    assert store.get_tiles(_geometry(8.2, 47.6, 8.5, 47.8)) == tiles
+    assert len(stac_catalogue["search"]) == 1
+    assert len(stac_catalogue["download"]) == 1
+
+    # bounding box spanning four tiles only downloads the missing ones
+    tiles = store.get_tiles(_geometry(7.9, 47.5, 8.4, 48.2))
+    assert len(tiles) == 4
+    assert len(stac_catalogue["search"]) == 2
+    assert len(stac_catalogue["download"]) == 4
+
+    # tiles are accounted in the manifest of the tile store
+    manifest = CacheManifest(store.path)
+    assert manifest.count(".tiff") == 4
+    assert manifest.size() == sum(t.stat().st_size for t in tiles)
+
+    # tile store is shared across instances
+    assert TileStore(store.path).get_tiles(_geometry(8.1, 48.1, 8.2, 48.2)) == [store.tile_path("ALPSMLC30_N048E008")]
+    assert len(stac_catalogue["download"]) == 4
+
+
+def test_tile_store__no_tiles(tmp_path, stac_catalogue) -> None:
+    store = TileStore(get_tile_dir(tmp_path))
+    with pytest.raises(NoSTACItemFound):
+        store.get_tiles(_geometry(-30.5, 40.1, -30.2, 40.2))
+    # searched cells without tiles are remembered as well
+    with pytest.raises(NoSTACItemFound):
+        store.get_tiles(_geometry(-30.6, 40.1, -30.2, 40.3))
+    assert len(stac_catalogue["search"]) == 1
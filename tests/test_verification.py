@@ -1,29 +1,24 @@
-from mapa_streamlit.verification import _get_area, selected_bbox_in_boundary, selected_bbox_too_large
+import pytest
 
+from mapa_streamlit.cli import get_bbox_geometry
+from mapa_streamlit.estimation import CostEstimate
+from mapa_streamlit.verification import (
+    exceeded_cost_limits,
+    get_default_params,
+    get_rejection_reason,
+    parse_params,
+    selected_bbox_in_boundary,
+)
 
-def test_selected_bbox_too_large() -> None:
-    geometry = {
-        "type": "Polygon",
-        "coordinates": [
-            [
-                [6.767578, 43.644026],
-                [6.767578, 47.754098],
-                [19.248047, 47.754098],
-                [19.248047, 43.644026],
-                [6.767578, 43.644026],
-            ]
-        ],
-    }
-    area = _get_area(geometry["coordinates"][0])
-    assert area == 51.3
-    assert selected_bbox_too_large(geometry=geometry, threshold=50) is True
-    assert selected_bbox_too_large(geometry=geometry, threshold=60) is False
 
-
-def test__get_area() -> None:
-    bbox = [[1, 1], [1, 3], [3, 1], [3, 3]]
-    area = _get_area(bbox=bbox)
-    assert area == 5.66
+def test_exceeded_cost_limits() -> None:
+    estimate = CostEstimate(
+        area=100.0, dem_pixels=1000, fetch_size=10 * 1024**2, peak_memory=20 * 1024**2, triangles=500, output_size=1
+    )
+    assert exceeded_cost_limits(estimate) == []
+    assert exceeded_cost_limits(estimate, max_dem_pixels=999) == ["elevation data points"]
+    assert exceeded_cost_limits(estimate, max_fetch_size=5) == ["data to download"]
+    assert exceeded_cost_limits(estimate, max_peak_memory=5, max_triangles=100) == ["memory", "triangles"]
 
 
 def test_selected_bbox_in_boundary() -> None:
@@ -60,3 +55,41 @@ def test_selected_bbox_in_boundary() -> None:
     invalid_bbox = valid_bbox.copy()
     invalid_bbox["coordinates"][0][0] = [50.0, 100.0]
     assert selected_bbox_in_boundary(invalid_bbox) is False
+
+
+def test_get_rejection_reason() -> None:
+    params = get_default_params()
+    geometry = get_bbox_geometry(7.0, 47.8, 7.3, 48.1)
+    assert get_rejection_reason(geometry, params, tile_workers=1) is None
+    assert "polygon" in get_rejection_reason({"type": "Point", "coordinates": [1, 2]}, params)
+    assert "polygon" in get_rejection_reason("foo", params)
+    for coordinates in ([[1, 2]], [[[1, 2], [3, 4], [5, 6]]], [[["a", 1], [2, 3], [4, 5], ["a", 1]]]):
+        malformed = {"type": "Polygon", "coordinates": coordinates}
+        assert get_rejection_reason(malformed, params) == "polygon has invalid coordinates"
+    infinite = get_bbox_geometry(7.0, 47.8, float("inf"), 48.1)
+    assert get_rejection_reason(infinite, params) == "polygon has invalid coordinates"
+    assert "output format" in get_rejection_reason(geometry, dict(params, output_format="OBJ"))
+    assert "compression" in get_rejection_reason(geometry, dict(params, compression="xz"))
+    assert "tiling" in get_rejection_reason(geometry, dict(params, split_area_in_tiles="0x2"))
+    # tilings and numeric parameters are restricted to the options of the app
+    assert "tiling" in get_rejection_reason(geometry, dict(params, split_area_in_tiles="100x100"))
+    assert get_rejection_reason(geometry, dict(params, model_size=200, z_offset=0), tile_workers=1) is None
+    assert "model_size" in get_rejection_reason(geometry, dict(params, model_size=100000))
+    assert "z_scale" in get_rejection_reason(geometry, dict(params, z_scale=-1.0))
+    assert "z_offset" in get_rejection_reason(geometry, dict(params, z_offset=21))
+    assert "tolerance" in get_rejection_reason(geometry, dict(params, tolerance=float("nan")))
+    assert "boundaries" in get_rejection_reason(get_bbox_geometry(179, 0, 181, 1), params)
+    assert "limits" in get_rejection_reason(get_bbox_geometry(0, 0, 40, 40), params)
+
+
+def test_parse_params() -> None:
+    defaults = get_default_params()
+    assert parse_params({"model_size": "150", "z_scale": "2", "foo": "baa", "tolerance": ""}, defaults) == dict(
+        defaults, model_size=150, z_scale=2.0
+    )
+    # integral floats are accepted for integer parameters
+    assert parse_params({"model_size": "100.0"}, defaults)["model_size"] == 100
+    assert parse_params({"model_size": 100.0}, defaults)["model_size"] == 100
+    for values in ({"model_size": "100.5"}, {"model_size": "inf"}, {"z_scale": "foo"}, {"z_offset": [1]}):
+        with pytest.raises(ValueError, match=f"invalid {next(iter(values))}"):
+            parse_params(values, defaults)
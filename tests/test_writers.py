@@ -0,0 +1,73 @@
+import zipfile
+from xml.etree import ElementTree
+
+import numpy as np
+import pytest
+from mapa.algorithm import ModelSize, compute_all_triangles
+
+from mapa_streamlit.writers import ArchiveWriter, OutputWriter, get_writer
+
+_NS = {"m": "http://schemas.microsoft.com/3dmanufacturing/core/2015/02"}
+
+
+def _get_triangles() -> np.ndarray:
+    array = np.random.default_rng(42).random((30, 40)) * 100
+    return compute_all_triangles(array, ModelSize(x=30, y=40), z_offset=2.0, z_scale=1.0, elevation_scale=0.1)
+
+
+def test_binary_stl_writer(tmp_path) -> None:
+    triangles = _get_triangles()
+    output = get_writer("STL").write(triangles, tmp_path / "foo")
+    assert output == tmp_path / "foo.stl"
+    assert output.stat().st_size == 84 + 50 * len(triangles)
+
+
+def test_three_mf_writer(tmp_path) -> None:
+    triangles = _get_triangles()
+    output = get_writer("3MF").write(triangles, tmp_path / "foo")
+    assert output == tmp_path / "foo.3mf"
+    with zipfile.ZipFile(output) as container:
+        assert sorted(container.namelist()) == ["3D/3dmodel.model", "[Content_Types].xml", "_rels/.rels"]
+        model = ElementTree.fromstring(container.read("3D/3dmodel.model"))
+    vertices = np.array([[float(v.get(c)) for c in "xyz"] for v in model.iterfind(".//m:vertex", _NS)])
+    indices = np.array([[int(t.get(v)) for v in ("v1", "v2", "v3")] for t in model.iterfind(".//m:triangle", _NS)])
+    # shared vertices are only stored once, degenerated triangles are dropped
+    assert len(vertices) < len(triangles)
+    assert len(indices) <= len(triangles)
+    assert all(len(set(t)) == 3 for t in indices)
+    assert vertices[indices].min() == pytest.approx(triangles.min(), abs=1e-4)
+    assert vertices[indices].max() == pytest.approx(triangles.max(), abs=1e-4)
+    assert output.stat().st_size < (84 + 50 * len(triangles)) / 4
+
+
+def test_get_writer__unknown_format() -> None:
+    with pytest.raises(ValueError, match="Unknown output format"):
+        get_writer("OBJ")
+    # writers need to implement `write`
+    with pytest.raises(TypeError):
+        OutputWriter()
+
+
+@pytest.mark.parametrize(
+    "output_format, compression, compress_type",
+    [
+        ("STL", "default", zipfile.ZIP_DEFLATED),
+        ("STL", "store", zipfile.ZIP_STORED),
+        ("3MF", "best", zipfile.ZIP_STORED),
+    ],
+)
+def test_archive_writer(tmp_path, output_format, compression, compress_type) -> None:
+    output = get_writer(output_format).write(_get_triangles(), tmp_path / "foo")
+    with ArchiveWriter(tmp_path / "foo.zip", output_format=output_format, compression=compression) as archive:
+        archive.add(output)
+    assert archive.duration > 0
+    with zipfile.ZipFile(tmp_path / "foo.zip") as zip_file:
+        (info,) = zip_file.infolist()
+    assert info.filename == output.name
+    assert info.compress_type == compress_type
+
+
+def test_archive_writer__unknown_compression(tmp_path) -> None:
+    with pytest.raises(ValueError, match="Unknown compression"):
+        ArchiveWriter(tmp_path / "foo.zip", compression="foo")
+    assert not (tmp_path / "foo.zip").is_file()